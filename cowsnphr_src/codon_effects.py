@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+from Bio.Data import CodonTable
+from Bio.Seq import Seq
+import numpy
+
+__author__ = 'adamkoziol'
+
+# Integer codes of the unambiguous nucleotides. Codons containing any other character (e.g. N, or a lowercase base)
+# are translated with Biopython instead
+BASE_CODES = numpy.full(256, 4, dtype=numpy.int64)
+for _code, _base in enumerate('TCAG'):
+    BASE_CODES[ord(_base)] = _code
+INVALID = 4
+
+# Amino acid residue of each of the 64 codons of the standard table (the table used by Seq.translate) indexed by
+# 16 * first base code + 4 * second base code + third base code
+_standard_table = CodonTable.unambiguous_dna_by_id[1]
+CODON_RESIDUES = numpy.array([_standard_table.forward_table.get(first + second + third, '*')
+                              for first in 'TCAG' for second in 'TCAG' for third in 'TCAG'], dtype='U1')
+
+# Effect classes of substitutions
+SYNONYMOUS = 'synonymous'
+NONSYNONYMOUS = 'nonsynonymous'
+STOP = 'stop'
+
+
+class CodonEffects(object):
+    """
+    Batch translation and classification of the codons affected by SNPs. Codons are handled as arrays, so that the
+    effects of every (strain, position) pair of a group are determined at once rather than with one Biopython object
+    per codon
+    """
+
+    @staticmethod
+    def substitute_codons(ref_codons, offsets, snp_seqs):
+        """
+        Create the codons of the strains by substituting the SNP sequences into the reference codons
+        :param ref_codons: type LIST: Reference codons containing each SNP
+        :param offsets: type NUMPY.ARRAY: Position of each SNP within its codon (0, 1, or 2)
+        :param snp_seqs: type LIST: Strand-specific sequence of each SNP
+        :return: alt_codons: NumPy array of the codons of the strains
+        """
+        alt_codons = numpy.array(ref_codons, dtype='S3').reshape(-1)
+        if not len(alt_codons):
+            return alt_codons.astype('U3')
+        bases = alt_codons.view(numpy.uint8).reshape(-1, 3).copy()
+        # Single base substitutions are written directly into the codon
+        single = numpy.array([len(snp_seq) == 1 for snp_seq in snp_seqs], dtype=bool)
+        rows = numpy.flatnonzero(single)
+        bases[rows, offsets[rows]] = numpy.frombuffer(''.join(snp_seqs[row] for row in rows).encode(),
+                                                      dtype=numpy.uint8)
+        alt_codons = bases.view('S3').reshape(-1).astype('U3')
+        # Insertions shift the bases following the SNP, so the codon is truncated to the first three bases
+        for row in numpy.flatnonzero(~single).tolist():
+            ref_codon = ref_codons[row]
+            alt_codons[row] = (ref_codon[:offsets[row]] + snp_seqs[row] + ref_codon[offsets[row] + 1:])[:3]
+        return alt_codons
+
+    @staticmethod
+    def translate_codons(codons, codon_cache=None):
+        """
+        Translate an array of codons with the standard codon table
+        :param codons: type iterable: Codons to translate
+        :param codon_cache: type DICT: Optional dictionary of codon: amino acid residue for codons with ambiguous bases.
+        Updated in place
+        :return: residues: NumPy array of the amino acid residue of each codon
+        """
+        codons = numpy.asarray(codons, dtype='U3').reshape(-1)
+        residues = numpy.empty(len(codons), dtype='U1')
+        if not len(codons):
+            return residues
+        codes = BASE_CODES[numpy.frombuffer(codons.astype('S3').tobytes(), dtype=numpy.uint8).reshape(-1, 3)]
+        # Short codons are padded with null bytes, which are invalid
+        valid = (codes != INVALID).all(axis=1)
+        residues[valid] = CODON_RESIDUES[codes[valid, 0] * 16 + codes[valid, 1] * 4 + codes[valid, 2]]
+        codon_cache = codon_cache if codon_cache is not None else dict()
+        for row in numpy.flatnonzero(~valid).tolist():
+            codon = str(codons[row])
+            if codon not in codon_cache:
+                codon_cache[codon] = str(Seq(codon).translate())
+            residues[row] = codon_cache[codon]
+        return residues
+
+    @staticmethod
+    def classify_effects(ref_residues, alt_residues):
+        """
+        Classify the effect of each substitution. Substitutions that gain or lose a stop codon are 'stop', those that
+        change the amino acid residue are 'nonsynonymous', and the remainder are 'synonymous'
+        :param ref_residues: type NUMPY.ARRAY: Amino acid residues of the reference codons
+        :param alt_residues: type NUMPY.ARRAY: Amino acid residues of the codons of the strains
+        :return: effects: NumPy array of the effect class of each substitution
+        """
+        ref_residues = numpy.asarray(ref_residues, dtype='U1')
+        alt_residues = numpy.asarray(alt_residues, dtype='U1')
+        changed = ref_residues != alt_residues
+        effects = numpy.where(changed, NONSYNONYMOUS, SYNONYMOUS).astype('U13')
+        effects[changed & ((ref_residues == '*') | (alt_residues == '*'))] = STOP
+        return effects
+
+    @staticmethod
+    def codon_effects(ref_codons, offsets, snp_seqs, codon_cache=None):
+        """
+        Determine the codons, amino acid residues, and effect classes of a batch of SNPs
+        :param ref_codons: type LIST: Reference codons containing each SNP
+        :param offsets: type iterable: Position of each SNP within its codon (0, 1, or 2)
+        :param snp_seqs: type LIST: Strand-specific sequence of each SNP
+        :param codon_cache: type DICT: Optional dictionary of codon: amino acid residue for codons with ambiguous bases
+        :return: Dictionary of 'ref_codon', 'alt_codon', 'ref_aa', 'alt_aa', and 'effect': NumPy array
+        """
+        offsets = numpy.asarray(offsets, dtype=numpy.int64).reshape(-1)
+        alt_codons = CodonEffects.substitute_codons(ref_codons=ref_codons,
+                                                    offsets=offsets,
+                                                    snp_seqs=snp_seqs)
+        ref_residues = CodonEffects.translate_codons(codons=ref_codons,
+                                                     codon_cache=codon_cache)
+        alt_residues = CodonEffects.translate_codons(codons=alt_codons,
+                                                     codon_cache=codon_cache)
+        return {
+            'ref_codon': numpy.array(ref_codons, dtype='U3').reshape(-1),
+            'alt_codon': alt_codons,
+            'ref_aa': ref_residues,
+            'alt_aa': alt_residues,
+            'effect': CodonEffects.classify_effects(ref_residues=ref_residues,
+                                                    alt_residues=alt_residues)
+        }
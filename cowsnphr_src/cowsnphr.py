@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 from olctools.accessoryFunctions.accessoryFunctions import SetupLogging
-from cowsnphr_src.vcf_methods import VCFMethods
+from cowsnphr_src.vcf_methods import DeepVariantCaller, PileupCaller, VCFMethods
 from cowsnphr_src.tree_methods import TreeMethods
+from cowsnphr_src.task_graph import TaskGraph
 from argparse import ArgumentParser
 from pathlib import Path
 import multiprocessing
@@ -17,8 +18,22 @@ class COWSNPhR(object):
 
     def main(self):
         self.fastq_manipulation()
-        self.reference_mapping()
-        self.snp_calling()
+        self.ref_file()
+        graph = TaskGraph(state_file=self.task_state_file)
+        self.reference_mapping(graph=graph)
+        self.snp_calling(graph=graph)
+        if self.dry_run:
+            stale_tasks = graph.run(threads=self.threads,
+                                    dry_run=True)
+            logging.info('Tasks to run: \n{tasks}'.format(tasks='\n'.join(stale_tasks) if stale_tasks else 'None'))
+            logging.info('The SNP loading, phylogenetic tree, annotation, and report stages are always run')
+            return
+        self.run_tasks(graph=graph)
+        if self.add_samples:
+            self.load_previous_analysis()
+            if self.previous_strains and not self.new_strains:
+                logging.info('No new samples to add to the analysis in {seq_path}'.format(seq_path=self.seq_path))
+                return
         self.load_snps()
         self.phylogenetic_trees()
         self.annotate_snps()
@@ -28,7 +43,7 @@ class COWSNPhR(object):
     def fastq_manipulation(self):
         """
         Determine the number of strains to process. Create strain-specific working directories with relative symlinks
-        to FASTQ files
+        to FASTQ files. The directories and symlinks are not created in a dry run
         """
         logging.info('Locating FASTQ files, creating strain-specific working directories and symlinks to files')
         fastq_files = VCFMethods.file_list(path=self.seq_path)
@@ -38,67 +53,74 @@ class COWSNPhR(object):
         if self.debug:
             logging.info('Strain names: \n{strain_names}'.format(strain_names='\n'.join(sorted(self.strain_name_dict))))
         self.strain_fastq_dict = VCFMethods.file_link(strain_folder_dict=strain_folder_dict,
-                                                      strain_name_dict=self.strain_name_dict)
+                                                      strain_name_dict=self.strain_name_dict,
+                                                      link=not self.dry_run)
         if self.debug:
             logging.info(
                 'Strain-specific symlinked FASTQ files: \n{symlinks}'.format(
                     symlinks='\n'.join(['{strain_name}: {fastq_files}'.format(strain_name=sn, fastq_files=ff)
                                         for sn, ff in self.strain_fastq_dict.items()])))
 
-    def reference_mapping(self):
+    def reference_mapping(self, graph):
         """
-        Perform reference mapping with bowtie2
+        Add the reference indexing, and the strain-specific bowtie2 reference mapping, BAM indexing, unmapped read
+        extraction, SKESA assembly of unmapped reads, and quast tasks to the task graph
+        :param graph: TaskGraph object
+        """
+        base_name = os.path.splitext(os.path.abspath(self.ref_fasta))[0]
+        graph.add_task(name='reference',
+                       function=self.index_reference,
+                       inputs=[self.ref_fasta],
+                       outputs=[base_name + '.1.bt2', self.ref_fasta + '.fai'],
+                       restore=self.index_reference)
+        for strain_name, fastq_files in self.strain_fastq_dict.items():
+            VCFMethods.add_read_tasks(graph=graph,
+                                      strain_name=strain_name,
+                                      fastq_files=fastq_files,
+                                      strain_name_dict=self.strain_name_dict,
+                                      strain_mapper_index_dict=self.strain_mapper_index_dict,
+                                      threads=self.strain_threads,
+                                      logfile=self.logfile,
+                                      reference_mapper='bowtie2',
+                                      dependencies=['reference'],
+                                      inputs=[self.ref_fasta])
+        graph.add_task(name='assembly_report',
+                       function=lambda: self.assembly_report(graph=graph),
+                       dependencies=['quast:{sn}'.format(sn=strain_name) for strain_name in self.strain_fastq_dict])
+
+    def index_reference(self):
+        """
+        Index the reference genome with bowtie2 build and samtools faidx
         """
-        logging.info('Extracting paths to reference genomes')
-        self.ref_file()
         logging.info('Running bowtie2 build')
-        strain_bowtie2_index_dict, self.strain_reference_abs_path_dict, self.strain_reference_dep_path_dict = \
+        strain_bowtie2_index_dict, strain_reference_abs_path_dict, strain_reference_dep_path_dict = \
             VCFMethods.index_ref_genome(reference_link_path_dict=self.reference_strain_dict,
                                         dependency_path=self.ref_path,
                                         logfile=self.logfile,
                                         reference_mapper='bowtie2')
+        # Update the dictionaries in place, as they are shared with the strain-specific tasks
+        self.strain_mapper_index_dict.update(strain_bowtie2_index_dict)
+        self.strain_reference_abs_path_dict.update(strain_reference_abs_path_dict)
+        self.strain_reference_dep_path_dict.update(strain_reference_dep_path_dict)
         logging.info('Creating .fai index file of {ref}'.format(ref=self.ref_strain))
         VCFMethods.faidx_ref_genome(reference_link_path_dict=self.reference_strain_dict,
                                     dependency_path=self.ref_path,
                                     logfile=self.logfile)
-        logging.info('Running bowtie2 reference mapping')
-        self.strain_sorted_bam_dict = VCFMethods.map_ref_genome(
-            strain_fastq_dict=self.strain_fastq_dict,
-            strain_name_dict=self.strain_name_dict,
-            strain_mapper_index_dict=strain_bowtie2_index_dict,
-            threads=self.threads,
-            logfile=self.logfile,
-            reference_mapper='bowtie2')
+
+    def assembly_report(self, graph):
+        """
+        Create the combined quast report of the SKESA assemblies of the unmapped reads
+        :param graph: TaskGraph object
+        """
+        self.strain_sorted_bam_dict, strain_unmapped_reads_dict, strain_skesa_output_fasta_dict, quast_report_dict = \
+            VCFMethods.read_task_results(graph=graph,
+                                         strain_names=self.strain_fastq_dict)
         logging.debug('Sorted BAM files: \n{files}'.format(
             files='\n'.join(['{strain_name}: {bam_file}'.format(strain_name=sn, bam_file=bf)
                              for sn, bf in self.strain_sorted_bam_dict.items()])))
-        logging.info('Indexing sorted BAM files')
-        VCFMethods.samtools_index(strain_sorted_bam_dict=self.strain_sorted_bam_dict,
-                                  strain_name_dict=self.strain_name_dict,
-                                  threads=self.threads,
-                                  logfile=self.logfile)
-        logging.info('Extracting unmapped reads')
-        strain_unmapped_reads_dict = VCFMethods.extract_unmapped_reads(
-            strain_sorted_bam_dict=self.strain_sorted_bam_dict,
-            strain_name_dict=self.strain_name_dict,
-            threads=self.threads,
-            logfile=self.logfile)
-        logging.info('Attempting to assemble unmapped reads with SKESA')
-        strain_skesa_output_fasta_dict = VCFMethods.assemble_unmapped_reads(
-            strain_unmapped_reads_dict=strain_unmapped_reads_dict,
-            strain_name_dict=self.strain_name_dict,
-            threads=self.threads,
-            logfile=self.logfile)
         logging.debug('SKESA assemblies: \n{files}'.format(
             files='\n'.join(['{strain_name}: {assembly}'.format(strain_name=sn, assembly=af)
                              for sn, af in strain_skesa_output_fasta_dict.items()])))
-        logging.info('Running Quast on SKESA assemblies')
-        quast_report_dict = VCFMethods \
-            .quast(strain_skesa_output_fasta_dict=strain_skesa_output_fasta_dict,
-                   strain_unmapped_reads_dict=strain_unmapped_reads_dict,
-                   strain_sorted_bam_dict=self.strain_sorted_bam_dict,
-                   threads=self.threads,
-                   logfile=self.logfile)
         VCFMethods.parse_quast_report(quast_report_dict=quast_report_dict,
                                       summary_path=self.summary_path)
 
@@ -113,54 +135,96 @@ class COWSNPhR(object):
             self.reference_strain_dict[strain_name] = self.ref_fasta
             self.strain_consolidated_ref_dict[strain_name] = self.ref_strain
             self.reference_strain_dict[self.ref_strain] = self.ref_fasta
+        # Share the threads between the strains that are processed concurrently
+        concurrent_strains, self.strain_threads = \
+            VCFMethods.allocate_strain_threads(num_strains=len(self.strain_fastq_dict),
+                                               threads=self.threads)
+        # Allow each concurrent strain, plus the strains in call_variants and postprocess_variants, to be queued
+        self.variant_queue_depth = concurrent_strains + 2
 
-    def snp_calling(self):
+    def snp_calling(self, graph):
         """
-        Prep files for SNP calling. Use deepvariant to call SNPs. Parse the outputs from deepvariant
+        Add the strain-specific variant calling tasks of the selected backend, which also copy the gVCF files to a
+        common folder, to the task graph. With deepvariant, the make_examples, call_variants, and postprocess_variants
+        phases of different strains are pipelined, e.g. one strain is in call_variants while the next is in
+        make_examples. The queue of strains in variant calling is bounded, so that at most variant_queue_depth strains
+        are pending
+        :param graph: TaskGraph object
         """
-        logging.info('Preparing files for SNP calling with deepvariant make_examples')
-        strain_examples_dict, strain_variant_path_dict, strain_gvcf_tfrecords_dict = \
-            VCFMethods.deepvariant_make_examples(strain_sorted_bam_dict=self.strain_sorted_bam_dict,
-                                                 strain_name_dict=self.strain_name_dict,
-                                                 strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
-                                                 vcf_path=os.path.join(self.seq_path, 'vcf_files'),
-                                                 home=self.home,
-                                                 logfile=self.logfile,
-                                                 threads=self.threads,
-                                                 working_path=self.working_path,
-                                                 deepvariant_version=self.deepvariant_version)
-        logging.info('Calling variants with deepvariant call_variants')
-        strain_call_variants_dict = \
-            VCFMethods.deepvariant_call_variants(strain_variant_path_dict=strain_variant_path_dict,
-                                                 strain_name_dict=self.strain_name_dict,
-                                                 vcf_path=os.path.join(self.seq_path, 'vcf_files'),
-                                                 home=self.home,
-                                                 threads=self.threads,
-                                                 logfile=self.logfile,
-                                                 working_path=self.working_path,
-                                                 deepvariant_version=self.deepvariant_version,
-                                                 variant_caller='deepvariant')
-        logging.info('Creating VCF files with deepvariant postprocess_variants')
-        self.strain_vcf_dict = \
-            VCFMethods.deepvariant_postprocess_variants_multiprocessing(
-                strain_call_variants_dict=strain_call_variants_dict,
-                strain_variant_path_dict=strain_variant_path_dict,
-                strain_name_dict=self.strain_name_dict,
-                strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
-                strain_gvcf_tfrecords_dict=strain_gvcf_tfrecords_dict,
-                vcf_path=os.path.join(self.seq_path, 'vcf_files'),
-                home=self.home,
-                logfile=self.logfile,
-                deepvariant_version=self.deepvariant_version,
-                threads=self.threads)
-        logging.info('Copying gVCF files to common folder')
-        VCFMethods.copy_vcf_files(strain_vcf_dict=self.strain_vcf_dict,
-                                  vcf_path=os.path.join(self.seq_path, 'vcf_files'))
+        strain_names = list(self.strain_fastq_dict)
+        for index, strain_name in enumerate(strain_names):
+            # Variant calling of a strain is not started until an earlier strain has left the queue
+            after = [self.variant_caller.final_task(strain_name=strain_names[index - self.variant_queue_depth])] \
+                if index >= self.variant_queue_depth else list()
+            self.variant_caller.add_tasks(graph=graph,
+                                          strain_name=strain_name,
+                                          strain_name_dict=self.strain_name_dict,
+                                          strain_reference_abs_path_dict=self.strain_reference_abs_path_dict,
+                                          vcf_path=os.path.join(self.seq_path, 'vcf_files'),
+                                          threads=self.strain_threads,
+                                          logfile=self.logfile,
+                                          dependencies=['reference'],
+                                          inputs=[self.ref_fasta],
+                                          after=after,
+                                          shards=self.threads)
+
+    def run_tasks(self, graph):
+        """
+        Run the out of date tasks in the task graph. Tasks are run concurrently once their dependencies are complete,
+        provided that they fit in the thread and memory budgets.
+        The content hashes of the inputs and outputs of completed tasks are recorded, so the analysis can be restarted
+        without repeating completed tasks. The timings, overlap, and thread utilisation of the phases are appended to
+        the logfile basename + _task_times.txt, and the durations of the deepvariant jobs to _deepvariant_times.txt
+        :param graph: TaskGraph object
+        """
+        logging.info('Running reference mapping, BAM indexing, unmapped read extraction, SKESA assembly of unmapped '
+                     'reads, quast, and {variant_caller}'.format(variant_caller=self.variant_caller_name))
+        # Limit the estimated memory of the concurrent tasks to the supplied maximum, or to the available memory
+        max_memory = int(float(self.max_mem) * 1024 ** 3) if self.max_mem else VCFMethods.available_memory()
+        logging.debug('Memory available to the tasks: {memory:.1f} GB'.format(memory=max_memory / 1024 ** 3))
+        try:
+            stale_tasks = graph.run(threads=self.threads,
+                                    max_memory=max_memory)
+        finally:
+            self.variant_caller.finish(logfile=self.logfile)
+        logging.debug('Completed tasks: \n{tasks}'.format(tasks='\n'.join(stale_tasks)))
+        if stale_tasks:
+            utilisation = graph.write_phase_report(report_file='{logfile}_task_times.txt'.format(logfile=self.logfile))
+            logging.info('Thread utilisation of the tasks: {utilisation:.1%}'.format(utilisation=utilisation))
+        for strain_name in self.strain_fastq_dict:
+            self.strain_vcf_dict.update(graph.results[self.variant_caller.final_task(strain_name=strain_name)])
+
+    def load_previous_analysis(self):
+        """
+        Load the saved results of the previous analysis in the sequence path. Include any gVCF files placed in the
+        vcf_files folder that were not created from the supplied FASTQ files, and determine which strains are new to
+        the analysis
+        """
+        vcf_path = os.path.join(self.seq_path, 'vcf_files')
+        vcf_files = sorted(glob(os.path.join(vcf_path, '*.gvcf.gz')))
+        for strain_name, vcf_file in TreeMethods.strain_list(vcf_files=vcf_files).items():
+            if strain_name not in self.strain_vcf_dict:
+                logging.info('Adding supplied gVCF file {vcf_file}'.format(vcf_file=vcf_file))
+                self.strain_vcf_dict[strain_name] = vcf_file
+                self.reference_strain_dict[strain_name] = self.ref_fasta
+                self.strain_consolidated_ref_dict[strain_name] = self.ref_strain
+        if os.path.isfile(self.state_file):
+            logging.info('Loading results of the previous analysis from {state_file}'
+                         .format(state_file=self.state_file))
+            self.previous_strains, self.previous_group_positions, self.previous_snp_sequence, \
+                self.previous_snp_matrix = TreeMethods.load_analysis_state(state_file=self.state_file)
+        else:
+            logging.warning('Cannot find the results of a previous analysis in {state_file}. All samples will be '
+                            'processed'.format(state_file=self.state_file))
+        self.new_strains = set(self.strain_vcf_dict) - self.previous_strains
+        logging.info('New samples: \n{strain_names}'.format(strain_names='\n'.join(sorted(self.new_strains))))
 
     def load_snps(self):
         logging.info('Parsing gVCF files')
         self.strain_parsed_vcf_dict, self.strain_best_ref_dict, self.strain_best_ref_set_dict = \
-            TreeMethods.load_vcf(strain_vcf_dict=self.strain_vcf_dict)
+            TreeMethods.load_vcf(strain_vcf_dict=self.strain_vcf_dict,
+                                 threads=self.threads,
+                                 cache=True)
         if self.debug:
             logging.info('Parsed gVCF summaries:')
             pass_dict, insertion_dict, deletion_dict = \
@@ -190,7 +254,8 @@ class COWSNPhR(object):
                             print(ref_chrom, len(pos_set))
         logging.info("Performing SNP density filtering")
         filtered_group_positions = TreeMethods.density_filter_snps(group_positions_set=group_positions_set,
-                                                                   threshold=0)
+                                                                   threshold=0,
+                                                                   threads=self.threads)
         if self.debug:
             logging.info('Number of SNPs per contig following density filtering:')
             for species_code, group_dict in filtered_group_positions.items():
@@ -224,15 +289,37 @@ class COWSNPhR(object):
                     for ref_chrom, pos_set in ref_dict.items():
                         if pos_set:
                             print(ref_chrom, len(pos_set), sorted(list(pos_set)))
-        logging.info('Loading SNP sequences')
-        self.group_strain_snp_sequence, self.species_group_best_ref = \
-            TreeMethods.load_snp_sequence(strain_parsed_vcf_dict=self.strain_parsed_vcf_dict,
-                                          strain_consolidated_ref_dict=self.strain_consolidated_ref_dict,
-                                          group_positions_set=filtered_masked_group_positions,
-                                          strain_groups=self.strain_groups,
-                                          strain_species_dict=self.strain_species_dict,
-                                          consolidated_ref_snp_positions=consolidated_ref_snp_positions,
-                                          iupac=self.iupac)
+        self.filtered_masked_group_positions = filtered_masked_group_positions
+        if self.previous_snp_sequence:
+            logging.info('Loading SNP sequences of new samples and new SNP positions')
+            self.group_strain_snp_sequence, self.species_group_best_ref = \
+                TreeMethods.update_snp_sequence(previous_snp_sequence=self.previous_snp_sequence,
+                                                previous_group_positions=self.previous_group_positions,
+                                                strain_parsed_vcf_dict=self.strain_parsed_vcf_dict,
+                                                strain_consolidated_ref_dict=self.strain_consolidated_ref_dict,
+                                                group_positions_set=filtered_masked_group_positions,
+                                                strain_groups=self.strain_groups,
+                                                strain_species_dict=self.strain_species_dict,
+                                                consolidated_ref_snp_positions=consolidated_ref_snp_positions,
+                                                iupac=self.iupac,
+                                                threads=self.threads)
+            self.changed_groups = TreeMethods.changed_groups(previous_snp_sequence=self.previous_snp_sequence,
+                                                             group_strain_snp_sequence=self.group_strain_snp_sequence)
+            logging.info('Groups with changes: \n{groups}'.format(
+                groups='\n'.join(sorted('{species}: {group}'.format(species=species, group=group)
+                                        for species, group_set in self.changed_groups.items()
+                                        for group in group_set))))
+        else:
+            logging.info('Loading SNP sequences')
+            self.group_strain_snp_sequence, self.species_group_best_ref = \
+                TreeMethods.load_snp_sequence(strain_parsed_vcf_dict=self.strain_parsed_vcf_dict,
+                                              strain_consolidated_ref_dict=self.strain_consolidated_ref_dict,
+                                              group_positions_set=filtered_masked_group_positions,
+                                              strain_groups=self.strain_groups,
+                                              strain_species_dict=self.strain_species_dict,
+                                              consolidated_ref_snp_positions=consolidated_ref_snp_positions,
+                                              iupac=self.iupac,
+                                              threads=self.threads)
         logging.info('Removing identical SNP positions from group')
         ident_group_positions = \
             TreeMethods.find_identical_calls(group_strain_snp_sequence=self.group_strain_snp_sequence)
@@ -245,7 +332,8 @@ class COWSNPhR(object):
                                           species_group_best_ref=self.species_group_best_ref,
                                           reference_strain_dict=self.reference_strain_dict,
                                           ident_group_positions=ident_group_positions,
-                                          nested=False)
+                                          nested=False,
+                                          changed_groups=self.changed_groups)
         if self.debug:
             logging.info('Multi-FASTA alignment output:')
             for species_code, group_dict in self.group_fasta_dict.items():
@@ -263,7 +351,8 @@ class COWSNPhR(object):
                                 mask_pos_dict=mask_pos_dict,
                                 supplied_mask_pos_dict=supplied_mask_pos_dict,
                                 ident_group_positions=ident_group_positions,
-                                summary_path=self.summary_path)
+                                summary_path=self.summary_path,
+                                changed_groups=self.changed_groups)
 
     def phylogenetic_trees(self):
         """
@@ -274,7 +363,8 @@ class COWSNPhR(object):
             .run_fasttree(group_fasta_dict=self.group_fasta_dict,
                           strain_consolidated_ref_dict=self.strain_consolidated_ref_dict,
                           strain_groups=self.strain_groups,
-                          logfile=self.logfile)
+                          logfile=self.logfile,
+                          threads=self.threads)
         logging.info('Parsing strain order from phylogenetic trees')
         self.species_group_order_dict = TreeMethods.parse_tree_order(species_group_trees=species_group_trees)
         logging.info('Copying phylogenetic trees to {tree_path}'.format(tree_path=self.tree_path))
@@ -311,6 +401,17 @@ class COWSNPhR(object):
             for ref_chrom, pos_dict in species_group_snp_num_dict['species']['group'].items():
                 if pos_dict:
                     print(ref_chrom, pos_dict)
+        logging.info('Determining codon effects of SNPs')
+        self.species_group_codon_effects = \
+            TreeMethods.determine_codon_effects(
+                group_strain_snp_sequence=self.group_strain_snp_sequence,
+                species_group_best_ref=self.species_group_best_ref,
+                strain_parsed_vcf_dict=self.strain_parsed_vcf_dict,
+                species_group_annotated_snps_dict=self.species_group_annotated_snps_dict,
+                reference_strain_dict=self.reference_strain_dict,
+                species_group_snp_num_dict=species_group_snp_num_dict,
+                iupac=self.iupac,
+                threads=self.threads)
         logging.info('Determining amino acid sequence at SNP locations')
         self.translated_snp_residue_dict, self.ref_translated_snp_residue_dict = \
             TreeMethods.determine_aa_sequence(
@@ -320,11 +421,30 @@ class COWSNPhR(object):
                 species_group_annotated_snps_dict=self.species_group_annotated_snps_dict,
                 reference_strain_dict=self.reference_strain_dict,
                 species_group_snp_num_dict=species_group_snp_num_dict,
-                iupac=self.iupac)
-        logging.info('Creating SNP matrix')
-        TreeMethods.create_snp_matrix(species_group_best_ref=self.species_group_best_ref,
-                                      group_strain_snp_sequence=self.group_strain_snp_sequence,
-                                      matrix_path=self.matrix_path)
+                iupac=self.iupac,
+                species_group_codon_effects=self.species_group_codon_effects)
+        if self.previous_snp_matrix:
+            logging.info('Updating SNP matrix')
+            snp_matrix = TreeMethods.update_snp_matrix(previous_snp_matrix=self.previous_snp_matrix,
+                                                       previous_snp_sequence=self.previous_snp_sequence,
+                                                       species_group_best_ref=self.species_group_best_ref,
+                                                       group_strain_snp_sequence=self.group_strain_snp_sequence,
+                                                       matrix_path=self.matrix_path)
+        else:
+            logging.info('Creating SNP matrix')
+            # Alignments larger than the memory limit are stored on disk while the pairwise SNPs are counted
+            max_memory = int(float(self.max_mem) * 1024 ** 3) if self.max_mem else None
+            snp_matrix = TreeMethods.create_snp_matrix(species_group_best_ref=self.species_group_best_ref,
+                                                       group_strain_snp_sequence=self.group_strain_snp_sequence,
+                                                       matrix_path=self.matrix_path,
+                                                       threads=self.threads,
+                                                       max_memory=max_memory)
+        logging.info('Saving results of the analysis to {state_file}'.format(state_file=self.state_file))
+        TreeMethods.save_analysis_state(state_file=self.state_file,
+                                        strain_names=list(self.strain_parsed_vcf_dict),
+                                        group_positions_set=self.filtered_masked_group_positions,
+                                        group_strain_snp_sequence=self.group_strain_snp_sequence,
+                                        snp_matrix=snp_matrix)
         logging.info('Ranking SNPs based on prevalence')
         species_group_snp_rank, self.species_group_num_snps = \
             TreeMethods.rank_snps(species_group_snp_num_dict=species_group_snp_num_dict)
@@ -350,29 +470,23 @@ class COWSNPhR(object):
         Create the summary report of the analyses
         """
         logging.info('Creating summary tables')
-        TreeMethods.create_summary_table(species_group_sorted_snps=self.species_group_sorted_snps,
-                                         species_group_order_dict=self.species_group_order_dict,
-                                         species_group_best_ref=self.species_group_best_ref,
-                                         group_strain_snp_sequence=self.group_strain_snp_sequence,
-                                         species_group_annotated_snps_dict=self.species_group_annotated_snps_dict,
-                                         translated_snp_residue_dict=self.translated_snp_residue_dict,
-                                         ref_translated_snp_residue_dict=self.ref_translated_snp_residue_dict,
-                                         species_group_num_snps=self.species_group_num_snps,
-                                         summary_path=self.summary_path,
-                                         molecule='nt')
-        # Amino acid summary table
-        TreeMethods.create_summary_table(species_group_sorted_snps=self.species_group_sorted_snps,
-                                         species_group_order_dict=self.species_group_order_dict,
-                                         species_group_best_ref=self.species_group_best_ref,
-                                         group_strain_snp_sequence=self.group_strain_snp_sequence,
-                                         species_group_annotated_snps_dict=self.species_group_annotated_snps_dict,
-                                         translated_snp_residue_dict=self.translated_snp_residue_dict,
-                                         ref_translated_snp_residue_dict=self.ref_translated_snp_residue_dict,
-                                         species_group_num_snps=self.species_group_num_snps,
-                                         summary_path=self.summary_path,
-                                         molecule='aa')
+        TreeMethods.write_codon_effects(species_group_codon_effects=self.species_group_codon_effects,
+                                        summary_path=self.summary_path)
+        # Create the nucleotide and amino acid summary tables
+        TreeMethods.create_summary_tables(species_group_sorted_snps=self.species_group_sorted_snps,
+                                          species_group_order_dict=self.species_group_order_dict,
+                                          species_group_best_ref=self.species_group_best_ref,
+                                          group_strain_snp_sequence=self.group_strain_snp_sequence,
+                                          species_group_annotated_snps_dict=self.species_group_annotated_snps_dict,
+                                          translated_snp_residue_dict=self.translated_snp_residue_dict,
+                                          ref_translated_snp_residue_dict=self.ref_translated_snp_residue_dict,
+                                          species_group_num_snps=self.species_group_num_snps,
+                                          summary_path=self.summary_path,
+                                          threads=self.threads,
+                                          changed_groups=self.changed_groups)
 
-    def __init__(self, seq_path, ref_path, threads, working_path, maskfile, gpu, debug):
+    def __init__(self, seq_path, ref_path, threads, working_path, maskfile, gpu, debug, add_samples=False,
+                 dry_run=False, variant_caller='deepvariant', max_mem=None):
         # Determine the path in which the sequence files are located. Allow for ~ expansion
         if seq_path.startswith('~'):
             self.seq_path = os.path.abspath(os.path.expanduser(os.path.join(seq_path)))
@@ -428,6 +542,14 @@ class COWSNPhR(object):
         self.summary_path = os.path.join(self.seq_path, 'summary_tables')
         self.matrix_path = os.path.join(self.seq_path, 'snv_matrix')
         self.logfile = os.path.join(self.seq_path, 'log')
+        # Results of the analysis required to add samples to it later
+        self.add_samples = add_samples
+        self.state_file = os.path.join(self.seq_path, 'analysis_state.json.gz')
+        # Content hashes of the inputs and outputs of the completed tasks, used to restart interrupted analyses
+        self.task_state_file = os.path.join(self.seq_path, 'task_state.json')
+        self.dry_run = dry_run
+        # Maximum memory (GB) used by the concurrent tasks. The available memory is used if it is not supplied
+        self.max_mem = max_mem
         # Dictionary of degenerate IUPAC codes
         self.iupac = {
             'R': ['A', 'G'],
@@ -447,6 +569,9 @@ class COWSNPhR(object):
         self.ref_strain = str()
         self.strain_name_dict = dict()
         self.strain_fastq_dict = dict()
+        self.strain_threads = 1
+        self.variant_queue_depth = 3
+        self.strain_mapper_index_dict = dict()
         self.strain_consolidated_ref_dict = dict()
         self.strain_reference_abs_path_dict = dict()
         self.strain_reference_dep_path_dict = dict()
@@ -466,13 +591,31 @@ class COWSNPhR(object):
         self.species_group_annotated_snps_dict = dict()
         self.translated_snp_residue_dict = dict()
         self.ref_translated_snp_residue_dict = dict()
+        self.species_group_codon_effects = dict()
         self.full_best_ref_gbk_dict = dict()
         self.species_group_num_snps = dict()
         self.species_group_sorted_snps = dict()
+        self.filtered_masked_group_positions = dict()
+        self.previous_strains = set()
+        self.new_strains = set()
+        self.previous_group_positions = dict()
+        self.previous_snp_sequence = dict()
+        self.previous_snp_matrix = dict()
+        # Dictionary of species code: set of groups changed since the previous analysis. None unless samples are added
+        self.changed_groups = None
         if gpu:
             self.deepvariant_version = '1.0.0-gpu'
         else:
             self.deepvariant_version = '1.0.0'
+        # Variant calling backend: deepvariant in Docker, or the in-process samtools mpileup caller
+        self.variant_caller_name = variant_caller
+        if variant_caller == 'pileup':
+            self.variant_caller = PileupCaller()
+        else:
+            self.variant_caller = DeepVariantCaller(home=self.home,
+                                                    deepvariant_version=self.deepvariant_version,
+                                                    logfile=self.logfile,
+                                                    working_path=self.working_path)
 
 
 def get_version():
@@ -496,6 +639,7 @@ def main():
                         required=True,
                         help='Provide the location of the folder containing the reference FASTA and GenBank files')
     parser.add_argument('-t', '--threads',
+                        type=int,
                         default=multiprocessing.cpu_count() - 1,
                         help='Number of threads. Default is the number of cores in the system - 1')
     parser.add_argument('-d', '--debug',
@@ -520,6 +664,33 @@ def main():
                         help='Enable this flag if your workstation has a GPU compatible with deepvariant. '
                              'The program will use the deepvariant-gpu Docker image instead of the regular deepvariant '
                              'image. Note that since I do not have a setup with a GPU, this is COMPLETELY UNTESTED!')
+    parser.add_argument('-a', '--add_samples',
+                        action='store_true',
+                        help='Add new samples to the previous analysis in the sequence path. The SNP sequences and '
+                             'SNV matrix of the samples already in the analysis are reused, and only updated at the '
+                             'SNP positions introduced by the new samples. The alignments, trees, and reports of the '
+                             'groups without changes are kept. Supply the FASTQ files of the new samples in the '
+                             'sequence path, or place their gVCF files in the vcf_files folder')
+    parser.add_argument('-D', '--dry_run',
+                        action='store_true',
+                        help='List the reference mapping, assembly, and variant calling tasks that are not up to date, '
+                             'and would be run, without running them. Tasks are up to date if their outputs exist, '
+                             'and the contents of their inputs and outputs are unchanged since they were completed. '
+                             'Only these tasks are resumed: the SNP, SNV matrix, phylogenetic tree, annotation, and '
+                             'report stages that follow are always run in full')
+    parser.add_argument('-c', '--variant_caller',
+                        choices=['deepvariant', 'pileup'],
+                        default='deepvariant',
+                        help='Variant calling backend. deepvariant (default) runs deepvariant in Docker. pileup is a '
+                             'fast, container-free caller that parses samtools mpileup output (samtools must be '
+                             'installed), and calls single base substitutions only. It is intended for the rapid '
+                             'reanalysis of closely related strains')
+    parser.add_argument('-M', '--max_mem',
+                        type=float,
+                        help='Maximum memory (GB) to be used by concurrent jobs. The memory of each deepvariant '
+                             'postprocess_variants job is estimated from the size of its inputs, and jobs are only '
+                             'started while their estimates fit. Default is the memory available at the start of the '
+                             'analyses. When supplied, SNP matrix alignments larger than this are stored on disk')
     args = parser.parse_args()
     cowsnphr = COWSNPhR(seq_path=args.sequence_path,
                         ref_path=args.reference_path,
@@ -527,7 +698,11 @@ def main():
                         working_path=args.working_path,
                         maskfile=args.maskfile,
                         gpu=args.gpu,
-                        debug=args.debug)
+                        debug=args.debug,
+                        add_samples=args.add_samples,
+                        dry_run=args.dry_run,
+                        variant_caller=args.variant_caller,
+                        max_mem=args.max_mem)
     cowsnphr.main()
     logging.info('Analyses complete!')
 
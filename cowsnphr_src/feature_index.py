@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+from Bio.SeqFeature import AfterPosition, BeforePosition, CompoundLocation, ExactPosition, FeatureLocation, SeqFeature
+from collections import OrderedDict
+from collections.abc import Mapping
+import heapq
+import numpy
+
+__author__ = 'adamkoziol'
+
+# Classes of the fuzzy positions that are kept when an index is serialised. Any other fuzzy position is stored as an
+# exact position
+POSITION_CLASSES = {position_class.__name__: position_class
+                    for position_class in (ExactPosition, BeforePosition, AfterPosition)}
+
+
+class FeatureIndex(Mapping):
+    """
+    Position-indexed GenBank features of a reference chromosome. Rather than one dictionary entry per base of every
+    feature, the chromosome is split into sorted, non-overlapping (start, end) segments with inclusive end positions,
+    each of which is covered by a single feature. As with the previous dictionaries, a position covered by several
+    features returns the last of these features in the GenBank record, and every feature covers the positions from
+    int(feature.location.start) to int(feature.location.end). Indexing with a position returns the SeqFeature, and
+    raises a KeyError for positions outside of all features
+    """
+
+    def __getitem__(self, pos):
+        index = self.segment_index(pos)
+        if index is None:
+            raise KeyError(pos)
+        return self.features[self.feature_ids[index]]
+
+    def __iter__(self):
+        # Yield every covered position in sorted order, so that the index behaves like the previous dictionaries
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            for pos in range(start, end + 1):
+                yield pos
+
+    def __len__(self):
+        return int((self.ends - self.starts + 1).sum())
+
+    def __contains__(self, pos):
+        return self.segment_index(pos) is not None
+
+    def segment_index(self, pos):
+        """
+        Use a binary search of the sorted segment starts to find the segment containing the supplied position
+        :param pos: type INT: Reference position
+        :return: index: Row of the segment, or None if the position is not within a feature
+        """
+        # Positions that cannot be compared to the integer segments (e.g. None or strings) are not within a feature
+        try:
+            index = int(numpy.searchsorted(self.starts, pos, side='right')) - 1
+            if index >= 0 and self.ends[index] >= pos:
+                return index
+        except TypeError:
+            pass
+        return None
+
+    def feature_indices(self, positions):
+        """
+        Vectorised lookup of the features covering the supplied positions
+        :param positions: type iterable: Reference positions
+        :return: NumPy array of the index of the feature in self.features covering each position, or -1
+        """
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        index = numpy.searchsorted(self.starts, positions, side='right') - 1
+        found = index >= 0
+        found[found] = self.ends[index[found]] >= positions[found]
+        return numpy.where(found, self.feature_ids[numpy.maximum(index, 0)], -1)
+
+    def to_dict(self):
+        """
+        Create a JSON serialisable representation of the index
+        :return: Dictionary of the segment arrays, and of the type, location, and qualifiers of every feature
+        """
+        features = list()
+        for feature in self.features:
+            features.append({
+                'type': feature.type,
+                'parts': [[int(part.start), type(part.start).__name__, int(part.end), type(part.end).__name__,
+                           part.strand] for part in feature.location.parts],
+                'qualifiers': feature.qualifiers
+            })
+        return {
+            'starts': self.starts.tolist(),
+            'ends': self.ends.tolist(),
+            'feature_ids': self.feature_ids.tolist(),
+            'features': features
+        }
+
+    @staticmethod
+    def from_dict(index_dict):
+        """
+        Rebuild an index created by to_dict
+        :param index_dict: type DICT: Dictionary created by to_dict
+        :return: FeatureIndex object
+        """
+        features = list()
+        for feature_dict in index_dict['features']:
+            parts = [FeatureLocation(POSITION_CLASSES.get(start_class, ExactPosition)(start),
+                                     POSITION_CLASSES.get(end_class, ExactPosition)(end),
+                                     strand)
+                     for start, start_class, end, end_class, strand in feature_dict['parts']]
+            location = parts[0] if len(parts) == 1 else CompoundLocation(parts)
+            features.append(SeqFeature(location=location,
+                                       type=feature_dict['type'],
+                                       qualifiers=OrderedDict(feature_dict['qualifiers'])))
+        return FeatureIndex(starts=numpy.array(index_dict['starts'], dtype=numpy.int64),
+                            ends=numpy.array(index_dict['ends'], dtype=numpy.int64),
+                            feature_ids=numpy.array(index_dict['feature_ids'], dtype=numpy.int64),
+                            features=features)
+
+    @staticmethod
+    def from_features(features):
+        """
+        Create an index from a list of SeqFeatures. Where features overlap, the last feature in the list is used
+        :param features: type LIST: List of SeqFeature objects
+        :return: FeatureIndex object
+        """
+        features = list(features)
+        starts = [int(feature.location.start) for feature in features]
+        ends = [int(feature.location.end) for feature in features]
+        # Every segment starts either at the start of a feature, or directly after the end of a feature
+        boundaries = sorted(set(starts) | {end + 1 for end in ends})
+        order = sorted((start, feature_id) for feature_id, start in enumerate(starts) if ends[feature_id] >= start)
+        segments = list()
+        # Max-heap (by feature order) of the features covering the current segment. Features that have ended are only
+        # removed once they reach the top of the heap
+        heap = list()
+        next_feature = 0
+        for boundary, next_boundary in zip(boundaries, boundaries[1:]):
+            while next_feature < len(order) and order[next_feature][0] <= boundary:
+                feature_id = order[next_feature][1]
+                heapq.heappush(heap, (-feature_id, ends[feature_id]))
+                next_feature += 1
+            while heap and heap[0][1] < boundary:
+                heapq.heappop(heap)
+            if heap:
+                feature_id = -heap[0][0]
+                # Extend the previous segment if it is adjacent and covered by the same feature
+                if segments and segments[-1][2] == feature_id and segments[-1][1] == boundary - 1:
+                    segments[-1][1] = next_boundary - 1
+                else:
+                    segments.append([boundary, next_boundary - 1, feature_id])
+        segments = numpy.array(segments, dtype=numpy.int64).reshape(-1, 3)
+        # Only keep the features that cover at least one position
+        used_ids, feature_ids = numpy.unique(segments[:, 2], return_inverse=True)
+        return FeatureIndex(starts=segments[:, 0],
+                            ends=segments[:, 1],
+                            feature_ids=feature_ids.astype(numpy.int64),
+                            features=[features[feature_id] for feature_id in used_ids.tolist()])
+
+    def __init__(self, starts, ends, feature_ids, features):
+        self.starts = starts
+        self.ends = ends
+        self.feature_ids = feature_ids
+        self.features = features
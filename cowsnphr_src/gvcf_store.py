@@ -0,0 +1,597 @@
+#!/usr/bin/env python3
+from collections.abc import Mapping
+from array import array
+import heapq
+import numpy
+import json
+import os
+
+__author__ = 'adamkoziol'
+
+# Integer codes used in the filter column of the store. The names match the 'FILTER' values previously stored in the
+# nested per-position dictionaries
+MATCH = 0
+PASS = 1
+INSERTION = 2
+DELETION = 3
+FILTER_NAMES = ('MATCH', 'PASS', 'INSERTION', 'DELETION')
+FILTER_CODES = {name: code for code, name in enumerate(FILTER_NAMES)}
+# Version of the on-disk layout written by GVCFStore.save. Cached files written with a different version are rejected
+CACHE_VERSION = 1
+
+
+class ChromosomeCalls(Mapping):
+    """
+    Columnar, array-backed store of the parsed gVCF records of a single strain for a single reference chromosome.
+    Every stored record is a row in a set of parallel NumPy arrays sorted by position. Variant calls (lines with an
+    'ALT' other than <*>) additionally keep their raw allele and format strings in a sparse position-keyed dictionary,
+    so the full record can be rebuilt on demand. Zero coverage gVCF blocks (deletions) are not expanded into one row per
+    base, but are kept as sorted, non-overlapping (start, end) intervals. Indexing with a position returns a dictionary
+    with the same key: value pairs as the previous nested dictionaries: 'CHROM', 'REF', 'ALT', 'QUAL', 'LENGTH',
+    'FILTER', 'STATS'
+    """
+
+    def __getitem__(self, pos):
+        # Find the row corresponding to the position
+        index = self.index(pos)
+        if index is not None:
+            return self.record(index)
+        # Positions within a deletion interval are rebuilt from the interval arrays
+        deletion_index = self.deletion_index(pos)
+        if deletion_index is not None:
+            return self.deletion_record(deletion_index)
+        raise KeyError(pos)
+
+    def __iter__(self):
+        # Yield the stored positions, and every position within the deletion intervals, in sorted order as Python
+        # integers, so that they behave like the previous dictionary keys
+        deleted = (pos for start, end in zip(self.deletion_starts.tolist(), self.deletion_ends.tolist())
+                   for pos in range(start, end + 1))
+        return heapq.merge(self.positions.tolist(), deleted)
+
+    def __len__(self):
+        return len(self.positions) + self.deletion_length
+
+    def __contains__(self, pos):
+        return self.index(pos) is not None or self.deletion_index(pos) is not None
+
+    def index(self, pos):
+        """
+        Use a binary search of the sorted position array to find the row of the supplied position
+        :param pos: type INT: Reference position
+        :return: index: Row of the position in the arrays, or None if the position is not stored
+        """
+        try:
+            index = int(numpy.searchsorted(self.positions, pos))
+        except TypeError:
+            return None
+        if index < len(self.positions) and self.positions[index] == pos:
+            return index
+        return None
+
+    def deletion_index(self, pos):
+        """
+        Use a binary search of the sorted deletion interval start array to find the interval containing the supplied
+        position
+        :param pos: type INT: Reference position
+        :return: index: Row of the interval in the deletion arrays, or None if the position is not deleted
+        """
+        try:
+            index = int(numpy.searchsorted(self.deletion_starts, pos, side='right')) - 1
+        except TypeError:
+            return None
+        if index >= 0 and self.deletion_ends[index] >= pos:
+            return index
+        return None
+
+    def is_deleted(self, pos):
+        """
+        O(log n) query of whether the supplied position falls within a zero coverage gVCF block
+        :param pos: type INT: Reference position
+        :return: Boolean of whether the position is deleted
+        """
+        return self.deletion_index(pos) is not None
+
+    def deleted(self, positions):
+        """
+        Vectorised version of is_deleted
+        :param positions: type iterable: Reference positions
+        :return: NumPy boolean array of whether each position is deleted
+        """
+        positions = numpy.asarray(positions)
+        index = numpy.searchsorted(self.deletion_starts, positions, side='right') - 1
+        deleted = index >= 0
+        deleted[deleted] = self.deletion_ends[index[deleted]] >= positions[deleted]
+        return deleted
+
+    def deletion_mask(self, length):
+        """
+        Create a boolean array covering the chromosome, which can be indexed directly with a position
+        :param length: type INT: Length of the reference chromosome
+        :return: NumPy boolean array of length + 1, True at every deleted position
+        """
+        # Add +1 at the start of each interval and -1 after its end. The cumulative sum is positive within intervals
+        coverage = numpy.zeros(length + 2, dtype=numpy.int32)
+        starts = numpy.clip(self.deletion_starts, 0, length + 1)
+        ends = numpy.clip(self.deletion_ends + 1, 0, length + 1)
+        numpy.add.at(coverage, starts, 1)
+        numpy.add.at(coverage, ends, -1)
+        return numpy.cumsum(coverage[:-1]) > 0
+
+    def nearest_filter(self, pos):
+        """
+        Find the filter code of the stored position closest to the supplied position, considering every position within
+        the deletion intervals as stored. Ties are resolved in favour of the lower position, as was the case with
+        min(dict.keys(), key=lambda k: abs(k - pos))
+        :param pos: type INT: Reference position
+        :return: filter_code: One of MATCH, PASS, INSERTION, DELETION, or None if there are no stored positions
+        """
+        if self.is_deleted(pos):
+            return DELETION
+        # Find the closest stored row on either side of the position
+        index = int(numpy.searchsorted(self.positions, pos))
+        if index < len(self.positions) and self.positions[index] == pos:
+            return int(self.filters[index])
+        candidates = list()
+        if index > 0:
+            candidates.append((pos - int(self.positions[index - 1]), 0, int(self.filters[index - 1])))
+        if index < len(self.positions):
+            candidates.append((int(self.positions[index]) - pos, 1, int(self.filters[index])))
+        # Find the closest deletion interval on either side of the position
+        deletion_index = int(numpy.searchsorted(self.deletion_starts, pos, side='right'))
+        if deletion_index > 0:
+            candidates.append((pos - int(self.deletion_ends[deletion_index - 1]), 0, DELETION))
+        if deletion_index < len(self.deletion_starts):
+            candidates.append((int(self.deletion_starts[deletion_index]) - pos, 1, DELETION))
+        if not candidates:
+            return None
+        # Sort on distance, and then on side (lower positions first)
+        return min(candidates)[2]
+
+    def indices(self, positions):
+        """
+        Vectorised version of index
+        :param positions: type iterable: Sorted or unsorted reference positions
+        :return: NumPy array of the row of each position in the arrays, or -1 if the position is not stored
+        """
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        index = numpy.searchsorted(self.positions, positions)
+        found = index < len(self.positions)
+        found[found] = self.positions[index[found]] == positions[found]
+        return numpy.where(found, index, -1)
+
+    def nearest_filters(self, positions):
+        """
+        Vectorised version of nearest_filter
+        :param positions: type iterable: Reference positions
+        :return: NumPy array of the filter code of the stored position closest to each position, or -1 if there are no
+        stored positions
+        """
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        # Each candidate is encoded as distance * 8 + side * 4 + filter code, so that the minimum candidate is the one
+        # chosen by nearest_filter: closest, then lower side, then lowest filter code
+        missing = numpy.iinfo(numpy.int64).max
+        candidates = numpy.full((4, len(positions)), missing, dtype=numpy.int64)
+        index = numpy.searchsorted(self.positions, positions)
+        lower = index > 0
+        candidates[0, lower] = (positions[lower] - self.positions[index[lower] - 1]) * 8 + \
+            self.filters[index[lower] - 1]
+        upper = index < len(self.positions)
+        candidates[1, upper] = (self.positions[index[upper]] - positions[upper]) * 8 + 4 + self.filters[index[upper]]
+        deletion_index = numpy.searchsorted(self.deletion_starts, positions, side='right')
+        lower = deletion_index > 0
+        candidates[2, lower] = (positions[lower] - self.deletion_ends[deletion_index[lower] - 1]) * 8 + DELETION
+        upper = deletion_index < len(self.deletion_starts)
+        candidates[3, upper] = (self.deletion_starts[deletion_index[upper]] - positions[upper]) * 8 + 4 + DELETION
+        best = candidates.min(axis=0)
+        filters = numpy.where(best == missing, -1, best % 4)
+        # Positions within a deletion interval are always deletions
+        filters[self.deleted(positions)] = DELETION
+        return filters
+
+    def filter_at(self, pos):
+        """
+        Return the filter code of the supplied position without rebuilding the full record
+        :param pos: type INT: Reference position
+        :return: filter_code: One of MATCH, PASS, INSERTION, DELETION, or None if the position is not stored
+        """
+        index = self.index(pos)
+        if index is not None:
+            return int(self.filters[index])
+        if self.is_deleted(pos):
+            return DELETION
+        return None
+
+    def record(self, index):
+        """
+        Rebuild the dictionary representation of the record stored in the supplied row
+        :param index: type INT: Row of the record in the arrays
+        :return: Dictionary of 'CHROM', 'REF', 'ALT', 'QUAL', 'LENGTH', 'FILTER', 'STATS'
+        """
+        pos = int(self.positions[index])
+        try:
+            # Variant calls have their raw strings stored in the sparse dictionary
+            ref, alt, qual, format_stat, strain_info = self.calls[pos]
+            stats = {category: value for category, value in zip(format_stat.split(':'), strain_info.split(':'))}
+        except KeyError:
+            # gVCF reference blocks are rebuilt from the arrays
+            ref = chr(self.ref_codes[index])
+            alt = '<*>'
+            qual = '{:g}'.format(self.quals[index])
+            stats = {'MIN_DP': str(self.depths[index])}
+        return {
+            'CHROM': self.chrom,
+            'REF': ref,
+            'ALT': alt,
+            'QUAL': qual,
+            'LENGTH': int(self.lengths[index]),
+            'FILTER': FILTER_NAMES[self.filters[index]],
+            'STATS': stats
+        }
+
+    def deletion_record(self, index):
+        """
+        Rebuild the dictionary representation of a position within the supplied deletion interval
+        :param index: type INT: Row of the interval in the deletion arrays
+        :return: Dictionary of 'CHROM', 'REF', 'ALT', 'QUAL', 'LENGTH', 'FILTER', 'STATS'
+        """
+        return {
+            'CHROM': self.chrom,
+            'REF': chr(self.deletion_refs[index]),
+            'ALT': '<*>',
+            'QUAL': '{:g}'.format(self.deletion_quals[index]),
+            'LENGTH': 1,
+            'FILTER': 'DELETION',
+            'STATS': {'MIN_DP': '0'}
+        }
+
+    def ref_base(self, index):
+        """
+        Return the 'REF' string of the record in the supplied row without rebuilding the full record
+        :param index: type INT: Row of the record in the arrays
+        :return: REF string
+        """
+        try:
+            return self.calls[int(self.positions[index])][0]
+        except KeyError:
+            return chr(self.ref_codes[index])
+
+    def ref_bases(self):
+        """
+        Create a list of the 'REF' strings of every row. Single bases are decoded from the reference code column,
+        while variant calls use the raw 'REF' string (e.g. multi-base indels)
+        :return: List of REF strings in row order
+        """
+        refs = list(self.ref_codes.tobytes().decode())
+        if self.calls:
+            for index in numpy.flatnonzero(numpy.isin(self.positions, list(self.calls))).tolist():
+                refs[index] = self.calls[int(self.positions[index])][0]
+        return refs
+
+    def deletion_items(self):
+        """
+        Expand the deletion intervals into (position, 'REF' string) pairs
+        :return: Generator of position, REF string for every deleted position
+        """
+        for start, end, ref_code in zip(self.deletion_starts.tolist(), self.deletion_ends.tolist(),
+                                        self.deletion_refs.tolist()):
+            ref = chr(ref_code)
+            for pos in range(start, end + 1):
+                yield pos, ref
+
+    def filter_positions(self, filter_code):
+        """
+        Extract the positions of all records with the supplied filter code
+        :param filter_code: type INT: One of MATCH, PASS, INSERTION, DELETION
+        :return: Sorted NumPy array of positions
+        """
+        if filter_code == DELETION:
+            if not len(self.deletion_starts):
+                return numpy.zeros(0, dtype=numpy.int32)
+            return numpy.concatenate([numpy.arange(start, end + 1, dtype=numpy.int32)
+                                      for start, end in zip(self.deletion_starts, self.deletion_ends)])
+        return self.positions[self.filters == filter_code]
+
+    @property
+    def deletion_length(self):
+        """
+        Total number of deleted positions
+        """
+        return int((self.deletion_ends.astype(numpy.int64) - self.deletion_starts + 1).sum())
+
+    @property
+    def nbytes(self):
+        """
+        Approximate number of bytes used by the arrays
+        """
+        return sum(column.nbytes for column in (self.positions, self.filters, self.lengths, self.ref_codes,
+                                                self.alt_codes, self.depths, self.alt_depths, self.quals,
+                                                self.deletion_starts, self.deletion_ends, self.deletion_refs,
+                                                self.deletion_quals))
+
+    def __init__(self, chrom, positions, filters, lengths, ref_codes, alt_codes, depths, alt_depths, quals, calls,
+                 deletion_starts, deletion_ends, deletion_refs, deletion_quals):
+        self.chrom = chrom
+        self.positions = positions
+        self.filters = filters
+        self.lengths = lengths
+        self.ref_codes = ref_codes
+        self.alt_codes = alt_codes
+        self.depths = depths
+        self.alt_depths = alt_depths
+        self.quals = quals
+        self.calls = calls
+        self.deletion_starts = deletion_starts
+        self.deletion_ends = deletion_ends
+        self.deletion_refs = deletion_refs
+        self.deletion_quals = deletion_quals
+
+
+class GVCFStore(Mapping):
+    """
+    Compact store of all the parsed gVCF records of a single strain. Behaves as a read-only dictionary of reference
+    chromosome: ChromosomeCalls. Records are added with add_record and add_deletion while parsing, and the columns are
+    converted to NumPy arrays with finalise once the file has been read
+    """
+
+    def __getitem__(self, chrom):
+        return self.chromosomes[chrom]
+
+    def __iter__(self):
+        return iter(self.chromosomes)
+
+    def __len__(self):
+        return len(self.chromosomes)
+
+    def add_record(self, chrom, pos, filter_code, ref, alt, qual, length, format_stat, strain_info, depth=0,
+                   replace=True):
+        """
+        Append a record to the columns of the supplied chromosome. Records must be added in increasing position order
+        :param chrom: type STR: Name of the reference chromosome
+        :param pos: type INT: Reference position
+        :param filter_code: type INT: One of MATCH, PASS, INSERTION
+        :param ref: type STR: 'REF' entry from the gVCF line
+        :param alt: type STR: 'ALT' entry from the gVCF line
+        :param qual: type STR: 'QUAL' entry from the gVCF line
+        :param length: type INT: Length of the feature
+        :param format_stat: type STR: 'FORMAT' entry from the gVCF line e.g. GT:GQ:DP:AD:VAF:PL
+        :param strain_info: type STR: Strain-specific format values e.g. 1/1:54:18:0,18,0:1,0:60,55,0,990,990,990
+        :param depth: type INT: Read depth (DP) of a variant call, or the minimum depth (MIN_DP) of a gVCF block
+        :param replace: type BOOL: Whether the record overwrites a previous record at the same position
+        """
+        columns = self._pending.setdefault(chrom, self._new_columns())
+        positions = columns['positions']
+        # Records at the same position as the previous record either overwrite it, or are ignored
+        if positions and positions[-1] == pos:
+            if not replace:
+                return
+            for name in self._row_columns:
+                columns[name].pop()
+            columns['calls'].pop(pos, None)
+        positions.append(pos)
+        columns['filters'].append(filter_code)
+        columns['lengths'].append(length)
+        columns['ref_codes'].append(ord(ref[0]))
+        columns['alt_codes'].append(ord(alt[0]))
+        columns['depths'].append(depth)
+        columns['quals'].append(float(qual))
+        # Variant calls keep their raw strings, and the depth of the first alternate allele
+        if alt != '<*>':
+            columns['calls'][pos] = (ref, alt, qual, format_stat, strain_info)
+            columns['alt_depths'].append(self.alt_depth(format_stat=format_stat,
+                                                        strain_info=strain_info))
+        else:
+            columns['alt_depths'].append(0)
+
+    def add_deletion(self, chrom, start, end, ref, qual):
+        """
+        Append a zero coverage gVCF block to the deletion intervals of the supplied chromosome
+        :param chrom: type STR: Name of the reference chromosome
+        :param start: type INT: First deleted position
+        :param end: type INT: Last deleted position (inclusive) e.g. from END=136738
+        :param ref: type STR: 'REF' entry from the gVCF line
+        :param qual: type STR: 'QUAL' entry from the gVCF line
+        """
+        columns = self._pending.setdefault(chrom, self._new_columns())
+        columns['deletion_starts'].append(start)
+        columns['deletion_ends'].append(max(end, start))
+        columns['deletion_refs'].append(ord(ref[0]))
+        columns['deletion_quals'].append(float(qual))
+
+    def finalise(self):
+        """
+        Convert the pending Python columns to NumPy arrays
+        """
+        for chrom, columns in self._pending.items():
+            calls = ChromosomeCalls(
+                chrom=chrom,
+                positions=numpy.frombuffer(columns['positions'], dtype=numpy.int32).copy(),
+                filters=numpy.frombuffer(columns['filters'], dtype=numpy.uint8).copy(),
+                lengths=numpy.frombuffer(columns['lengths'], dtype=numpy.int32).copy(),
+                ref_codes=numpy.frombuffer(columns['ref_codes'], dtype=numpy.uint8).copy(),
+                alt_codes=numpy.frombuffer(columns['alt_codes'], dtype=numpy.uint8).copy(),
+                depths=numpy.frombuffer(columns['depths'], dtype=numpy.int32).copy(),
+                alt_depths=numpy.frombuffer(columns['alt_depths'], dtype=numpy.int32).copy(),
+                quals=numpy.frombuffer(columns['quals'], dtype=numpy.float32).copy(),
+                calls=columns['calls'],
+                deletion_starts=numpy.frombuffer(columns['deletion_starts'], dtype=numpy.int32).copy(),
+                deletion_ends=numpy.frombuffer(columns['deletion_ends'], dtype=numpy.int32).copy(),
+                deletion_refs=numpy.frombuffer(columns['deletion_refs'], dtype=numpy.uint8).copy(),
+                deletion_quals=numpy.frombuffer(columns['deletion_quals'], dtype=numpy.float32).copy())
+            # gVCF files are sorted by position, but ensure that the binary searches remain valid if they are not
+            if numpy.any(numpy.diff(calls.positions) < 0):
+                order = numpy.argsort(calls.positions, kind='stable')
+                for column in self._row_columns[1:] + ('positions',):
+                    setattr(calls, column, getattr(calls, column)[order])
+            self._sort_deletions(calls)
+            self.chromosomes[chrom] = calls
+        self._pending = dict()
+        return self
+
+    @staticmethod
+    def _sort_deletions(calls):
+        """
+        Sort the deletion intervals by start position, and merge any overlapping intervals, so that a single binary
+        search finds the interval containing a position
+        :param calls: ChromosomeCalls object
+        """
+        starts = calls.deletion_starts
+        if not len(starts):
+            return
+        order = numpy.argsort(starts, kind='stable')
+        starts = starts[order]
+        ends = calls.deletion_ends[order]
+        refs = calls.deletion_refs[order]
+        quals = calls.deletion_quals[order]
+        # Running maximum of the end positions. An interval starting at or before the furthest end seen so far
+        # overlaps a previous interval
+        furthest = numpy.maximum.accumulate(ends)
+        new_block = numpy.ones(len(starts), dtype=bool)
+        new_block[1:] = starts[1:] > furthest[:-1]
+        block_starts = numpy.flatnonzero(new_block)
+        block_ends = numpy.append(block_starts[1:], len(starts)) - 1
+        calls.deletion_starts = starts[block_starts]
+        calls.deletion_ends = furthest[block_ends]
+        calls.deletion_refs = refs[block_starts]
+        calls.deletion_quals = quals[block_starts]
+
+    def count(self, filter_code):
+        """
+        Count the number of positions with the supplied filter code across all chromosomes
+        :param filter_code: type INT: One of MATCH, PASS, INSERTION, DELETION
+        :return: Number of positions
+        """
+        if filter_code == DELETION:
+            return sum(calls.deletion_length for calls in self.chromosomes.values())
+        return int(sum(numpy.count_nonzero(calls.filters == filter_code) for calls in self.chromosomes.values()))
+
+    def total_length(self, filter_code):
+        """
+        Sum the 'LENGTH' of all the records with the supplied filter code across all chromosomes
+        :param filter_code: type INT: One of MATCH, PASS, INSERTION, DELETION
+        :return: Total length
+        """
+        if filter_code == DELETION:
+            return self.count(DELETION)
+        return int(sum(calls.lengths[calls.filters == filter_code].sum() for calls in self.chromosomes.values()))
+
+    @property
+    def nbytes(self):
+        """
+        Approximate number of bytes used by the arrays of all the chromosomes
+        """
+        return sum(calls.nbytes for calls in self.chromosomes.values())
+
+    def save(self, path, metadata=None):
+        """
+        Write the finalised store to an uncompressed NumPy .npz archive. The archive is written to a temporary file,
+        and moved into place once complete, so concurrent readers never see a partially written file
+        :param path: type STR: Absolute path of the .npz file to create
+        :param metadata: type DICT: Additional JSON serialisable key: value pairs to store in the archive header
+        """
+        header = dict(metadata) if metadata else dict()
+        header['version'] = CACHE_VERSION
+        header['strain_name'] = self.strain_name
+        header['chromosomes'] = list(self.chromosomes)
+        arrays = dict()
+        for i, calls in enumerate(self.chromosomes.values()):
+            for column in self._array_columns:
+                arrays['{i}_{column}'.format(i=i, column=column)] = getattr(calls, column)
+            # The raw strings of the variant calls are stored as a single tab and newline delimited block of text, as
+            # gVCF fields cannot contain either character
+            call_positions = sorted(calls.calls)
+            text = '\n'.join('\t'.join(calls.calls[pos]) for pos in call_positions)
+            arrays['{i}_call_positions'.format(i=i)] = numpy.array(call_positions, dtype=numpy.int32)
+            arrays['{i}_call_text'.format(i=i)] = numpy.frombuffer(text.encode(), dtype=numpy.uint8)
+        arrays['header'] = numpy.frombuffer(json.dumps(header).encode(), dtype=numpy.uint8)
+        temp_path = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+        try:
+            with open(temp_path, 'wb') as archive:
+                numpy.savez(archive, **arrays)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def load_metadata(path):
+        """
+        Read the header of an archive created by save without loading any of the arrays
+        :param path: type STR: Absolute path of the .npz file
+        :return: metadata: Dictionary of the header key: value pairs
+        """
+        with numpy.load(path) as archive:
+            metadata = json.loads(archive['header'].tobytes().decode())
+        if metadata.get('version') != CACHE_VERSION:
+            raise ValueError('Unsupported cache version in {path}'.format(path=path))
+        return metadata
+
+    @staticmethod
+    def load(path):
+        """
+        Recreate a finalised store from an archive created by save
+        :param path: type STR: Absolute path of the .npz file
+        :return: store: GVCFStore
+        :return: metadata: Dictionary of the header key: value pairs
+        """
+        with numpy.load(path) as archive:
+            metadata = json.loads(archive['header'].tobytes().decode())
+            if metadata.get('version') != CACHE_VERSION:
+                raise ValueError('Unsupported cache version in {path}'.format(path=path))
+            store = GVCFStore(strain_name=metadata['strain_name'])
+            for i, chrom in enumerate(metadata['chromosomes']):
+                columns = {column: archive['{i}_{column}'.format(i=i, column=column)]
+                           for column in GVCFStore._array_columns}
+                call_positions = archive['{i}_call_positions'.format(i=i)].tolist()
+                text = archive['{i}_call_text'.format(i=i)].tobytes().decode()
+                calls = {pos: tuple(line.split('\t')) for pos, line in zip(call_positions, text.split('\n'))} \
+                    if call_positions else dict()
+                store.chromosomes[chrom] = ChromosomeCalls(chrom=chrom,
+                                                           calls=calls,
+                                                           **columns)
+        return store, metadata
+
+    @staticmethod
+    def alt_depth(format_stat, strain_info):
+        """
+        Extract the depth of the first alternate allele from the 'AD' format entry e.g. AD 24,9,0 yields 9
+        :param format_stat: type STR: 'FORMAT' entry from the gVCF line
+        :param strain_info: type STR: Strain-specific format values
+        :return: Integer of the allele depth, or 0 if it is not available
+        """
+        for category, value in zip(format_stat.split(':'), strain_info.split(':')):
+            if category == 'AD':
+                try:
+                    return int(value.split(',')[1])
+                except (IndexError, ValueError):
+                    return 0
+        return 0
+
+    # Names of the per-row columns. Deletion intervals have their own columns
+    _row_columns = ('positions', 'filters', 'lengths', 'ref_codes', 'alt_codes', 'depths', 'alt_depths', 'quals')
+    # Names of all the NumPy array columns written to, and read from, cached archives
+    _array_columns = _row_columns + ('deletion_starts', 'deletion_ends', 'deletion_refs', 'deletion_quals')
+
+    @staticmethod
+    def _new_columns():
+        # Python arrays use far less memory than lists while the file is being parsed
+        return {
+            'positions': array('i'),
+            'filters': array('B'),
+            'lengths': array('i'),
+            'ref_codes': array('B'),
+            'alt_codes': array('B'),
+            'depths': array('i'),
+            'alt_depths': array('i'),
+            'quals': array('f'),
+            'calls': dict(),
+            'deletion_starts': array('i'),
+            'deletion_ends': array('i'),
+            'deletion_refs': array('B'),
+            'deletion_quals': array('f')
+        }
+
+    def __init__(self, strain_name):
+        self.strain_name = strain_name
+        self.chromosomes = dict()
+        self._pending = dict()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import numpy
+import json
+import os
+
+__author__ = 'adamkoziol'
+
+
+class IntervalMask(object):
+    """
+    Masked regions of a single reference chromosome stored as sorted, merged (start, end) intervals with inclusive
+    end positions, rather than as a set of every masked position. Supports the 'in' operator for single positions, as
+    well as vectorized queries of arrays of positions
+    """
+
+    def __contains__(self, pos):
+        try:
+            index = int(numpy.searchsorted(self.starts, pos, side='right')) - 1
+        except TypeError:
+            return False
+        return index >= 0 and self.ends[index] >= pos
+
+    def __iter__(self):
+        # Yield every masked position in sorted order, so that the mask can be used in place of the previous sets
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            for pos in range(start, end + 1):
+                yield pos
+
+    def __len__(self):
+        return int((self.ends - self.starts + 1).sum())
+
+    def contains(self, positions):
+        """
+        Determine which of the supplied positions are masked with a single binary search of the interval starts
+        :param positions: type NUMPY.ARRAY: Reference positions
+        :return: Boolean NumPy array that is True for masked positions
+        """
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        index = numpy.searchsorted(self.starts, positions, side='right') - 1
+        masked = index >= 0
+        masked[masked] = self.ends[index[masked]] >= positions[masked]
+        return masked
+
+    def mask_array(self, length):
+        """
+        Create a boolean array that is True at every masked position
+        :param length: type INT: Length of the reference chromosome
+        :return: Boolean NumPy array of size length + 1, so that it can be indexed with 1-based positions
+        """
+        marks = numpy.zeros(length + 2, dtype=numpy.int32)
+        starts = numpy.clip(self.starts, 0, length + 1)
+        ends = numpy.clip(self.ends + 1, 0, length + 1)
+        numpy.add.at(marks, starts, 1)
+        numpy.add.at(marks, ends, -1)
+        return numpy.cumsum(marks)[:length + 1] > 0
+
+    @staticmethod
+    def from_intervals(intervals):
+        """
+        Create a mask from (start, end) intervals with inclusive end positions. Intervals do not have to be sorted, and
+        may overlap. Intervals with an end before their start are ignored
+        :param intervals: type LIST: List of (start, end) tuples
+        :return: IntervalMask object
+        """
+        intervals = numpy.array([(start, end) for start, end in intervals if end >= start],
+                                dtype=numpy.int64).reshape(-1, 2)
+        order = numpy.argsort(intervals[:, 0], kind='stable')
+        starts = intervals[order, 0]
+        ends = intervals[order, 1]
+        if not len(starts):
+            return IntervalMask(starts=starts,
+                                ends=ends)
+        # Running maximum of the end positions. An interval starting after the furthest end seen so far (and not
+        # directly adjacent to it) begins a new merged interval
+        furthest = numpy.maximum.accumulate(ends)
+        new_block = numpy.ones(len(starts), dtype=bool)
+        new_block[1:] = starts[1:] > furthest[:-1] + 1
+        block_starts = numpy.flatnonzero(new_block)
+        block_ends = numpy.append(block_starts[1:], len(starts)) - 1
+        return IntervalMask(starts=starts[block_starts],
+                            ends=furthest[block_ends])
+
+    @staticmethod
+    def save_masks(path, chrom_masks, metadata=None):
+        """
+        Write the masks of several reference chromosomes to an uncompressed NumPy .npz archive. The archive is written
+        to a temporary file, and moved into place once complete
+        :param path: type STR: Absolute path of the .npz file to create
+        :param chrom_masks: type DICT: Dictionary of reference chromosome: IntervalMask
+        :param metadata: type DICT: Additional JSON serialisable key: value pairs to store in the archive header
+        """
+        header = dict(metadata) if metadata else dict()
+        header['chromosomes'] = list(chrom_masks)
+        arrays = {'header': numpy.frombuffer(json.dumps(header).encode(), dtype=numpy.uint8)}
+        for i, mask in enumerate(chrom_masks.values()):
+            arrays['{i}_starts'.format(i=i)] = mask.starts
+            arrays['{i}_ends'.format(i=i)] = mask.ends
+        temp_path = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+        try:
+            with open(temp_path, 'wb') as archive:
+                numpy.savez(archive, **arrays)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def load_masks(path):
+        """
+        Load the masks written by save_masks
+        :param path: type STR: Absolute path of the .npz file
+        :return: chrom_masks: Dictionary of reference chromosome: IntervalMask
+        :return: metadata: Dictionary of the header key: value pairs
+        """
+        with numpy.load(path) as archive:
+            metadata = json.loads(archive['header'].tobytes().decode())
+            chrom_masks = {chrom: IntervalMask(starts=archive['{i}_starts'.format(i=i)],
+                                               ends=archive['{i}_ends'.format(i=i)])
+                           for i, chrom in enumerate(metadata['chromosomes'])}
+        return chrom_masks, metadata
+
+    def __init__(self, starts, ends):
+        self.starts = starts
+        self.ends = ends
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+from multiprocessing.pool import ThreadPool
+import threading
+import hashlib
+import shutil
+import queue
+import json
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+
+class Task(object):
+    """
+    A single unit of work in a TaskGraph, with the names of the tasks it depends on, and the files it reads and writes
+    """
+
+    def __init__(self, name, function, dependencies=None, inputs=None, outputs=None, scratch=None, threads=1,
+                 restore=None, after=None, memory=0):
+        self.name = name
+        self.function = function
+        self.dependencies = list(dependencies) if dependencies else list()
+        self.after = list(after) if after else list()
+        self.inputs = list(inputs) if inputs else list()
+        self.outputs = list(outputs) if outputs else list()
+        self.scratch = list(scratch) if scratch else list()
+        self.threads = threads
+        self.memory = memory
+        self.restore = restore
+
+
+class TaskGraph(object):
+    """
+    Directed acyclic graph of tasks. Tasks are run concurrently as soon as all of their dependencies have completed,
+    provided that the sums of the threads and of the estimated memory of the running tasks do not exceed the thread
+    and memory budgets. A task is up to date
+    (and is not run) when it declares outputs, all of its outputs exist, none of its dependencies have to be run, and
+    the content hashes of its inputs and outputs match those recorded when it last completed. The hashes are stored in
+    a JSON state file that is updated as each task completes, so an interrupted analysis can be restarted without
+    repeating the completed tasks. Outputs created before the state file existed are adopted as up to date
+    """
+
+    def add_task(self, name, function, dependencies=None, inputs=None, outputs=None, scratch=None, threads=1,
+                 restore=None, after=None, memory=0):
+        """
+        Add a task to the graph
+        :param name: type STR: Unique name of the task
+        :param function: Callable that performs the task. Its return value is stored in self.results
+        :param dependencies: type LIST: Names of the tasks that must complete before this task is run
+        :param inputs: type LIST: Absolute paths of the files read by the task
+        :param outputs: type LIST: Absolute paths of the files created by the task. Tasks without outputs are always run
+        :param scratch: type LIST: Absolute paths of intermediate files and folders that are removed (along with the
+        outputs) before an out of date task is run
+        :param threads: type INT: Number of threads used by the task. Default is 1
+        :param restore: Optional callable run instead of function when the task is up to date, to restore its results
+        :param after: type LIST: Names of tasks that must complete before this task is started, but that do not make
+        this task out of date when they are run. Used to limit how far ahead of later stages a stage may run
+        :param memory: type INT: Estimated peak memory (bytes) of the task, or a callable returning the estimate. The
+        callable is evaluated once the dependencies of the task have completed, so it may use their outputs.
+        Default is 0
+        :return: Task object
+        """
+        if name in self.tasks:
+            raise ValueError('Task {name} has already been added to the graph'.format(name=name))
+        self.tasks[name] = Task(name=name,
+                                function=function,
+                                dependencies=dependencies,
+                                inputs=inputs,
+                                outputs=outputs,
+                                scratch=scratch,
+                                threads=threads,
+                                restore=restore,
+                                after=after,
+                                memory=memory)
+        return self.tasks[name]
+
+    def task_order(self):
+        """
+        Sort the tasks so that every task follows its dependencies. Otherwise, tasks remain in the order in which they
+        were added
+        :return: order: List of task names
+        """
+        order = list()
+        placed = set()
+        remaining = list(self.tasks)
+        for name in remaining:
+            for dependency in self.tasks[name].dependencies + self.tasks[name].after:
+                if dependency not in self.tasks:
+                    raise ValueError('Task {name} depends on unknown task {dependency}'
+                                     .format(name=name,
+                                             dependency=dependency))
+        while remaining:
+            ready = [name for name in remaining
+                     if all(dependency in placed
+                            for dependency in self.tasks[name].dependencies + self.tasks[name].after)]
+            if not ready:
+                raise ValueError('The dependencies of tasks {names} form a cycle'.format(names=', '.join(remaining)))
+            order.extend(ready)
+            placed.update(ready)
+            remaining = [name for name in remaining if name not in placed]
+        return order
+
+    def file_hash(self, path):
+        """
+        Calculate the SHA-256 hash of the contents of a file. Hashes are cached with the size and modification time of
+        the file, so unchanged files are only read once
+        :param path: type STR: Absolute path of the file
+        :return: Hexadecimal hash, or None if the file does not exist
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        file_stat = [stat.st_size, stat.st_mtime_ns]
+        cached = self.state['files'].get(path)
+        if cached and cached[:2] == file_stat:
+            return cached[2]
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as hash_file:
+            for block in iter(lambda: hash_file.read(1 << 20), b''):
+                sha256.update(block)
+        # Hashes are calculated in the worker threads, while the state file is written by the scheduling thread
+        with self.state_lock:
+            self.state['files'][path] = file_stat + [sha256.hexdigest()]
+        return sha256.hexdigest()
+
+    def task_record(self, task):
+        """
+        Create the record of the content hashes of the inputs and outputs of a task
+        :param task: Task object
+        :return: Dictionary of 'inputs' and 'outputs': dictionary of path: hash
+        """
+        return {'inputs': {path: self.file_hash(path) for path in task.inputs},
+                'outputs': {path: self.file_hash(path) for path in task.outputs}}
+
+    def stale_tasks(self, order):
+        """
+        Determine which tasks must be run
+        :param order: type LIST: Names of the tasks sorted by task_order
+        :return: stale: Set of the names of the tasks that are not up to date
+        """
+        stale = set()
+        for name in order:
+            task = self.tasks[name]
+            if not task.outputs or any(dependency in stale for dependency in task.dependencies) \
+                    or not all(os.path.isfile(output) for output in task.outputs):
+                stale.add(name)
+                continue
+            record = self.state['tasks'].get(name)
+            # Adopt outputs that were created before the task was recorded in the state file
+            if record is None:
+                self.state['tasks'][name] = self.task_record(task)
+            elif record != self.task_record(task):
+                stale.add(name)
+        return stale
+
+    def execute_task(self, task, stale):
+        """
+        Run an out of date task, or restore the results of an up to date task
+        :param task: Task object
+        :param stale: type BOOL: Whether the task is out of date
+        :return: result: Return value of the task function
+        :return: record: Content hashes of the inputs and outputs of the task, or None if it does not declare outputs
+        """
+        if stale:
+            # Remove the previous outputs, so that they are not mistaken for the results of this run
+            for path in task.outputs + task.scratch:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.isfile(path):
+                    os.remove(path)
+            start = time.time()
+            result = task.function()
+            self.timings[task.name] = (start, time.time())
+        else:
+            result = task.restore() if task.restore else None
+        return result, self.task_record(task) if task.outputs else None
+
+    def save_state(self):
+        """
+        Write the state file. The file is written to a temporary file, and moved into place once complete
+        """
+        if not self.state_file:
+            return
+        temp_path = '{path}.{pid}.tmp'.format(path=self.state_file, pid=os.getpid())
+        with self.state_lock:
+            state_json = json.dumps(self.state)
+        with open(temp_path, 'w') as state:
+            state.write(state_json)
+        os.replace(temp_path, self.state_file)
+
+    def task_memory(self, task, stale):
+        """
+        Determine the estimated memory of a task
+        :param task: Task object
+        :param stale: type BOOL: Whether the task is out of date. Restoring the results of a task uses no memory
+        :return: Estimated memory of the task in bytes
+        """
+        if not stale:
+            return 0
+        return int(task.memory() if callable(task.memory) else task.memory)
+
+    def run(self, threads=1, dry_run=False, max_memory=None):
+        """
+        Run every task that is not up to date, and restore the results of the remaining tasks
+        :param threads: type INT: Thread budget shared by the running tasks. Default is 1
+        :param dry_run: type BOOL: Only determine the tasks that would be run. Default is False
+        :param max_memory: type INT: Memory budget (bytes) shared by the running tasks. Default is None (unlimited)
+        :return: List of the names of the tasks that were (or would be) run, in dependency order
+        """
+        order = self.task_order()
+        stale = self.stale_tasks(order)
+        stale_order = [name for name in order if name in stale]
+        if dry_run:
+            return stale_order
+        budget = max(1, int(threads))
+        self.budget = budget
+        self.start_time = time.time()
+        pending = list(order)
+        # Dictionary of task name: (threads, memory) of the running tasks
+        running = dict()
+        # Dictionary of task name: estimated memory of the tasks whose dependencies have completed
+        memory = dict()
+        completed = queue.Queue()
+        failure = None
+        with ThreadPool(processes=budget) as pool:
+            while pending or running:
+                for name in list(pending):
+                    task = self.tasks[name]
+                    if not all(dependency in self.results for dependency in task.dependencies + task.after):
+                        continue
+                    # Tasks requesting more threads or memory than the budgets are run once nothing else is running
+                    weight = min(max(1, int(task.threads)), budget)
+                    if name not in memory:
+                        memory[name] = self.task_memory(task=task,
+                                                        stale=name in stale)
+                    if running and (sum(used_threads for used_threads, _ in running.values()) + weight > budget or
+                                    max_memory and sum(used for _, used in running.values()) + memory[name]
+                                    > max_memory):
+                        continue
+                    pending.remove(name)
+                    running[name] = (weight, memory[name])
+                    pool.apply_async(self.execute_task,
+                                     (task, name in stale),
+                                     callback=lambda output, name=name: completed.put((name, output, None)),
+                                     error_callback=lambda error, name=name: completed.put((name, None, error)))
+                name, output, error = completed.get()
+                running.pop(name)
+                if error is not None:
+                    # Stop starting new tasks, but allow the running tasks to finish
+                    failure = failure or error
+                    pending = list()
+                    continue
+                result, record = output
+                self.results[name] = result
+                if record is not None:
+                    self.state['tasks'][name] = record
+                elif name in self.state['tasks']:
+                    del self.state['tasks'][name]
+                # Record each completed task immediately, so that it is not repeated if a later task fails
+                self.save_state()
+        self.end_time = time.time()
+        if failure is not None:
+            raise failure
+        return stale_order
+
+    def phase_report(self):
+        """
+        Summarise the timings of the tasks that were run. Tasks are grouped into phases by the part of their name
+        preceding the first colon e.g. map:strain belongs to the map phase
+        :return: phases: Dictionary of phase: dictionary of 'tasks': number of tasks run, 'start' and 'end': time of the
+        first start and last end relative to the start of the run, 'busy': time during which at least one task of the
+        phase was running, and 'overlap': part of the busy time during which tasks of other phases were also running
+        :return: utilisation: Thread-seconds used by the tasks divided by the thread-seconds available during the run
+        """
+        phase_intervals = dict()
+        used = 0
+        for name, (start, end) in self.timings.items():
+            phase_intervals.setdefault(name.split(':')[0], list()).append((start - self.start_time,
+                                                                           end - self.start_time))
+            used += min(max(1, int(self.tasks[name].threads)), self.budget) * (end - start)
+        # Merge the overlapping intervals of each phase
+        phase_busy = dict()
+        for phase, intervals in phase_intervals.items():
+            merged = list()
+            for start, end in sorted(intervals):
+                if merged and start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            phase_busy[phase] = merged
+        phases = dict()
+        for phase, merged in phase_busy.items():
+            overlap = 0
+            for start, end in merged:
+                # Merge the busy intervals of the other phases that intersect this interval
+                others = sorted((max(start, other_start), min(end, other_end))
+                                for other_phase, other_merged in phase_busy.items() if other_phase != phase
+                                for other_start, other_end in other_merged
+                                if other_start < end and other_end > start)
+                covered_end = start
+                for other_start, other_end in others:
+                    overlap += max(0, other_end - max(other_start, covered_end))
+                    covered_end = max(covered_end, other_end)
+            phases[phase] = {'tasks': len(phase_intervals[phase]),
+                             'start': merged[0][0],
+                             'end': max(end for _, end in merged),
+                             'busy': sum(end - start for start, end in merged),
+                             'overlap': overlap}
+        wall_time = self.end_time - self.start_time
+        utilisation = used / (self.budget * wall_time) if wall_time > 0 else 0
+        return phases, utilisation
+
+    def write_phase_report(self, report_file):
+        """
+        Append the summary of the phases of the run to a report file
+        :param report_file: type STR: Absolute path to the report file
+        :return: utilisation: Thread utilisation of the run
+        """
+        phases, utilisation = self.phase_report()
+        write_header = not os.path.isfile(report_file)
+        with open(report_file, 'a+') as report:
+            if write_header:
+                report.write('Phase\tTasks\tStart\tEnd\tBusyTime\tOverlapTime\n')
+            for phase, summary in phases.items():
+                report.write('{phase}\t{tasks}\t{start:.2f}\t{end:.2f}\t{busy:.2f}\t{overlap:.2f}\n'
+                             .format(phase=phase,
+                                     **summary))
+            report.write('# Threads: {threads}, wall time: {wall_time:.2f}, utilisation: {utilisation:.1%}\n'
+                         .format(threads=self.budget,
+                                 wall_time=self.end_time - self.start_time,
+                                 utilisation=utilisation))
+        return utilisation
+
+    def __init__(self, state_file=None):
+        self.state_file = state_file
+        self.tasks = dict()
+        # Dictionary of task name: return value of the task function
+        self.results = dict()
+        # Dictionary of task name: (start time, end time) of the tasks that were run
+        self.timings = dict()
+        self.budget = 1
+        self.start_time = 0
+        self.end_time = 0
+        self.state = {'tasks': dict(), 'files': dict()}
+        self.state_lock = threading.Lock()
+        if state_file and os.path.isfile(state_file):
+            with open(state_file, 'r') as state:
+                self.state = json.load(state)
@@ -1,22 +1,34 @@
 #!/usr/bin/env python3
 from olctools.accessoryFunctions.accessoryFunctions import make_path, run_subprocess, write_to_logfile
-from Bio.SeqRecord import SeqRecord
-from Bio.Alphabet import IUPAC
+from cowsnphr_src.codon_effects import CodonEffects
+from cowsnphr_src.gvcf_store import GVCFStore, MATCH, PASS, INSERTION, DELETION
+from cowsnphr_src.feature_index import FeatureIndex
+from cowsnphr_src.interval_mask import IntervalMask
 from Bio.Seq import Seq
 from Bio import SeqIO
+from multiprocessing.pool import ThreadPool
 import multiprocessing
 from ete3 import Tree
 from glob import glob
 import xlsxwriter
+import hashlib
+import filecmp
+import zipfile
 import shutil
+import time
 import pandas
+import numpy
+import json
 import gzip
-import math
 import xlrd
 import os
 
 __author__ = 'adamkoziol'
 
+# Largest number of columns and rows in an Excel worksheet
+XLSX_MAX_COLUMNS = 16384
+XLSX_MAX_ROWS = 1048576
+
 
 class TreeMethods(object):
 
@@ -90,11 +102,13 @@ class TreeMethods(object):
         strain_list = [strain_name for strain_name in strain_vcf_dict]
         # Determine the number of strains present in the analyses
         list_length = len(strain_list)
+        # Only supply each worker with the path to its own gVCF file rather than the complete dictionary
+        strain_path_list = [{strain_name: strain_vcf_dict[strain_name]} for strain_name in strain_list]
         # Use multiprocessing.Pool.starmap to process the samples in parallel
         # Supply the list of strains, as well as a list the length of the number of strains of each required variable
         for parsed_vcf, strain_best_ref, strain_best_ref_set in p.starmap(TreeMethods.load_gvcf_multiprocessing,
                                                                           zip(strain_list,
-                                                                              [strain_vcf_dict] * list_length,
+                                                                              strain_path_list,
                                                                               [qual_cutoff] * list_length)):
             # Update the dictionaries
             strain_parsed_vcf_dict.update(parsed_vcf)
@@ -108,13 +122,12 @@ class TreeMethods(object):
     @staticmethod
     def load_gvcf_multiprocessing(strain_name, strain_vcf_dict, qual_cutoff):
         """
-        Load the gVCF files into a dictionary
+        Load the gVCF file of a single strain into a GVCFStore
         :param strain_name: type STR: Name of strain being processed
         :param strain_vcf_dict: type DICT: Dictionary of strain name: absolute path to gVCF file
         :param qual_cutoff: type INT: Quality cutoff value to use.
-        :return: parsed_vcf_dict: Dictionary of strain name: key: value pairs CHROM': ref_genome, 'REF': ref base,
-            'ALT': alt base, 'QUAL': quality score, 'LENGTH': length of feature, 'FILTER': deepvariant filter call,
-            'STATS': dictionary of format data
+        :return: parsed_vcf_dict: Dictionary of strain name: GVCFStore of parsed records. Zero coverage blocks are
+            stored as deletion intervals
         :return: strain_best_ref_dict: Dictionary of strain name: reference genome parsed from gVCF file. Note that
             this will select only a single 'best reference genome' even if there are multiple contigs in the file
             against which this strain was reference mapped
@@ -143,7 +156,7 @@ class TreeMethods(object):
         strain_best_ref_dict = dict()
         strain_best_ref_set_dict = dict()
         vcf_file = strain_vcf_dict[strain_name]
-        strain_parsed_vcf_dict[strain_name] = dict()
+        store = GVCFStore(strain_name=strain_name)
         # Use gzip to open the compressed file
         with gzip.open(vcf_file, 'r') as gvcf:
             for line in gvcf:
@@ -156,14 +169,14 @@ class TreeMethods(object):
                         subline = subline.decode()
                         # Split the line on tabs. The components correspond to the #CHROM comment above
                         ref_genome, pos, id_stat, ref, alt_string, qual, filter_stat, info_string, format_stat, \
-                            strain = subline.split('\t')
+                            strain = subline.rstrip().split('\t')
                         # The 'Format' entry consists of several components: GT:GQ:DP:AD:VAF:PL for SNP positions,
                         # and GT:GQ:MIN_DP:PL for all other entries (see quoted information above)
                         # Perform a dictionary comprehension to associate each format component with its
                         # corresponding 'strain' component e.g. FORMAT: GT:GQ:DP:AD:VAF:PL
                         # 'STRAIN' 1/1:54:18:0,18,0:1,0:60,55,0,990,990,990 yields'GT': '1/1', 'GQ': 54, 'DP': '18',
                         # 'AD': 18:0,18,0, 'VAF': 1,0, 'PL': 60,55,0,990,990,990
-                        format_dict = {value: strain.split(':')[i].rstrip()
+                        format_dict = {value: strain.split(':')[i]
                                        for i, value in enumerate(format_stat.split(':'))}
                         # Initialise the dictionary as required
                         if strain_name not in strain_best_ref_dict:
@@ -177,8 +190,6 @@ class TreeMethods(object):
                             info = info_string.split('END=')[1]
                         else:
                             info = pos
-                        # Initialise a string to store the sanitised 'ALT" call
-                        alt = str()
                         # For SNP calls, the alt_string will look like this: G,<*>, or A,G,<*>, while matches are
                         # simply <*>. Replace the <*> with the reference call, and create a list by splitting on
                         # commas
@@ -187,206 +198,281 @@ class TreeMethods(object):
                         alt_length = 1
                         # Check if the length of the list is greater than 1 i.e. a SNP call
                         if len(alt_split) > 1:
-                            # Iterate through the list
-                            for sub_alt in alt_split:
-                                # Add each allele to the alt string e.g. initial G,<*> -> G, T -> GT, and A,G,<*> ->
-                                # A, G, C -> AGC
-                                alt += sub_alt
-                                # If there is an insertion, e.g. CGAGACCG,<*>, set alt_length to the length of the
-                                # insertion
-                                if len(sub_alt) > alt_length:
-                                    alt_length = len(sub_alt)
+                            # If there is an insertion, e.g. CGAGACCG,<*>, set alt_length to the length of the
+                            # insertion
+                            alt_length = max(alt_length, max(len(sub_alt) for sub_alt in alt_split))
                         # Typecast pos to be an integer
                         pos = int(pos)
-                        if ref_genome not in strain_parsed_vcf_dict[strain_name]:
-                            strain_parsed_vcf_dict[strain_name][ref_genome] = dict()
                         # SNPs must have a deepvariant filter of 'PASS', be of length one, and have a quality
                         # score above the threshold
                         if filter_stat == 'PASS' and len(ref) == 1 and alt_length == 1 and float(qual) > qual_cutoff:
-                            # Populate the dictionary with the required key: value pairs
-                            strain_parsed_vcf_dict[strain_name][ref_genome][pos] = {
-                                'CHROM': ref_genome,
-                                'REF': ref,
-                                'ALT': alt,
-                                'QUAL': qual,
-                                'LENGTH': 1,
-                                'FILTER': filter_stat,
-                                'STATS': format_dict
-                            }
+                            store.add_record(chrom=ref_genome,
+                                             pos=pos,
+                                             filter_code=PASS,
+                                             ref=ref,
+                                             alt=alt_string,
+                                             qual=qual,
+                                             length=1,
+                                             format_stat=format_stat,
+                                             strain_info=strain,
+                                             depth=int(format_dict.get('DP', 0)))
                         # Insertions must still have a deepvariant filter of 'PASS', but must have a length
                         # greater than one
                         elif filter_stat == 'PASS' and alt_length > 1:
-                            strain_parsed_vcf_dict[strain_name][ref_genome][pos] = {
-                                'CHROM': ref_genome,
-                                'REF': ref,
-                                'ALT': alt,
-                                'QUAL': qual,
-                                'LENGTH': alt_length,
-                                'FILTER': 'INSERTION',
-                                'STATS': format_dict
-                            }
+                            store.add_record(chrom=ref_genome,
+                                             pos=pos,
+                                             filter_code=INSERTION,
+                                             ref=ref,
+                                             alt=alt_string,
+                                             qual=qual,
+                                             length=alt_length,
+                                             format_stat=format_stat,
+                                             strain_info=strain,
+                                             depth=int(format_dict.get('DP', 0)))
                         # If the position in the 'info' field does not match pos, and the minimum depth of a gVCF
-                        # block is 0, this is considered a deletion
-                        elif int(info) != pos and format_dict['MIN_DP'] == 0:
-                            # Subtract the starting position (pos) from the final position (info)
-                            length = int(info) - pos
-                            # Iterate through the range of the deletion, and populate the dictionary for each
-                            # position encompassed by this range (add +1 due to needing to include the final
-                            # position in the dictionary)
-                            for i in range(int(pos), int(info) + 1):
-                                strain_parsed_vcf_dict[strain_name][ref_genome][i] = {
-                                    'CHROM': ref_genome,
-                                    'REF': ref,
-                                    'ALT': alt,
-                                    'QUAL': qual,
-                                    'LENGTH': length,
-                                    'FILTER': 'DELETION',
-                                    'STATS': format_dict
-                                }
+                        # block is 0, this is considered a deletion. Store the block as a single interval
+                        elif int(info) != pos and format_dict.get('MIN_DP') == '0':
+                            store.add_deletion(chrom=ref_genome,
+                                               start=pos,
+                                               end=int(info),
+                                               ref=ref,
+                                               qual=qual)
+        strain_parsed_vcf_dict[strain_name] = store.finalise()
         return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
 
     @staticmethod
-    def load_vcf(strain_vcf_dict, min_depth=10):
+    def load_vcf(strain_vcf_dict, min_depth=10, threads=1, cache=False):
         """
-        Using vcf.Reader(), load the VCF files. Store the Reader objects, as well as the extracted reference sequence,
-        and its associated species code in dictionaries
+        Load the gVCF files into compact, array-backed GVCFStore objects. Store the parsed records, as well as the
+        extracted reference sequence(s) in dictionaries. Files are parsed concurrently in a multiprocessing pool
         :param strain_vcf_dict: type DICT: Dictionary of strain name: list of absolute path to VCF file
         :param min_depth: type INT: Integer of the minimum mapping depth at a site in order for it to be considered
         in the analysis
-        :return: strain_vcf_object_dict: Dictionary of strain name: VCF Reader object
+        :param threads: type INT: Number of processes to run concurrently. Default is 1
+        :param cache: type BOOL: Whether to reuse, and create, the parsed gVCF cache file stored next to each gVCF file
+        :return: strain_parsed_vcf_dict: Dictionary of strain name: GVCFStore of parsed records
         :return: strain_best_ref_dict: Dictionary of strain name: extracted reference genome name
+        :return: strain_best_ref_set_dict: Dictionary of strain name: set of extracted reference genome names
         """
         # Initialise dictionaries to store the parsed gVCF outputs and the closest reference genome
         strain_parsed_vcf_dict = dict()
         strain_best_ref_dict = dict()
         strain_best_ref_set_dict = dict()
-        for strain_name, vcf_file in strain_vcf_dict.items():
-            strain_parsed_vcf_dict[strain_name] = dict()
+        # Create a list of all the strain names, and one of the arguments to supply to load_vcf_strain. Each worker
+        # only receives the path to the single file it is parsing
+        strain_list = list(strain_vcf_dict)
+        arguments = [(strain_name, strain_vcf_dict[strain_name], min_depth) for strain_name in strain_list]
+        # Limit the number of processes to the number of threads, and to the number of files
+        processes = max(min(int(threads), len(strain_list)), 1)
+        # Only parse the files without a valid cache file if caching is requested
+        load_function = TreeMethods.load_vcf_strain_cached if cache else TreeMethods.load_vcf_strain
+        if processes > 1:
+            # Each worker returns a GVCFStore, which is pickled as a handful of NumPy buffers and a sparse dictionary
+            # of variant calls. Use a chunksize of one, as the gVCF files can vary considerably in size
+            p = multiprocessing.Pool(processes=processes)
+            results = p.starmap(load_function, arguments, chunksize=1)
+            # Close and join the pool
+            p.close()
+            p.join()
+        else:
+            results = [load_function(*argument) for argument in arguments]
+        # starmap returns the results in the same order as the supplied arguments
+        for strain_name, (parsed_vcf, best_ref, best_ref_set) in zip(strain_list, results):
+            strain_parsed_vcf_dict[strain_name] = parsed_vcf
+            # Only populate the reference dictionaries if the file contained records
+            if best_ref:
+                strain_best_ref_dict[strain_name] = best_ref
+                strain_best_ref_set_dict[strain_name] = best_ref_set
+        return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
+
+    @staticmethod
+    def load_vcf_strain(strain_name, vcf_file, min_depth=10):
+        """
+        Parse a single gVCF file into a GVCFStore
+        :param strain_name: type STR: Name of strain being processed
+        :param vcf_file: type STR: Absolute path to the gVCF file
+        :param min_depth: type INT: Integer of the minimum mapping depth at a site in order for it to be considered
+        in the analysis
+        :return: store: GVCFStore of parsed records
+        :return: best_ref: Name of the first reference genome parsed from the gVCF file
+        :return: best_ref_set: Set of all reference genomes parsed from the gVCF file
+        """
+        store = GVCFStore(strain_name=strain_name)
+        best_ref = str()
+        best_ref_set = set()
+        if vcf_file.endswith('.gz'):
+            # Use gzip to open the compressed gVCF file
+            filtered = gzip.open(vcf_file, 'r')
+        else:
+            filtered = open(vcf_file, 'r')
+        for line in filtered:
             if vcf_file.endswith('.gz'):
-                # Use gzip to open the compressed gVCF file
-                filtered = gzip.open(vcf_file, 'r')
+                # Convert the line to a string from bytes
+                line = line.decode()
+            # Skip the VCF file header information
+            if line.startswith('#'):
+                continue
+            # Split the line based on the columns
+            ref_genome, pos, id_stat, ref, alt_string, qual, filter_stat, info_string, \
+                format_stat, strain_info = line.rstrip().split('\t')
+            # Set the best reference genome to the first reference genome in the file
+            if not best_ref:
+                best_ref = ref_genome
+            best_ref_set.add(ref_genome)
+            # Typecast pos to int
+            pos = int(pos)
+            # The 'Format' entry consists of several components: GT:GQ:DP:AD:VAF:PL for SNP positions,
+            # and GT:GQ:MIN_DP:PL for gVCF blocks. Associate each format component with its corresponding 'strain'
+            # component
+            format_dict = {category: value for category, value in zip(format_stat.split(':'),
+                                                                      strain_info.split(':'))}
+            deletion = format_dict.get('MIN_DP') == '0'
+            if deletion:
+                # The block of deleted sequence will stretch from the current position until the 'END='
+                # position e.g.
+                # Contig_1_138.744  136699  . A  <*> 0 . END=136738 GT:GQ:MIN_DP:PL 0/0:1:0:0,0,0
+                # the deletion is from 136699 - 136738
+                end_str, end_pos = info_string.split('=')
+                # Store the zero coverage block as a single (start, end) interval rather than expanding it into an
+                # entry for every position
+                store.add_deletion(chrom=ref_genome,
+                                   start=pos,
+                                   end=int(end_pos),
+                                   ref=ref,
+                                   qual=qual)
+            try:
+                depth = float(format_dict['DP'].split(',')[0])
+            except KeyError:
+                depth = 0
+            if len(ref) == 1:
+                # Populate the store with the appropriate filter information
+                if filter_stat == 'PASS':
+                    split_alt = alt_string.split(',')[0]
+                    if depth >= min_depth:
+                        # Populate the store with the high quality SNPs
+                        store.add_record(chrom=ref_genome,
+                                         pos=pos,
+                                         filter_code=PASS,
+                                         ref=ref,
+                                         alt=alt_string,
+                                         qual=qual,
+                                         length=len(split_alt),
+                                         format_stat=format_stat,
+                                         strain_info=strain_info,
+                                         depth=int(depth))
+                # Populate the store with the regions that match. Do not overwrite deleted positions
+                elif not deletion:
+                    store.add_record(chrom=ref_genome,
+                                     pos=pos,
+                                     filter_code=MATCH,
+                                     ref=ref,
+                                     alt=alt_string,
+                                     qual=qual,
+                                     length=1,
+                                     format_stat=format_stat,
+                                     strain_info=strain_info,
+                                     depth=int(depth) if depth else int(format_dict.get('MIN_DP', 0)),
+                                     replace=False)
+            # Store all indels
             else:
-                filtered = open(vcf_file, 'r')
-            for line in filtered:
-                if vcf_file.endswith('.gz'):
-                    # Convert the line to a string from bytes
-                    line = line.decode()
-                # Add the VCF file header information to the filtered file
-                if line.startswith('#'):
-                    pass
-                else:
-                    # Split the line based on the columns
-                    ref_genome, pos, id_stat, ref, alt_string, qual, filter_stat, info_string, \
-                        format_stat, strain_info = line.rstrip().split('\t')
-                    # Initialise the ref_genome key
-                    if ref_genome not in strain_parsed_vcf_dict[strain_name]:
-                        strain_parsed_vcf_dict[strain_name][ref_genome] = dict()
-                    # Initialise the dictionary as required
-                    if strain_name not in strain_best_ref_dict:
-                        strain_best_ref_dict[strain_name] = ref_genome
-                        strain_best_ref_set_dict[strain_name] = {ref_genome}
-                    else:
-                        strain_best_ref_set_dict[strain_name].add(ref_genome)
-                    # # Find the depth entry. e.g. DP=11
-                    # depth_group = re.search('(DP=[0-9]+)', info_string)
-                    # # Split the depth matching group on '=' and convert the depth to an int
-                    # depth = int(str(depth_group.group()).split('=')[1])
-                    # Typecast pos to int
-                    pos = int(pos)
-                    # The 'Format' entry consists of several components: GT:DP:AD:RO:QR:AO:QA:GL for SNP positions,
-                    # andGQ:DP:MIN_DP:QR:RO:QA:AO for all other entries (see quoted information above)
-                    # Perform a dictionary comprehension to associate each format component with its
-                    # corresponding 'strain' component
-                    format_dict = dict()
-                    for i, category in enumerate(format_stat.split(':')):
-                        #
-                        value = strain_info.split(':')[i]
-                        format_dict[category] = value
-                        if category == 'MIN_DP' and value == '0':
-                            # The block of deleted sequence will stretch from the current position until the 'END='
-                            # position e.g.
-                            # Contig_1_138.744  136699  . A  <*> 0 . END=136738 GT:GQ:MIN_DP:PL 0/0:1:0:0,0,0
-                            # the deletion is from 136699 - 136738
-                            # Split the 'END=136738' string on the '='
-                            end_str, end_pos = info_string.split('=')
-                            # Typecast the string to an integer
-                            end_pos = int(end_pos)
-                            # If the end position is not the same as the current position, the deletion is larger than
-                            # one bp, iterate through the range of missing positions, and add them all to the dictionary
-                            if int(end_pos) > pos:
-                                for del_pos in range(pos, end_pos + 1):
-                                    # Store the zero coverage entries
-                                    strain_parsed_vcf_dict[strain_name][ref_genome][del_pos] = {
-                                        'CHROM': ref_genome,
-                                        'REF': ref,
-                                        'ALT': alt_string,
-                                        'QUAL': qual,
-                                        'LENGTH': 1,
-                                        'FILTER': 'DELETION',
-                                        'STATS': format_dict
-                                    }
-                            else:
-                                # Store the zero coverage entries for the one bp deletions
-                                strain_parsed_vcf_dict[strain_name][ref_genome][pos] = {
-                                    'CHROM': ref_genome,
-                                    'REF': ref,
-                                    'ALT': alt_string,
-                                    'QUAL': qual,
-                                    'LENGTH': 1,
-                                    'FILTER': 'DELETION',
-                                    'STATS': format_dict
-                                }
-                    try:
-                        depth = float(format_dict['DP'].split(',')[0])
-                    except KeyError:
-                        depth = 0
-                    if len(ref) == 1:
-                        # Populate the dictionary with the appropriate filter information
-                        if filter_stat == 'PASS':
-                            split_alt = alt_string.split(',')[0]
-                            if depth >= min_depth:
-                                # Populate the dictionaries with the number of high quality SNPs
-                                strain_parsed_vcf_dict[strain_name][ref_genome][pos] = {
-                                    'CHROM': ref_genome,
-                                    'REF': ref,
-                                    'ALT': alt_string,
-                                    'QUAL': qual,
-                                    'LENGTH': len(split_alt),
-                                    'FILTER': 'PASS',
-                                    'STATS': format_dict
-                                }
-                        else:
-                            if pos not in strain_parsed_vcf_dict[strain_name][ref_genome]:
-                                # Populate the dictionaries with the regions that match
-                                strain_parsed_vcf_dict[strain_name][ref_genome][pos] = {
-                                    'CHROM': ref_genome,
-                                    'REF': ref,
-                                    'ALT': alt_string,
-                                    'QUAL': qual,
-                                    'LENGTH': 1,
-                                    'FILTER': 'MATCH',
-                                    'STATS': format_dict
-                                }
-                    # Store all indels
-                    else:
-                        strain_parsed_vcf_dict[strain_name][ref_genome][pos] = {
-                            'CHROM': ref_genome,
-                            'REF': ref,
-                            'ALT': alt_string,
-                            'QUAL': qual,
-                            'LENGTH': len(alt_string),
-                            'FILTER': 'INSERTION',
-                            'STATS': format_dict
-                        }
-            filtered.close()
-        return strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict
+                store.add_record(chrom=ref_genome,
+                                 pos=pos,
+                                 filter_code=INSERTION,
+                                 ref=ref,
+                                 alt=alt_string,
+                                 qual=qual,
+                                 length=len(alt_string),
+                                 format_stat=format_stat,
+                                 strain_info=strain_info,
+                                 depth=int(depth))
+        filtered.close()
+        return store.finalise(), best_ref, best_ref_set
+
+    @staticmethod
+    def load_vcf_strain_cached(strain_name, vcf_file, min_depth=10):
+        """
+        Load the parsed gVCF records of a single strain from the cache file stored next to the gVCF file. The cache is
+        only used if the size and modification time of the gVCF file, or its size and SHA-1 hash, as well as the
+        minimum depth, match the values recorded when the cache was created. Otherwise, the gVCF file is parsed with
+        load_vcf_strain, and the cache is (re)written
+        :param strain_name: type STR: Name of strain being processed
+        :param vcf_file: type STR: Absolute path to the gVCF file
+        :param min_depth: type INT: Integer of the minimum mapping depth at a site in order for it to be considered
+        in the analysis
+        :return: store: GVCFStore of parsed records
+        :return: best_ref: Name of the first reference genome parsed from the gVCF file
+        :return: best_ref_set: Set of all reference genomes parsed from the gVCF file
+        """
+        cache_file = TreeMethods.gvcf_cache_file(vcf_file=vcf_file)
+        vcf_stat = os.stat(vcf_file)
+        file_hash = str()
+        if os.path.isfile(cache_file):
+            try:
+                metadata = GVCFStore.load_metadata(path=cache_file)
+                valid = metadata['strain_name'] == strain_name and metadata['min_depth'] == min_depth \
+                    and metadata['size'] == vcf_stat.st_size
+                # A changed modification time (e.g. the file was copied) only invalidates the cache if the contents
+                # of the file changed as well
+                if valid and metadata['mtime'] != vcf_stat.st_mtime_ns:
+                    file_hash = TreeMethods.file_hash(file_name=vcf_file)
+                    valid = metadata['hash'] == file_hash
+                if valid:
+                    store, metadata = GVCFStore.load(path=cache_file)
+                    return store, metadata['best_ref'], set(metadata['best_ref_set'])
+            # Unreadable, truncated, or outdated cache files are simply replaced
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                pass
+        store, best_ref, best_ref_set = TreeMethods.load_vcf_strain(strain_name=strain_name,
+                                                                    vcf_file=vcf_file,
+                                                                    min_depth=min_depth)
+        if not file_hash:
+            file_hash = TreeMethods.file_hash(file_name=vcf_file)
+        try:
+            store.save(path=cache_file,
+                       metadata={
+                           'size': vcf_stat.st_size,
+                           'mtime': vcf_stat.st_mtime_ns,
+                           'hash': file_hash,
+                           'min_depth': min_depth,
+                           'best_ref': best_ref,
+                           'best_ref_set': sorted(best_ref_set)
+                       })
+        # A read-only folder only means that the file will be parsed again on the next run
+        except OSError:
+            pass
+        return store, best_ref, best_ref_set
+
+    @staticmethod
+    def gvcf_cache_file(vcf_file):
+        """
+        Determine the name of the parsed gVCF cache file of the supplied gVCF file. The name must not match the
+        *.gvcf* pattern used by file_list e.g. /path/to/03-1057.gvcf.gz will return /path/to/03-1057_parsed.npz
+        :param vcf_file: type STR: Absolute path to the gVCF file
+        :return: Absolute path to the cache file
+        """
+        base_name = vcf_file[:-3] if vcf_file.endswith('.gz') else vcf_file
+        base_name = os.path.splitext(base_name)[0]
+        return '{base_name}_parsed.npz'.format(base_name=base_name)
+
+    @staticmethod
+    def file_hash(file_name, block_size=1048576):
+        """
+        Calculate the SHA-1 hash of the supplied file
+        :param file_name: type STR: Absolute path to the file
+        :param block_size: type INT: Number of bytes to read at once. Default is 1 MiB
+        :return: Hex digest of the hash
+        """
+        sha1 = hashlib.sha1()
+        with open(file_name, 'rb') as hash_file:
+            for block in iter(lambda: hash_file.read(block_size), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
 
     @staticmethod
     def summarise_gvcf_outputs(strain_parsed_vcf_dict):
         """
         Count the number of locations that PASS filter (SNP call), are considered INSERTIONS, or DELETIONS
-        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: reference position: parsed VCF dictionary
-        for that reference position
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: GVCFStore of parsed records
         :return: pass_dict: Dictionary of strain name: number of locations with 'PASS' filter
         :return: insertion_dict: Dictionary of strain name: number of locations with 'INSERTION' filter
         :return: deletion_dict: Dictionary of strain name: number of locations with 'DELETION' filter
@@ -395,24 +481,13 @@ class TreeMethods(object):
         pass_dict = dict()
         insertion_dict = dict()
         deletion_dict = dict()
-        for strain_name, ref_dict in strain_parsed_vcf_dict.items():
-            # Add the strain name key to the dictionaries
-            pass_dict[strain_name] = 0
-            insertion_dict[strain_name] = 0
-            deletion_dict[strain_name] = 0
-            for ref_chrom, pos_dict in ref_dict.items():
-                for pos, filter_dict in pos_dict.items():
-                    # Extract the value from the 'FILTER' key from the dictionary
-                    filter_value = filter_dict['FILTER']
-                    # Increment the appropriate dictionary if the filter matches
-                    if filter_value == 'PASS':
-                        pass_dict[strain_name] += 1
-                    # As the dictionary is based on the reference position, insertions will be considered a single base
-                    # Use the 'LENGTH filter to add the total insertion length to the dictionary
-                    elif filter_value == 'INSERTION':
-                        insertion_dict[strain_name] += filter_dict['LENGTH']
-                    elif filter_value == 'DELETION':
-                        deletion_dict[strain_name] += 1
+        for strain_name, store in strain_parsed_vcf_dict.items():
+            # Count the records with each filter code directly from the columnar store
+            pass_dict[strain_name] = store.count(PASS)
+            # As the store is based on the reference position, insertions will be considered a single base
+            # Use the 'LENGTH' column to add the total insertion length to the dictionary
+            insertion_dict[strain_name] = store.total_length(INSERTION)
+            deletion_dict[strain_name] = store.count(DELETION)
         return pass_dict, insertion_dict, deletion_dict
 
     @staticmethod
@@ -540,7 +615,7 @@ class TreeMethods(object):
         """
         Parse the gVCF files, and extract all the query and reference genome-specific SNP locations as well as the
         reference sequence
-        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: dictionary of parsed VCF data
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: GVCFStore of parsed VCF data
         :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
         :return: consolidated_ref_snp_positions: Dictionary of reference name: reference chromosome: pos: ref sequence
         :return: ref_snp_positions: Dictionary of reference chromosome name: absolute position: reference base call
@@ -551,6 +626,14 @@ class TreeMethods(object):
         consolidated_ref_snp_positions = dict()
         strain_snp_positions = dict()
         ref_snp_positions = dict()
+        # Deleted positions are stored as intervals. Only the deleted positions that are SNP positions in any strain
+        # are required in the dictionaries, so find all the 'PASS' positions first
+        chrom_pass_positions = dict()
+        for strain_name, ref_dict in strain_parsed_vcf_dict.items():
+            for chrom, calls in ref_dict.items():
+                chrom_pass_positions.setdefault(chrom, list()).append(calls.filter_positions(PASS))
+        for chrom, position_arrays in chrom_pass_positions.items():
+            chrom_pass_positions[chrom] = numpy.unique(numpy.concatenate(position_arrays))
         for strain_name, ref_dict in strain_parsed_vcf_dict.items():
             best_ref = strain_consolidated_ref_dict[strain_name]
             strain_snp_positions[strain_name] = dict()
@@ -558,21 +641,25 @@ class TreeMethods(object):
             if best_ref not in consolidated_ref_snp_positions:
                 consolidated_ref_snp_positions[best_ref] = dict()
             # Iterate through all the positions
-            for ref_chrom, vcf_dict in ref_dict.items():
-                for pos, pos_dict in vcf_dict.items():
-                    chrom = pos_dict['CHROM']
-                    if chrom not in ref_snp_positions:
-                        ref_snp_positions[chrom] = dict()
-                    if chrom not in strain_snp_positions[strain_name]:
-                        strain_snp_positions[strain_name][chrom] = list()
-                    if chrom not in consolidated_ref_snp_positions[best_ref]:
-                        consolidated_ref_snp_positions[best_ref][chrom] = dict()
-                    consolidated_ref_snp_positions[best_ref][chrom][pos] = pos_dict['REF']
-                    # Only consider locations that are called 'PASS' in the dictionary
-                    if pos_dict['FILTER'] == 'PASS':
-                        # Populate the dictionary with the position and the reference sequence at that position
-                        ref_snp_positions[chrom][pos] = pos_dict['REF']
-                        strain_snp_positions[strain_name][chrom].append(pos)
+            for chrom, calls in ref_dict.items():
+                if chrom not in ref_snp_positions:
+                    ref_snp_positions[chrom] = dict()
+                if chrom not in strain_snp_positions[strain_name]:
+                    strain_snp_positions[strain_name][chrom] = list()
+                if chrom not in consolidated_ref_snp_positions[best_ref]:
+                    consolidated_ref_snp_positions[best_ref][chrom] = dict()
+                consolidated_ref_snp_positions[best_ref][chrom].update(zip(calls.positions.tolist(),
+                                                                           calls.ref_bases()))
+                # Deleted positions use the 'REF' entry of the zero coverage block
+                deleted_positions = chrom_pass_positions[chrom][calls.deleted(chrom_pass_positions[chrom])]
+                for pos in deleted_positions.tolist():
+                    consolidated_ref_snp_positions[best_ref][chrom][pos] = \
+                        chr(calls.deletion_refs[calls.deletion_index(pos)])
+                # Only consider locations that are called 'PASS' in the store
+                for pos in calls.filter_positions(PASS).tolist():
+                    # Populate the dictionary with the position and the reference sequence at that position
+                    ref_snp_positions[chrom][pos] = consolidated_ref_snp_positions[best_ref][chrom][pos]
+                    strain_snp_positions[strain_name][chrom].append(pos)
         return consolidated_ref_snp_positions, strain_snp_positions, ref_snp_positions
 
     @staticmethod
@@ -671,13 +758,14 @@ class TreeMethods(object):
         return group_positions_set
 
     @staticmethod
-    def density_filter_snps(group_positions_set, window_size=1000, threshold=2):
+    def density_filter_snps(group_positions_set, window_size=1000, threshold=2, threads=1):
         """
         Remove any SNPs from regions of a defined window size with two or more SNPs
         :param group_positions_set: type DICT: Dictionary of species code: group name: reference chromosome: set of
         group-specific SNP positions
         :param window_size: type INT: Window size to use when filtering SNPs. Default is 1000
         :param threshold: type INT: Number of SNPs present within the window to trigger filtering
+        :param threads: type INT: Number of reference chromosomes to filter concurrently. Default is 1
         :return: filtered_group_positions: Dictionary of species code: group name: reference chromosome: set of SNP
         unfiltered SNP positions
         """
@@ -685,6 +773,8 @@ class TreeMethods(object):
         bp_range = int(window_size / 2)
         # Initialise a dictionary to store the SNPs that pass filter
         filtered_group_positions = dict()
+        # Create a list of all the species, group, reference chromosome combinations to filter
+        chrom_list = list()
         for species, group_dict in group_positions_set.items():
             # Initialise the species key
             filtered_group_positions[species] = dict()
@@ -692,21 +782,41 @@ class TreeMethods(object):
                 # Initialise the group key
                 filtered_group_positions[species][group] = dict()
                 for ref_chrom, pos_list in ref_dict.items():
-                    if ref_chrom not in filtered_group_positions[species][group]:
-                        filtered_group_positions[species][group][ref_chrom] = set()
-                    for pos in pos_list:
-                        # Count of SNPs in range of this SNP
-                        add_pos = 0
-                        # Simple window of 1001 bp (pos - 500 to pos + 500)
-                        for i in range(pos - bp_range, pos + bp_range):
-                            # If there is another SNP in this range, increment add_pos
-                            if i in pos_list and i != pos:
-                                add_pos += 1
-                        # If the position passes the filter, add it to the dictionary
-                        if add_pos <= threshold:
-                            filtered_group_positions[species][group][ref_chrom].add(pos)
+                    chrom_list.append((species, group, ref_chrom, pos_list))
+        if int(threads) > 1 and len(chrom_list) > 1:
+            # The searches release the GIL, so the chromosomes can be filtered in a thread pool
+            p = ThreadPool(processes=min(int(threads), len(chrom_list)))
+            filtered_positions = p.starmap(TreeMethods.density_filter_positions,
+                                           [(pos_list, bp_range, threshold) for _, _, _, pos_list in chrom_list])
+            p.close()
+            p.join()
+        else:
+            filtered_positions = [TreeMethods.density_filter_positions(pos_list, bp_range, threshold)
+                                  for _, _, _, pos_list in chrom_list]
+        for (species, group, ref_chrom, _), position_set in zip(chrom_list, filtered_positions):
+            filtered_group_positions[species][group][ref_chrom] = position_set
         return filtered_group_positions
 
+    @staticmethod
+    def density_filter_positions(pos_list, bp_range, threshold):
+        """
+        Find the SNP positions of a single reference chromosome that pass the density filter. The window of a position
+        is pos - bp_range to pos + bp_range - 1. The number of other SNPs within the window is determined with two
+        binary searches of the sorted positions rather than by probing every base of the window
+        :param pos_list: type ITERABLE: SNP positions on the reference chromosome
+        :param bp_range: type INT: Half of the window size
+        :param threshold: type INT: Maximum number of other SNPs allowed within the window
+        :return: Set of the positions that pass the filter
+        """
+        positions = numpy.unique(numpy.fromiter(pos_list, dtype=numpy.int64))
+        # Count the SNPs within the window of each position
+        window_counts = numpy.searchsorted(positions, positions + bp_range, side='left') - \
+            numpy.searchsorted(positions, positions - bp_range, side='left')
+        # The window includes the position itself unless it is empty
+        if bp_range > 0:
+            window_counts -= 1
+        return set(positions[window_counts <= threshold].tolist())
+
     @staticmethod
     def mask_ref_genome(reference_strain_dict, logfile):
         """
@@ -755,49 +865,98 @@ class TreeMethods(object):
         :param coords_dict: type DICT: Dictionary of name of reference genome: name and absolute path to the nucmer-
         generated coords file
         :param cutoff: type INT: Percentage cutoff to use for identity values
-        :return: mask_pos_dict: Dictionary of species: group: reference chromosome: set of masked positions
+        :return: mask_pos_dict: Dictionary of species: group: reference chromosome: IntervalMask of masked positions
         """
         # Initialise the dictionary to store the masked positions
         mask_pos_dict = dict()
+        # The masked regions only depend on the coords files, so only parse them if there are groups to populate
+        if not strain_groups:
+            return mask_pos_dict
+        # Dictionary of reference chromosome: list of (start, end) masked intervals
+        chrom_intervals = dict()
+        # Unpack the reference name: name and path of coords file dictionary
+        for ref_name, coordsfile in coords_dict.items():
+            # Each coords file is only parsed once, and the intervals are reused on subsequent runs
+            for chrom, mask in TreeMethods.load_coords_intervals(coordsfile=coordsfile,
+                                                                 cutoff=cutoff).items():
+                chrom_intervals.setdefault(chrom, list()).extend(zip(mask.starts.tolist(), mask.ends.tolist()))
+        # Merge the intervals once per reference chromosome
+        chrom_masks = {chrom: IntervalMask.from_intervals(intervals=intervals)
+                       for chrom, intervals in chrom_intervals.items()}
+        # Every species and group shares the same masks
         for species, group_list in strain_groups.items():
             if species not in mask_pos_dict:
                 mask_pos_dict[species] = dict()
             for group in group_list:
                 if group not in mask_pos_dict[species]:
-                    mask_pos_dict[species][group] = dict()
-                # Unpack the reference name: name and path of coords file dictionary
-                for ref_name, coordsfile in coords_dict.items():
-                    # Set the name and path of the output .bed file by replacing the .coords file extension with .bed
-                    bedfile = coordsfile.replace('.coords', '.bed')
-                    with open(bedfile, 'w') as bed:
-                        with open(coordsfile, 'r') as coords:
-                            for line in coords:
-                                # Ignore the header information
-                                if line.startswith('='):
-                                    for data in coords:
-                                        # Split the data line on whitespace - filter the list for non-empty values that
-                                        # are not '|'
-                                        # [S1]  [E1]| [S2] [E2]| [LEN 1] [LEN 2] |  [% IDY]  | [TAGS]
-                                        # =============================================================================
-                                        #   1   340|  1   340  |   340      340  |   100.00  | Contig_10_403 Contig_10_
-                                        s1, e1, s2, e2, len1, len2, pid, contig1, contig2 \
-                                            = [value for value in data.rstrip().split() if value and value != '|']
-                                        # Ensure that the match isn't to itself, and that the percent identity of the
-                                        # match is above the desired cutoff value
-                                        if s1 != s2 and e1 != e2 and float(pid) > cutoff:
-                                            # Write the name of the chromosome, as well as the start and end positions
-                                            # of the repeat regions to the .bed file
-                                            bed.write('{chrom}\t{chrom_start}\t{chrom_end}\n'
-                                                      .format(chrom=contig1,
-                                                              chrom_start=s1,
-                                                              chrom_end=e1))
-                                            if contig1 not in mask_pos_dict[species][group]:
-                                                mask_pos_dict[species][group][contig1] = set()
-                                            # Add the range of the masked region to the set
-                                            for i in range(int(s1), int(e1) + 1):
-                                                mask_pos_dict[species][group][contig1].add(i)
+                    mask_pos_dict[species][group] = dict(chrom_masks)
         return mask_pos_dict
 
+    @staticmethod
+    def load_coords_intervals(coordsfile, cutoff=90):
+        """
+        Load the repeat and low-complexity regions of a single nucmer-generated coords file as merged intervals. The
+        intervals are cached in a binary _intervals.npz file next to the coords file, and the cache is reused as long as
+        the size and modification time of the coords file, and the identity cutoff, are unchanged. The .bed file of the
+        masked regions is written whenever the coords file is parsed
+        :param coordsfile: type STR: Name and absolute path of the nucmer-generated coords file
+        :param cutoff: type INT: Percentage cutoff to use for identity values
+        :return: chrom_masks: Dictionary of reference chromosome: IntervalMask of masked positions
+        """
+        # Set the name and path of the output .bed file by replacing the .coords file extension with .bed
+        bedfile = coordsfile.replace('.coords', '.bed')
+        cachefile = coordsfile.replace('.coords', '_intervals.npz')
+        coords_stat = os.stat(coordsfile)
+        if os.path.isfile(cachefile) and os.path.isfile(bedfile):
+            try:
+                chrom_masks, metadata = IntervalMask.load_masks(path=cachefile)
+                if metadata['size'] == coords_stat.st_size and metadata['mtime'] == coords_stat.st_mtime_ns \
+                        and metadata['cutoff'] == cutoff:
+                    return chrom_masks
+            # Unreadable or outdated cache files are simply replaced
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                pass
+        # Dictionary of reference chromosome: list of (start, end) masked intervals
+        chrom_intervals = dict()
+        with open(bedfile, 'w') as bed:
+            with open(coordsfile, 'r') as coords:
+                for line in coords:
+                    # Ignore the header information
+                    if line.startswith('='):
+                        for data in coords:
+                            # Split the data line on whitespace - filter the list for non-empty values that
+                            # are not '|'
+                            # [S1]  [E1]| [S2] [E2]| [LEN 1] [LEN 2] |  [% IDY]  | [TAGS]
+                            # =========================================================================================
+                            #   1   340|  1   340  |   340      340  |   100.00  | Contig_10_403 Contig_10_
+                            s1, e1, s2, e2, len1, len2, pid, contig1, contig2 \
+                                = [value for value in data.rstrip().split() if value and value != '|']
+                            # Ensure that the match isn't to itself, and that the percent identity of the
+                            # match is above the desired cutoff value
+                            if s1 != s2 and e1 != e2 and float(pid) > cutoff:
+                                # Write the name of the chromosome, as well as the start and end positions
+                                # of the repeat regions to the .bed file
+                                bed.write('{chrom}\t{chrom_start}\t{chrom_end}\n'
+                                          .format(chrom=contig1,
+                                                  chrom_start=s1,
+                                                  chrom_end=e1))
+                                # Add the masked region to the list of intervals
+                                chrom_intervals.setdefault(contig1, list()).append((int(s1), int(e1)))
+        chrom_masks = {chrom: IntervalMask.from_intervals(intervals=intervals)
+                       for chrom, intervals in chrom_intervals.items()}
+        try:
+            IntervalMask.save_masks(path=cachefile,
+                                    chrom_masks=chrom_masks,
+                                    metadata={
+                                        'size': coords_stat.st_size,
+                                        'mtime': coords_stat.st_mtime_ns,
+                                        'cutoff': cutoff
+                                    })
+        # A read-only dependency folder only means that the coords file will be parsed again on the next run
+        except OSError:
+            pass
+        return chrom_masks
+
     @staticmethod
     def load_supplied_mask(strain_groups, maskfile):
         """
@@ -805,28 +964,31 @@ class TreeMethods(object):
         :param strain_groups: type DICT: Dictionary of strain name: list of group(s) for which the strain contains the
         defining SNP
         :param maskfile: type STR: Name and absolute path to the user-supplied maskfile
-        :return: supplied_mask_pos_dict: Dictionary of species: group: reference chromosome: set of masked positions
+        :return: supplied_mask_pos_dict: Dictionary of species: group: reference chromosome: IntervalMask of masked
+        positions
         """
         # Initialise the dictionary
         supplied_mask_pos_dict = dict()
+        # Dictionary of reference chromosome: list of (start, end) masked intervals
+        chrom_intervals = dict()
+        # Open the maskfile
+        with open(maskfile, 'r') as mask:
+            for line in mask:
+                # Split the line on tabs
+                # e.g. Contig_13_99.0332	49320	49360
+                chrom, chrom_start, chrom_end = line.rstrip().split('\t')
+                # Add the masked region to the list of intervals
+                chrom_intervals.setdefault(chrom, list()).append((int(chrom_start), int(chrom_end)))
+        # Merge the intervals once per reference chromosome
+        chrom_masks = {chrom: IntervalMask.from_intervals(intervals=intervals)
+                       for chrom, intervals in chrom_intervals.items()}
+        # Every species and group shares the same masks
         for species, group_list in strain_groups.items():
             if species not in supplied_mask_pos_dict:
                 supplied_mask_pos_dict[species] = dict()
             for group in group_list:
                 if group not in supplied_mask_pos_dict[species]:
-                    supplied_mask_pos_dict[species][group] = dict()
-                # Open the maskfile
-                with open(maskfile, 'r') as mask:
-                    for line in mask:
-                        # Split the line on tabs
-                        # e.g. Contig_13_99.0332	49320	49360
-                        chrom, chrom_start, chrom_end = line.rstrip().split('\t')
-                        # Initialise the reference chromosome in the dictionary if necessary
-                        if chrom not in supplied_mask_pos_dict[species][group]:
-                            supplied_mask_pos_dict[species][group][chrom] = set()
-                        # Add the range of the masked region to the set
-                        for i in range(int(chrom_start), int(chrom_end) + 1):
-                            supplied_mask_pos_dict[species][group][chrom].add(i)
+                    supplied_mask_pos_dict[species][group] = dict(chrom_masks)
         return supplied_mask_pos_dict
 
     @staticmethod
@@ -839,10 +1001,10 @@ class TreeMethods(object):
         group-specific SNP positions
         :param filtered_group_positions: type DICT: Dictionary of species: group: reference chromosome: set of
         density-filtered SNP positions
-        :param mask_pos_dict: type DICT: Dictionary of species: group: reference chromosome: set of
+        :param mask_pos_dict: type DICT: Dictionary of species: group: reference chromosome: IntervalMask of
         nucmer-calculated masked positions
-        :param supplied_mask_pos_dict: type DICT: Dictionary of species: group: reference chromosome: set of user-
-        supplied masked positions
+        :param supplied_mask_pos_dict: type DICT: Dictionary of species: group: reference chromosome: IntervalMask of
+        user-supplied masked positions
         :return: filtered_masked_group_positions: Dictionary of species: group: reference chromosome: set of SNP
         positions that pass filter
         :return: filter_reasons: Dictionary of species: group: reference chromosome: position: list of reasons
@@ -865,28 +1027,29 @@ class TreeMethods(object):
                         filtered_masked_group_positions[species][group][ref_chrom] = set()
                     if ref_chrom not in filter_reasons[species][group]:
                         filter_reasons[species][group][ref_chrom] = dict()
-                    for pos in sorted(pos_list):
+                    positions = sorted(pos_list)
+                    # Determine which positions are density filtered, and which are in the nucmer-calculated and the
+                    # user-supplied masks with vectorized queries of the interval masks
+                    density_set = filtered_group_positions[species][group][ref_chrom]
+                    density_filtered = [pos not in density_set for pos in positions]
+                    try:
+                        calculated_masked = mask_pos_dict[species][group][ref_chrom].contains(positions).tolist()
+                    except KeyError:
+                        calculated_masked = [False] * len(positions)
+                    try:
+                        user_masked = supplied_mask_pos_dict[species][group][ref_chrom].contains(positions).tolist()
+                    except KeyError:
+                        user_masked = [False] * len(positions)
+                    for pos, density, calculated, user in zip(positions, density_filtered, calculated_masked,
+                                                              user_masked):
                         # Initialise the list of reasons that a position is filtered
                         reasons = list()
-                        # Density filtering check
-                        if pos not in filtered_group_positions[species][group][ref_chrom]:
+                        if density:
                             reasons.append('density')
-                        # Nucmer-calculated mask
-                        try:
-                            calculated_mask = mask_pos_dict[species][group][ref_chrom]
-                            # Check to see if this position is present in the set of calculated masked positions
-                            if pos in calculated_mask:
-                                reasons.append('calculated mask')
-                        except KeyError:
-                            pass
-                        # User-supplied mask
-                        try:
-                            user_mask = supplied_mask_pos_dict[species][group][ref_chrom]
-                            # Check to see if this position is present in the set of user-supplied masked positions
-                            if pos in user_mask:
-                                reasons.append('user mask')
-                        except KeyError:
-                            pass
+                        if calculated:
+                            reasons.append('calculated mask')
+                        if user:
+                            reasons.append('user mask')
                         # If the position was filtered, add the list of reasons to the dictionary
                         if reasons:
                             filter_reasons[species][group][ref_chrom][pos] = reasons
@@ -897,11 +1060,11 @@ class TreeMethods(object):
 
     @staticmethod
     def load_snp_sequence(strain_parsed_vcf_dict, strain_consolidated_ref_dict, group_positions_set, strain_groups,
-                          strain_species_dict, consolidated_ref_snp_positions, iupac):
+                          strain_species_dict, consolidated_ref_snp_positions, iupac, threads=1):
         """
         Parse the gVCF-derived dictionaries to determine the strain-specific sequence at every SNP position for every
         group
-        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: dictionary of parsed VCF data
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: GVCFStore of parsed VCF data
         :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
         :param group_positions_set: type DICT: Dictionary of species code: group name: reference chromosome: set of
         group-specific SNP positions
@@ -911,17 +1074,36 @@ class TreeMethods(object):
         :param consolidated_ref_snp_positions: type DICT: Dictionary of reference name: absolute position: reference
         base call
         :param iupac: type DICT: Dictionary of degenerate code: nucleotides included in group
+        :param threads: type INT: Number of strains to process concurrently
         :return: group_strain_snp_sequence: Dictionary of species code: group name: strain name:
         reference chromosome: position: strain-specific sequence
         :return: species_group_best_ref: Dictionary of species code: group name; best ref
         """
+        # Determine the sequences of each strain at the SNP positions of all its groups in a single sweep per strain
+        strain_args = list()
+        for strain_name, ref_dict in strain_parsed_vcf_dict.items():
+            species = strain_species_dict[strain_name]
+            group_positions = {group: group_positions_set[species][group] for group in strain_groups[strain_name]}
+            strain_args.append((ref_dict,
+                                group_positions,
+                                consolidated_ref_snp_positions[strain_consolidated_ref_dict[strain_name]],
+                                iupac))
+        # The sweeps are pure-Python loops, so they are run in a multiprocessing pool rather than in threads, which
+        # would serialise on the GIL. Each worker receives the GVCFStore of a single strain
+        processes = max(min(int(threads), len(strain_args)), 1)
+        if processes > 1:
+            p = multiprocessing.Pool(processes=processes)
+            strain_sequences = p.starmap(TreeMethods.strain_snp_sequence, strain_args, chunksize=1)
+            # Close and join the pool
+            p.close()
+            p.join()
+        else:
+            strain_sequences = [TreeMethods.strain_snp_sequence(*strain_arg) for strain_arg in strain_args]
         # Initialise a dictionary to store all the SNP locations, and the reference sequence for each reference
         # genome
         group_strain_snp_sequence = dict()
         species_group_best_ref = dict()
-        for strain_name, ref_dict in strain_parsed_vcf_dict.items():
-            # Extract the set of groups to which the strain belongs
-            groups = strain_groups[strain_name]
+        for strain_name, strain_sequence in zip(strain_parsed_vcf_dict, strain_sequences):
             # Extract the species code from the dictionary
             species = strain_species_dict[strain_name]
             best_ref = strain_consolidated_ref_dict[strain_name]
@@ -929,7 +1111,7 @@ class TreeMethods(object):
             if species not in group_strain_snp_sequence:
                 group_strain_snp_sequence[species] = dict()
                 species_group_best_ref[species] = dict()
-            for group in groups:
+            for group in strain_groups[strain_name]:
                 # Add the group and strain name keys to the dictionary
                 if group not in group_strain_snp_sequence[species]:
                     group_strain_snp_sequence[species][group] = dict()
@@ -938,109 +1120,274 @@ class TreeMethods(object):
                 if group not in species_group_best_ref[species]:
                     species_group_best_ref[species][group] = best_ref
                 for ref_chrom, position_set in group_positions_set[species][group].items():
-                    # The reference sequence only needs to be determined once. This variable will check to see if it
-                    # already has been added to the dictionary
-                    write_ref = False
+                    # The reference sequence only needs to be determined once for each reference chromosome
                     if best_ref not in group_strain_snp_sequence[species][group]:
                         group_strain_snp_sequence[species][group][best_ref] = dict()
                     if ref_chrom not in group_strain_snp_sequence[species][group][best_ref]:
-                        group_strain_snp_sequence[species][group][best_ref][ref_chrom] = dict()
-                        write_ref = True
-                    for pos in sorted(position_set):
-                        ref_pos = consolidated_ref_snp_positions[best_ref][ref_chrom][pos]
-                        # Include the reference position if necessary
-                        if write_ref:
-                            group_strain_snp_sequence[species][group][best_ref][ref_chrom][pos] = ref_pos
-                        # gVCF blocks will compress stretches of normal matches. I haven't added these regions to the
-                        # dictionary, so these positions will yield KeyErrors
-                        try:
-                            # Extract the gVCF dictionary from the position-specific dictionary
-                            pos_dict = ref_dict[ref_chrom][pos]
-                            if ref_chrom not in group_strain_snp_sequence[species][group][strain_name]:
-                                group_strain_snp_sequence[species][group][strain_name][ref_chrom] = dict()
-                            # Deletions are recorded as a '-'
-                            if pos_dict['FILTER'] == 'DELETION':
-                                group_strain_snp_sequence[species][group][strain_name][ref_chrom][pos] = '-'
-                            elif pos_dict['FILTER'] == 'INSERTION':
-                                group_strain_snp_sequence[species][group][strain_name][ref_chrom][
-                                    pos] = pos_dict['REF']
-                            else:
-                                if pos_dict['LENGTH'] == 1:
-                                    # Determine if the allele frequency is a mixed population
-                                    try:
-                                        # Create a list consisting of the reference position for now
-                                        mixed_components = [ref_pos]
-                                        # Split the 'ALT' value on commas e.g. 'T', '<*>'
-                                        other_components = list()
-                                        for component in pos_dict['ALT'].split(','):
-                                            # Ignore the '<*>'
-                                            if component != '<*>':
-                                                # If the component is a single base, add it to the list - otherwise,
-                                                # it represents an insertion
-                                                if len(component) == 1:
-                                                    other_components.append(component)
-                                        if other_components:
-                                            depth = float(pos_dict['STATS']['DP'])
-                                            # The allele depth is composed of three values e.g. 0,17,0
-                                            # The first is the number of reference-matching bases, the second is the
-                                            # number of bases matching the alternate call, and the third is 'other'?
-                                            allele_depth = float(pos_dict['STATS']['AD'].split(',')[1])
-                                            allele_freq = allele_depth / depth
-                                            # If the alternate allele constitutes less than 75%, but over 50% of the
-                                            # total depth, determine what the degenerate base call is
-                                            if allele_freq < 0.75:
-                                                if allele_freq >= 0.50:
-                                                    for component in other_components:
-                                                        mixed_components.append(component)
-                                                    # Determine the IUPAC code for any multi-allelic sites
-                                                    for code, components in iupac.items():
-                                                        if sorted(mixed_components) == sorted(components):
-                                                            group_strain_snp_sequence[species][group][strain_name][
-                                                                ref_chrom][pos] = code
-                                                # Use the 'REF' allele
-                                                else:
-                                                    group_strain_snp_sequence[species][group][strain_name][ref_chrom][
-                                                        pos] = pos_dict['REF']
-                                            # Otherwise use the alt allele
-                                            else:
-                                                group_strain_snp_sequence[species][group][strain_name][ref_chrom][
-                                                    pos] = pos_dict['ALT'][0]
-                                    # The FreeBayes stats dictionary doesn't have the VAF. Assign the alternate allele
-                                    # as in the original vSNP.
-                                    except KeyError:
-                                        # IF "AC' (alternate called alleles) is 1, find the IUPAC code of the ref + alt
-                                        # allele combination e.g. 13-1950 pos 714775: ref: G, alt: A, call: R
-                                        if pos_dict['STATS']['AC'] == '1':
-                                            for code, components in iupac.items():
-                                                if sorted([pos_dict['REF'], pos_dict['ALT']]) == sorted(components):
-                                                    group_strain_snp_sequence[species][group][strain_name][
-                                                        ref_chrom][pos] = code
-                                        # Otherwise use the alt allele
-                                        else:
-                                            group_strain_snp_sequence[species][group][strain_name][ref_chrom][pos] = \
-                                                pos_dict['ALT'][0]
-                        # If the entry isn't in the dictionary, it is because it matches the reference sequence or
-                        # because there is a deletion
-                        except KeyError:
-                            # Create a copy of the dictionary with the strain-specific reference chromosome information
-                            # derived from the gVCF file
-                            data = strain_parsed_vcf_dict[strain_name][ref_chrom]
-                            # Find the closest position below the current position in the dictionary
-                            closest_pos = min(data.keys(), key=lambda k: abs(k - pos))
-                            # If the position is a DELETION, store a -
-                            if data[closest_pos]['FILTER'] == 'DELETION':
-                                group_strain_snp_sequence[species][group][strain_name][ref_chrom][pos] = '-'
-                            # Otherwise, the position should match the reference genome sequence
-                            else:
-                                try:
-                                    if ref_chrom not in group_strain_snp_sequence[species][group][strain_name]:
-                                        group_strain_snp_sequence[species][group][strain_name][ref_chrom] = dict()
-                                    group_strain_snp_sequence[species][group][strain_name][ref_chrom][pos] \
-                                        = consolidated_ref_snp_positions[best_ref][ref_chrom][pos]
-                                except KeyError:
-                                    pass
+                        group_strain_snp_sequence[species][group][best_ref][ref_chrom] = \
+                            {pos: consolidated_ref_snp_positions[best_ref][ref_chrom][pos]
+                             for pos in sorted(position_set)}
+                    if ref_chrom in strain_sequence[group]:
+                        group_strain_snp_sequence[species][group][strain_name].setdefault(ref_chrom, dict()) \
+                            .update(strain_sequence[group][ref_chrom])
         return group_strain_snp_sequence, species_group_best_ref
 
+    @staticmethod
+    def strain_snp_sequence(ref_dict, group_positions, ref_snp_positions, iupac):
+        """
+        Determine the sequence of a single strain at the SNP positions of each of its groups. The SNP positions of all
+        the groups are merged, and each reference chromosome is processed in a single sorted sweep: the stored records
+        are found with binary searches of the sorted position arrays, and the positions compressed into gVCF blocks
+        are assigned the filter of the closest stored position
+        :param ref_dict: type GVCFStore: Parsed gVCF data of the strain
+        :param group_positions: type DICT: Dictionary of group name: reference chromosome: set of group-specific SNP
+        positions
+        :param ref_snp_positions: type DICT: Dictionary of reference chromosome: position: reference base call of the
+        best reference of the strain
+        :param iupac: type DICT: Dictionary of degenerate code: nucleotides included in group
+        :return: strain_sequence: Dictionary of group name: reference chromosome: position: strain-specific sequence
+        """
+        # Merge the positions of all the groups, keeping the reference chromosomes in the order they are first seen
+        chrom_positions = dict()
+        for group, chrom_dict in group_positions.items():
+            for ref_chrom, position_set in chrom_dict.items():
+                chrom_positions.setdefault(ref_chrom, set()).update(position_set)
+        # Dictionary of reference chromosome: position: sequence
+        chrom_sequence = dict()
+        for ref_chrom, position_set in chrom_positions.items():
+            chrom_sequence[ref_chrom] = dict()
+            if not position_set:
+                continue
+            positions = sorted(position_set)
+            # Extract the strain-specific reference chromosome information derived from the gVCF file
+            data = ref_dict[ref_chrom]
+            indices = data.indices(positions).tolist()
+            deleted = data.deleted(positions).tolist()
+            nearest_filters = data.nearest_filters(positions).tolist()
+            for pos, index, is_deleted, nearest_filter in zip(positions, indices, deleted, nearest_filters):
+                ref_pos = ref_snp_positions[ref_chrom][pos]
+                # gVCF blocks will compress stretches of normal matches. These positions are not stored, and are
+                # assigned the filter of the closest stored position
+                try:
+                    if index >= 0:
+                        pos_dict = data.record(index)
+                    elif is_deleted:
+                        pos_dict = data.deletion_record(data.deletion_index(pos))
+                    else:
+                        raise KeyError(pos)
+                    call = TreeMethods.determine_snp_call(pos_dict=pos_dict,
+                                                          ref_pos=ref_pos,
+                                                          iupac=iupac)
+                    if call is not None:
+                        chrom_sequence[ref_chrom][pos] = call
+                # If the entry isn't stored, it is because it matches the reference sequence or because there is a
+                # deletion
+                except KeyError:
+                    # Records with incomplete statistics fall back to the closest stored position as well
+                    if index >= 0:
+                        nearest_filter = data.nearest_filter(pos)
+                    # If the position is a DELETION, store a -
+                    if nearest_filter == DELETION:
+                        chrom_sequence[ref_chrom][pos] = '-'
+                    # Otherwise, the position should match the reference genome sequence
+                    else:
+                        chrom_sequence[ref_chrom][pos] = ref_pos
+        # Split the sequences into the groups
+        strain_sequence = dict()
+        for group, chrom_dict in group_positions.items():
+            strain_sequence[group] = dict()
+            for ref_chrom, position_set in chrom_dict.items():
+                if position_set:
+                    strain_sequence[group][ref_chrom] = {pos: chrom_sequence[ref_chrom][pos]
+                                                         for pos in sorted(position_set)
+                                                         if pos in chrom_sequence[ref_chrom]}
+        return strain_sequence
+
+    @staticmethod
+    def determine_snp_call(pos_dict, ref_pos, iupac):
+        """
+        Determine the strain-specific sequence from a single gVCF record
+        :param pos_dict: type DICT: Dictionary of 'CHROM', 'REF', 'ALT', 'QUAL', 'LENGTH', 'FILTER', 'STATS'
+        :param ref_pos: type STR: Reference base call at the position
+        :param iupac: type DICT: Dictionary of degenerate code: nucleotides included in group
+        :return: call: Strain-specific sequence, or None if the record does not yield a call. A KeyError is raised if
+        the statistics required to make a call are missing from the record
+        """
+        call = None
+        # Deletions are recorded as a '-'
+        if pos_dict['FILTER'] == 'DELETION':
+            call = '-'
+        elif pos_dict['FILTER'] == 'INSERTION':
+            call = pos_dict['REF']
+        elif pos_dict['LENGTH'] == 1:
+            # Determine if the allele frequency is a mixed population
+            try:
+                # Create a list consisting of the reference position for now
+                mixed_components = [ref_pos]
+                # Split the 'ALT' value on commas e.g. 'T', '<*>'
+                other_components = list()
+                for component in pos_dict['ALT'].split(','):
+                    # Ignore the '<*>'
+                    if component != '<*>':
+                        # If the component is a single base, add it to the list - otherwise, it represents an
+                        # insertion
+                        if len(component) == 1:
+                            other_components.append(component)
+                if other_components:
+                    depth = float(pos_dict['STATS']['DP'])
+                    # The allele depth is composed of three values e.g. 0,17,0
+                    # The first is the number of reference-matching bases, the second is the number of bases matching
+                    # the alternate call, and the third is 'other'?
+                    allele_depth = float(pos_dict['STATS']['AD'].split(',')[1])
+                    allele_freq = allele_depth / depth
+                    # If the alternate allele constitutes less than 75%, but over 50% of the total depth, determine
+                    # what the degenerate base call is
+                    if allele_freq < 0.75:
+                        if allele_freq >= 0.50:
+                            for component in other_components:
+                                mixed_components.append(component)
+                            # Determine the IUPAC code for any multi-allelic sites
+                            for code, components in iupac.items():
+                                if sorted(mixed_components) == sorted(components):
+                                    call = code
+                        # Use the 'REF' allele
+                        else:
+                            call = pos_dict['REF']
+                    # Otherwise use the alt allele
+                    else:
+                        call = pos_dict['ALT'][0]
+            # The FreeBayes stats dictionary doesn't have the VAF. Assign the alternate allele as in the original vSNP.
+            except KeyError:
+                # IF "AC' (alternate called alleles) is 1, find the IUPAC code of the ref + alt allele combination
+                # e.g. 13-1950 pos 714775: ref: G, alt: A, call: R
+                if pos_dict['STATS']['AC'] == '1':
+                    for code, components in iupac.items():
+                        if sorted([pos_dict['REF'], pos_dict['ALT']]) == sorted(components):
+                            call = code
+                # Otherwise use the alt allele
+                else:
+                    call = pos_dict['ALT'][0]
+        return call
+
+    @staticmethod
+    def update_snp_sequence(previous_snp_sequence, previous_group_positions, strain_parsed_vcf_dict,
+                            strain_consolidated_ref_dict, group_positions_set, strain_groups, strain_species_dict,
+                            consolidated_ref_snp_positions, iupac, threads=1):
+        """
+        Update the strain-specific sequences of a previous analysis with additional strains. The sequences of strains
+        already present in the previous analysis are reused, and only determined at the SNP positions that were not
+        part of the previous analysis. The sequences of the new strains are determined at every SNP position
+        :param previous_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
+        reference chromosome: position: strain-specific sequence from the previous analysis
+        :param previous_group_positions: type DICT: Dictionary of species code: group name: reference chromosome: set
+        of SNP positions used in the previous analysis
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: GVCFStore of parsed VCF data
+        :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
+        :param group_positions_set: type DICT: Dictionary of species code: group name: reference chromosome: set of
+        group-specific SNP positions
+        :param strain_groups: type DICT: Dictionary of strain name: list of group(s) for which the strain contains the
+        defining SNP
+        :param strain_species_dict: type DICT: Dictionary of strain name: species code
+        :param consolidated_ref_snp_positions: type DICT: Dictionary of reference name: absolute position: reference
+        base call
+        :param iupac: type DICT: Dictionary of degenerate code: nucleotides included in group
+        :param threads: type INT: Number of strains to process concurrently
+        :return: group_strain_snp_sequence: Dictionary of species code: group name: strain name:
+        reference chromosome: position: strain-specific sequence
+        :return: species_group_best_ref: Dictionary of species code: group name; best ref
+        """
+        # Split the strains into those with sequences in the previous analysis, and the new strains
+        previous_strains = set()
+        for species, group_dict in previous_snp_sequence.items():
+            for group, strain_dict in group_dict.items():
+                previous_strains.update(strain_dict)
+        previous_vcf_dict = {strain_name: ref_dict for strain_name, ref_dict in strain_parsed_vcf_dict.items()
+                             if strain_name in previous_strains}
+        new_vcf_dict = {strain_name: ref_dict for strain_name, ref_dict in strain_parsed_vcf_dict.items()
+                        if strain_name not in previous_strains}
+        # Find the SNP positions that were not part of the previous analysis
+        added_group_positions = dict()
+        for species, group_dict in group_positions_set.items():
+            added_group_positions[species] = dict()
+            for group, ref_dict in group_dict.items():
+                added_group_positions[species][group] = dict()
+                for ref_chrom, position_set in ref_dict.items():
+                    added_group_positions[species][group][ref_chrom] = \
+                        set(position_set) - previous_group_positions.get(species, dict()).get(group, dict()).get(
+                            ref_chrom, set())
+        # Determine the sequences of the previous strains at the added positions, and of the new strains at all
+        # positions
+        added_snp_sequence, species_group_best_ref = \
+            TreeMethods.load_snp_sequence(strain_parsed_vcf_dict=previous_vcf_dict,
+                                          strain_consolidated_ref_dict=strain_consolidated_ref_dict,
+                                          group_positions_set=added_group_positions,
+                                          strain_groups=strain_groups,
+                                          strain_species_dict=strain_species_dict,
+                                          consolidated_ref_snp_positions=consolidated_ref_snp_positions,
+                                          iupac=iupac,
+                                          threads=threads)
+        new_snp_sequence, new_species_group_best_ref = \
+            TreeMethods.load_snp_sequence(strain_parsed_vcf_dict=new_vcf_dict,
+                                          strain_consolidated_ref_dict=strain_consolidated_ref_dict,
+                                          group_positions_set=group_positions_set,
+                                          strain_groups=strain_groups,
+                                          strain_species_dict=strain_species_dict,
+                                          consolidated_ref_snp_positions=consolidated_ref_snp_positions,
+                                          iupac=iupac,
+                                          threads=threads)
+        for species, group_dict in new_species_group_best_ref.items():
+            species_group_best_ref.setdefault(species, dict()).update(group_dict)
+        # Assemble the dictionary in the same order that load_snp_sequence would have created it from all the strains:
+        # strains in the order they were parsed, with the reference inserted after the first strain of the group,
+        # and positions sorted within each reference chromosome
+        group_strain_snp_sequence = dict()
+        for strain_name in strain_parsed_vcf_dict:
+            species = strain_species_dict[strain_name]
+            if species not in group_strain_snp_sequence:
+                group_strain_snp_sequence[species] = dict()
+            for group in strain_groups[strain_name]:
+                if group not in group_strain_snp_sequence[species]:
+                    group_strain_snp_sequence[species][group] = dict()
+                best_ref = species_group_best_ref[species][group]
+                for name in (strain_name, best_ref):
+                    if name in group_strain_snp_sequence[species][group]:
+                        continue
+                    sources = [previous_snp_sequence, added_snp_sequence, new_snp_sequence]
+                    chrom_dict = dict()
+                    for ref_chrom, position_set in group_positions_set[species][group].items():
+                        pos_dict = dict()
+                        present = name == best_ref
+                        for source in sources:
+                            source_dict = source.get(species, dict()).get(group, dict()).get(name, dict())
+                            if ref_chrom in source_dict:
+                                pos_dict.update(source_dict[ref_chrom])
+                                present = True
+                        # Discard any positions that are no longer part of the analysis
+                        if present:
+                            chrom_dict[ref_chrom] = {pos: pos_dict[pos] for pos in sorted(pos_dict)
+                                                     if pos in position_set}
+                    group_strain_snp_sequence[species][group][name] = chrom_dict
+        return group_strain_snp_sequence, species_group_best_ref
+
+    @staticmethod
+    def changed_groups(previous_snp_sequence, group_strain_snp_sequence):
+        """
+        Find the groups that differ from a previous analysis. A group has changed if strains were added to it, or if
+        any of its SNP positions or sequences differ. The outputs of the other groups are unchanged
+        :param previous_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
+        reference chromosome: position: strain-specific sequence from the previous analysis
+        :param group_strain_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
+        reference chromosome: position: strain-specific sequence
+        :return: changed_groups: Dictionary of species code: set of the names of the changed groups
+        """
+        changed_groups = dict()
+        for species, group_dict in group_strain_snp_sequence.items():
+            changed_groups[species] = set()
+            for group, strain_dict in group_dict.items():
+                if strain_dict != previous_snp_sequence.get(species, dict()).get(group):
+                    changed_groups[species].add(group)
+        return changed_groups
+
     @staticmethod
     def find_identical_calls(group_strain_snp_sequence):
         """
@@ -1098,21 +1445,26 @@ class TreeMethods(object):
 
     @staticmethod
     def create_multifasta(group_strain_snp_sequence, fasta_path, group_positions_set, strain_parsed_vcf_dict,
-                          species_group_best_ref, reference_strain_dict, ident_group_positions, nested=True):
+                          species_group_best_ref, reference_strain_dict, ident_group_positions, nested=True,
+                          changed_groups=None):
         """
-        Create a multiple sequence alignment in FASTA format for each group from all the SNP positions for the group
+        Create a multiple sequence alignment in FASTA format for each group from all the SNP positions for the group.
+        When adding strains to a previous analysis, only the alignments of the changed groups are rewritten, and their
+        trees are removed so that they are rebuilt. The alignments and trees of the other groups are left on disk
         :param group_strain_snp_sequence: type DICT: Dictionary of species: group: strain name: reference chromosome:
         position: sequence
         :param fasta_path: type STR: Absolute path of folder in which alignments are to be created
         :param group_positions_set: type DICT: Dictionary of species code: group name: reference chromosome: set of
         group-specific SNP positions
-        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: dictionary of parsed VCF data
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: GVCFStore of parsed VCF data
         :param species_group_best_ref: type DICT: Dictionary of species code: group name: best ref
         :param reference_strain_dict: type DICT: Dictionary of strain name: absolute path to reference genome
         :param ident_group_positions: type DICT: Dictionary of species: group: reference chromosome: set of identical
         positions
         :param nested: type BOOL: Boolean on whether the multi-FASTA files should be created in the normal directory
         structure, or within the fasta_path
+        :param changed_groups: type DICT: Dictionary of species code: set of groups that changed since the previous
+        analysis (see changed_groups). Default is None: all the alignments are created from scratch
         :return: group_fasta_dict: Dictionary of species code: group name: FASTA file created for the group
         :return: group_folders: Set of absolute paths to folders for each group
         :return: species_folders: Set of absolute path to folders for each species
@@ -1121,12 +1473,30 @@ class TreeMethods(object):
         group_fasta_dict = dict()
         group_folders = set()
         species_folders = set()
-        # Clear out the fasta_path to ensure that no previously processed FASTA files are present, as new outputs will
-        # be appended to the old outputs
-        try:
-            shutil.rmtree(fasta_path)
-        except FileNotFoundError:
-            pass
+        # Set of the alignment files to (re)create
+        rewrite_files = set()
+        if changed_groups is None:
+            # Clear out the fasta_path to ensure that no previously processed FASTA files are present, as new outputs
+            # will be appended to the old outputs
+            try:
+                shutil.rmtree(fasta_path)
+            except FileNotFoundError:
+                pass
+        else:
+            for species, group_dict in group_strain_snp_sequence.items():
+                for group in group_dict:
+                    output_dir = os.path.join(fasta_path, species, group) if nested else fasta_path
+                    group_fasta = os.path.join(output_dir, 'alignment.fasta')
+                    # Alignments shared with a changed group, or missing from the previous analysis, are recreated
+                    if group in changed_groups.get(species, set()) or not os.path.isfile(group_fasta):
+                        rewrite_files.add(group_fasta)
+            # Remove the outdated alignments and trees, as new outputs are appended to any existing files
+            for group_fasta in rewrite_files:
+                for outdated_file in (group_fasta, os.path.join(os.path.dirname(group_fasta), 'best_tree.tre')):
+                    try:
+                        os.remove(outdated_file)
+                    except FileNotFoundError:
+                        pass
         for species, group_dict in group_strain_snp_sequence.items():
             # Initialise the species key
             group_fasta_dict[species] = dict()
@@ -1141,56 +1511,79 @@ class TreeMethods(object):
                 make_path(output_dir)
                 # Add the group-specific folder to the set of all group folders
                 group_folders.add(output_dir)
+                if not strain_dict:
+                    continue
+                # Set the name of the FASTA alignment file
+                group_fasta = os.path.join(output_dir, 'alignment.fasta')
+                # Reuse the alignment of an unchanged group
+                if changed_groups is not None and group_fasta not in rewrite_files:
+                    group_fasta_dict[species][group] = group_fasta
+                    continue
                 best_ref = species_group_best_ref[species][group]
                 # Use SeqIO to parse all the records in the reference FASTA file
                 ref_records = SeqIO.to_dict(SeqIO.parse(reference_strain_dict[best_ref], 'fasta'))
-                for strain_name, chrom_dict in strain_dict.items():
-                    # Create a string to store the strain-specific sequence
-                    strain_group_seq = str()
-                    # Iterate through all the chromosomes in the reference genome
-                    for ref_chrom, position_set in group_positions_set[species][group].items():
-                        for pos in sorted(position_set):
-                            # Don't add the sequence if it is identical for all strains
-                            if pos not in ident_group_positions[species][group][ref_chrom]:
-                                # Adjust sequence
-                                ref_seq = str(ref_records[ref_chrom].seq)[pos - 1]
+                # Determine the sorted alignment positions, and the reference base at each position, once per reference
+                # chromosome. Positions that are identical for all strains are not included in the alignment
+                chrom_positions = dict()
+                chrom_ref_bases = dict()
+                for ref_chrom, position_set in group_positions_set[species][group].items():
+                    if not position_set:
+                        continue
+                    ident_positions = ident_group_positions[species][group][ref_chrom]
+                    positions = [pos for pos in sorted(position_set) if pos not in ident_positions]
+                    if not positions:
+                        continue
+                    # Convert the reference sequence to a string once, rather than once per position
+                    ref_seq = numpy.frombuffer(str(ref_records[ref_chrom].seq).encode(), dtype='S1')
+                    chrom_positions[ref_chrom] = positions
+                    chrom_ref_bases[ref_chrom] = ref_seq[numpy.array(positions, dtype=numpy.int64) - 1]
+                # Write all the sequences of the group through a single buffered handle. Append, as all the groups
+                # share the same alignment file when nested is False
+                with open(group_fasta, 'a+') as fasta:
+                    for strain_name, chrom_dict in strain_dict.items():
+                        # Create a list to store the strain-specific sequence of each reference chromosome
+                        strain_group_seq = list()
+                        # Iterate through all the chromosomes in the reference genome
+                        for ref_chrom, positions in chrom_positions.items():
+                            # Start from the reference bases
+                            row = chrom_ref_bases[ref_chrom].copy()
+                            strain_chrom_dict = chrom_dict.get(ref_chrom, dict())
+                            sequences = [strain_chrom_dict.get(pos) for pos in positions]
+                            # Positions without a sequence are deletions if they fall within a zero coverage gVCF block
+                            missing = [index for index, sequence in enumerate(sequences) if sequence is None]
+                            if missing:
                                 try:
-                                    sequence = chrom_dict[ref_chrom][pos]
-                                    if len(sequence) > 1:
-                                        strain_group_seq += ref_seq
-                                    else:
-                                        # Append each base to the string
-                                        strain_group_seq += sequence
+                                    # Query the deletion intervals of the store
+                                    deleted = strain_parsed_vcf_dict[strain_name][ref_chrom].deleted(
+                                        [positions[index] for index in missing])
+                                    row[numpy.array(missing, dtype=numpy.int64)[deleted]] = b'-'
                                 except KeyError:
-                                    try:
-                                        sequence_dict = strain_parsed_vcf_dict[strain_name][ref_chrom][pos]
-                                        if sequence_dict['FILTER'] == 'DELETION':
-                                            strain_group_seq += '-'
-                                        else:
-                                            strain_group_seq += ref_seq
-                                    except KeyError:
-                                        strain_group_seq += ref_seq
-                    # Create a SeqRecord from the sequence string in IUPAC ambiguous DNA format. Use the strain name
-                    # as the id
-                    record = SeqRecord(Seq(strain_group_seq, IUPAC.ambiguous_dna),
-                                       id=strain_name,
-                                       description='')
-                    # Set the name of the FASTA alignment file
-                    group_fasta = os.path.join(output_dir, 'alignment.fasta')
-                    # Use SeqIO to append the FASTA sequence to the alignment file
-                    with open(group_fasta, 'a+') as fasta:
-                        SeqIO.write(record, fasta, 'fasta')
-                    # Add the alignment file to the set of all alignment files
-                    group_fasta_dict[species][group] = group_fasta
+                                    pass
+                            # Multi-base sequences (insertions) are represented by the reference base
+                            called = [(index, sequence) for index, sequence in enumerate(sequences)
+                                      if sequence is not None and len(sequence) == 1]
+                            if called:
+                                indices, bases = zip(*called)
+                                row[list(indices)] = numpy.array(bases, dtype='S1')
+                            strain_group_seq.append(row.tobytes().decode())
+                        strain_group_seq = ''.join(strain_group_seq)
+                        # Write the record in the same format as SeqIO: the strain name as the id, and the sequence
+                        # wrapped at 60 characters
+                        fasta.write('>{strain_name}\n'.format(strain_name=strain_name))
+                        fasta.write(''.join('{line}\n'.format(line=strain_group_seq[i:i + 60])
+                                            for i in range(0, len(strain_group_seq), 60)))
+                # Add the alignment file to the set of all alignment files
+                group_fasta_dict[species][group] = group_fasta
         return group_folders, species_folders, group_fasta_dict
 
     @staticmethod
     def snp_summary(group_strain_snp_sequence, species_group_best_ref, reference_strain_dict, group_positions_set,
                     filter_reasons, strain_parsed_vcf_dict, filtered_group_positions, mask_pos_dict,
-                    supplied_mask_pos_dict, ident_group_positions, summary_path):
+                    supplied_mask_pos_dict, ident_group_positions, summary_path, changed_groups=None):
         """
         Create two summary tables. snv_summary.tsv has details on every SNV position extracted from the global VCF
-        files. contig_summary_tsv has details for every reference contig
+        files. contig_summary_tsv has details for every reference contig. As the tables include every group, they are
+        only left unchanged when adding strains to a previous analysis if none of the groups changed
         :param group_strain_snp_sequence: type DICT: Dictionary of species: group: strain name: reference chromosome:
         position: sequence
         :param species_group_best_ref: type DICT: Dictionary of species code: group name: best ref
@@ -1199,19 +1592,26 @@ class TreeMethods(object):
         group-specific SNP positions
         :param filter_reasons: type DICT: Dictionary of species: group: reference chromosome: position: list of reasons
         position was excluded
-        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: dictionary of parsed VCF data
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: GVCFStore of parsed VCF data
         :param filtered_group_positions: type DICT: Dictionary of species: group: reference chromosome: set of
         density-filtered SNP positions
-        :param mask_pos_dict: type DICT: Dictionary of species: group: reference chromosome: set of
+        :param mask_pos_dict: type DICT: Dictionary of species: group: reference chromosome: IntervalMask of
         nucmer-calculated masked positions
-        :param supplied_mask_pos_dict: type DICT: Dictionary of species: group: reference chromosome: set of user-
-        supplied masked positions
+        :param supplied_mask_pos_dict: type DICT: Dictionary of species: group: reference chromosome: IntervalMask of
+        user-supplied masked positions
         :param ident_group_positions: type DICT: Dictionary of species: group: reference chromosome: set of identical
         positions
         :param summary_path: type STR: Absolute path to folder in which summary reports are to be created
+        :param changed_groups: type DICT: Dictionary of species code: set of groups that changed since the previous
+        analysis (see changed_groups). Default is None: the tables are always created
         """
         # Create the summary path as required
         make_path(summary_path)
+        summary_files = [os.path.join(summary_path, summary_file)
+                         for summary_file in ('snv_summary.tsv', 'contig_summary.tsv')]
+        if changed_groups is not None and not any(changed_groups.values()) \
+                and all(os.path.isfile(summary_file) for summary_file in summary_files):
+            return
         with open(os.path.join(summary_path, 'snv_summary.tsv'), 'w') as snp_summary:
             with open(os.path.join(summary_path, 'contig_summary.tsv'), 'w') as pos_summary:
                 for species, group_dict in group_strain_snp_sequence.items():
@@ -1225,114 +1625,103 @@ class TreeMethods(object):
                         snp_summary_header = 'Contig\tPos\tStatus\tReason\t'
                         pos_summary_header = 'Contig\tTotalLength\tTotalInvalid\tTotalValid\tTotalValidInCore\t' \
                                              'PercentValidInCore\tPercentTotalValidInCore\n'
-                        # Initialise variables
-                        snp_summary_body = str()
-                        pos_summary_body = str()
+                        # Initialise variables. The lines of the tables are collected in lists, and written in bulk
+                        snp_summary_body = list()
+                        pos_summary_body = list()
                         summary_length = 0
                         summary_invalid = 0
                         summary_valid = 0
                         summary_valid_in_core = 0
                         strain_names = ['{best_ref}(ref)'.format(best_ref=best_ref)]
+                        # The strains are reported in sorted order. The reference strain is not processed
+                        sorted_strains = [(strain_name, chrom_dict) for strain_name, chrom_dict
+                                          in sorted(strain_dict.items()) if strain_name != best_ref]
                         for ref_chrom, position_set in group_positions_set[species][group].items():
-                            total_length = len(str(ref_records[ref_chrom].seq))
-                            total_invalid = 0
-                            total_valid = 0
-                            total_valid_in_core = 0
-                            for pos, ref_seq in enumerate(str(ref_records[ref_chrom].seq)):
-                                # Adjust sequence to account for 0-based indexing
-                                ref_seq = str(ref_records[ref_chrom].seq)[pos - 1]
-                                # Initialise the valid and core variables
-                                valid = True
-                                core = True
-                                # Determine if the position is present in the set of all SNV positions of the sample
-                                if pos in position_set:
-                                    snp_summary_body += '{ref_chrom}\t'.format(ref_chrom=ref_chrom)
-                                    # If the position is present in the filter_reasons dictionary, it is neither a core,
-                                    # nor a valid position
-                                    try:
+                            # Convert the reference sequence to an array once per chromosome
+                            ref_bases = numpy.frombuffer(str(ref_records[ref_chrom].seq).encode(), dtype='S1')
+                            total_length = len(ref_bases)
+                            # Create a boolean array of the positions deleted in any strain from the deletion intervals
+                            # of the stores once per chromosome rather than querying the stores at every position
+                            chrom_stores = dict()
+                            any_deleted = numpy.zeros(total_length + 1, dtype=bool)
+                            for strain_name in strain_dict:
+                                try:
+                                    chrom_stores[strain_name] = strain_parsed_vcf_dict[strain_name][ref_chrom]
+                                    any_deleted |= chrom_stores[strain_name].deletion_mask(total_length)
+                                except KeyError:
+                                    pass
+                            # Likewise, create a boolean array of the positions in the calculated or user-supplied masks
+                            masked = numpy.zeros(total_length + 1, dtype=bool)
+                            for mask_dict in (mask_pos_dict, supplied_mask_pos_dict):
+                                try:
+                                    masked |= mask_dict[species][group][ref_chrom].mask_array(total_length)
+                                except KeyError:
+                                    pass
+                            # And of the density-filtered positions
+                            density_filtered = numpy.zeros(total_length + 1, dtype=bool)
+                            density_positions = numpy.fromiter(filtered_group_positions[species][group][ref_chrom],
+                                                               dtype=numpy.int64)
+                            density_filtered[density_positions[(density_positions >= 0) &
+                                                               (density_positions <= total_length)]] = True
+                            # The positions of the chromosome are enumerated from 0 to total_length - 1, and the
+                            # reference base of each position is the base at pos - 1
+                            snp_positions = sorted(pos for pos in position_set if 0 <= pos < total_length)
+                            is_snp = numpy.zeros(total_length, dtype=bool)
+                            is_snp[snp_positions] = True
+                            # Positions that are not SNVs are neither valid nor core if they are density-filtered or
+                            # masked. Valid positions are only core if they are not deleted in any strain
+                            valid = ~(density_filtered[:total_length] | masked[:total_length]) & ~is_snp
+                            total_valid = int(valid.sum())
+                            total_valid_in_core = int((valid & ~any_deleted[:total_length]).sum())
+                            if snp_positions:
+                                # Add the strain names to the list of all strains
+                                for strain_name, chrom_dict in sorted_strains:
+                                    if strain_name not in strain_names:
+                                        strain_names.append(strain_name)
+                                snp_ref_bases = ref_bases[numpy.array(snp_positions, dtype=numpy.int64) - 1]\
+                                    .tobytes().decode()
+                                # Determine the sequence of every strain at every SNV position
+                                strain_columns = list()
+                                for strain_name, chrom_dict in sorted_strains:
+                                    strain_chrom_dict = chrom_dict.get(ref_chrom, dict())
+                                    # If the position isn't in chrom_dict, it is either because it is identical to the
+                                    # reference, or it was deleted. If it was deleted, add a -, otherwise, use the
+                                    # reference base
+                                    if strain_name in chrom_stores:
+                                        deleted = chrom_stores[strain_name].deleted(snp_positions).tolist()
+                                    else:
+                                        deleted = [False] * len(snp_positions)
+                                    strain_columns.append([strain_chrom_dict[pos] if pos in strain_chrom_dict
+                                                           else '-' if is_deleted else ref_seq
+                                                           for pos, ref_seq, is_deleted
+                                                           in zip(snp_positions, snp_ref_bases, deleted)])
+                                reason_dict = filter_reasons.get(species, dict()).get(group, dict()).get(ref_chrom,
+                                                                                                         dict())
+                                for index, pos in enumerate(snp_positions):
+                                    # If the position is present in the filter_reasons dictionary, it is neither a
+                                    # core, nor a valid position
+                                    if pos in reason_dict:
                                         # Add the reasons that the position is invalid to the validity string
-                                        validity = 'invalid\t{reason}'\
-                                            .format(reason=';'.join(filter_reasons[species][group][ref_chrom][pos]))
-                                        valid = False
-                                        core = False
-                                    except KeyError:
-                                        # If the position is not in the dictionary of identical postions, it is both
-                                        # valid and core
-                                        if pos not in ident_group_positions[species][group][ref_chrom]:
-                                            validity = 'valid\t'
-                                        # Otherwise, the SNV allele likely didn't have a high enough fraction, so the
-                                        # position is invalid, but core
-                                        else:
-                                            validity = 'invalid\tmajority reference call'
-                                            valid = False
-                                            core = True
-                                    sequence_string = str()
-                                    for strain_name, chrom_dict in sorted(strain_dict.items()):
-                                        # Don't process the reference strain
-                                        if strain_name != best_ref:
-                                            # Add the strain name to the list of all strains
-                                            if strain_name not in strain_names:
-                                                strain_names.append(strain_name)
-                                            try:
-                                                sequence = chrom_dict[ref_chrom][pos]
-                                                # Append each base to the string
-                                                sequence_string += '{seq}\t'.format(seq=sequence)
-                                            except KeyError:
-                                                # If the position isn't in chrom_dict, it is either because it is
-                                                # identical to the reference, or it was deleted
-                                                try:
-                                                    # If it was deleted, add a -, otherwise, use the reference base
-                                                    sequence_dict = strain_parsed_vcf_dict[strain_name][ref_chrom][pos]
-                                                    if sequence_dict['FILTER'] == 'DELETION':
-                                                        sequence_string += '-\t'
-                                                    else:
-                                                        sequence_string += '{seq}\t'\
-                                                            .format(seq=ref_seq)
-                                                except KeyError:
-                                                    sequence_string += '{seq}\t' \
-                                                        .format(seq=ref_seq)
-                                    snp_summary_body += '{pos}\t{validity}\t{ref_seq}\t{seq_string}\n'\
-                                        .format(pos=pos,
-                                                validity=validity,
-                                                ref_seq=ref_seq,
-                                                seq_string=sequence_string)
-                                # If the position isn't in the set of sample SNVs, check its status
-                                else:
-                                    for strain_name, chrom_dict in strain_dict.items():
-                                        # If the position is missing, then it is not a core position
-                                        try:
-                                            sequence_dict = strain_parsed_vcf_dict[strain_name][ref_chrom][pos]
-                                            if sequence_dict['FILTER'] == 'DELETION':
-                                                core = False
-                                        except KeyError:
-                                            pass
-                                    # Density filtering check. A density-filtered position is neither valid or core
-                                    if pos in filtered_group_positions[species][group][ref_chrom]:
-                                        valid = False
-                                        core = False
-                                    # Calculated mask. A masked position is neither valid nor core
-                                    try:
-                                        calculated_mask = mask_pos_dict[species][group][ref_chrom]
-                                        if pos in calculated_mask:
-                                            valid = False
-                                            core = False
-                                    except KeyError:
-                                        pass
-                                    # User-supplied mask
-                                    try:
-                                        user_mask = supplied_mask_pos_dict[species][group][ref_chrom]
-                                        if pos in user_mask:
-                                            valid = False
-                                            core = False
-                                    except KeyError:
-                                        pass
-                                # Determine if the position is either valid or core
-                                if not valid:
-                                    total_invalid += 1
-                                else:
-                                    total_valid += 1
-                                    if core:
+                                        validity = 'invalid\t{reason}'.format(reason=';'.join(reason_dict[pos]))
+                                    # If the position is not in the dictionary of identical postions, it is both valid
+                                    # and core
+                                    elif pos not in ident_group_positions[species][group][ref_chrom]:
+                                        validity = 'valid\t'
+                                        total_valid += 1
                                         total_valid_in_core += 1
+                                    # Otherwise, the SNV allele likely didn't have a high enough fraction, so the
+                                    # position is invalid, but core
+                                    else:
+                                        validity = 'invalid\tmajority reference call'
+                                    snp_summary_body.append('{ref_chrom}\t{pos}\t{validity}\t{ref_seq}\t{seq_string}\n'
+                                                            .format(ref_chrom=ref_chrom,
+                                                                    pos=pos,
+                                                                    validity=validity,
+                                                                    ref_seq=snp_ref_bases[index],
+                                                                    seq_string=''.join(
+                                                                        '{seq}\t'.format(seq=column[index])
+                                                                        for column in strain_columns)))
+                            total_invalid = total_length - total_valid
                             # Calculate the necessary values
                             percent_valid_in_core = '{:.2f}'.format(total_valid_in_core/total_valid*100)
                             percent_total_valid_in_core = '{:.2f}'.format(total_valid_in_core/total_length*100)
@@ -1340,77 +1729,170 @@ class TreeMethods(object):
                             summary_invalid += total_invalid
                             summary_valid += total_valid
                             summary_valid_in_core += total_valid_in_core
-                            pos_summary_body += '{ref_chrom}\t{total_length}\t{total_invalid}\t{total_valid}\t' \
-                                                '{total_valid_in_core}\t{percent_valid_in_core}\t' \
-                                                '{percent_total_valid_in_core}\n'\
-                                .format(ref_chrom=ref_chrom,
-                                        total_length=total_length,
-                                        total_invalid=total_invalid,
-                                        total_valid=total_valid,
-                                        total_valid_in_core=total_valid_in_core,
-                                        percent_valid_in_core=percent_valid_in_core,
-                                        percent_total_valid_in_core=percent_total_valid_in_core)
+                            pos_summary_body.append('{ref_chrom}\t{total_length}\t{total_invalid}\t{total_valid}\t'
+                                                    '{total_valid_in_core}\t{percent_valid_in_core}\t'
+                                                    '{percent_total_valid_in_core}\n'
+                                                    .format(ref_chrom=ref_chrom,
+                                                            total_length=total_length,
+                                                            total_invalid=total_invalid,
+                                                            total_valid=total_valid,
+                                                            total_valid_in_core=total_valid_in_core,
+                                                            percent_valid_in_core=percent_valid_in_core,
+                                                            percent_total_valid_in_core=percent_total_valid_in_core))
                     summary_percent_valid_in_core = '{:.2f}'.format(summary_valid_in_core / summary_valid * 100)
                     summary_percent_total_valid_in_core = '{:.2f}'.format(summary_valid_in_core / summary_length * 100)
-                    pos_summary_body += 'summary\t{summary_length}\t{summary_invalid}\t{summary_valid}\t' \
-                                        '{summary_valid_in_core}\t{summary_percent_valid_in_core}\t' \
-                                        '{summary_percent_total_valid_in_core}\n' \
-                        .format(summary_length=summary_length,
-                                summary_invalid=summary_invalid,
-                                summary_valid=summary_valid,
-                                summary_valid_in_core=summary_valid_in_core,
-                                summary_percent_valid_in_core=summary_percent_valid_in_core,
-                                summary_percent_total_valid_in_core=summary_percent_total_valid_in_core)
+                    pos_summary_body.append('summary\t{summary_length}\t{summary_invalid}\t{summary_valid}\t'
+                                            '{summary_valid_in_core}\t{summary_percent_valid_in_core}\t'
+                                            '{summary_percent_total_valid_in_core}\n'
+                                            .format(summary_length=summary_length,
+                                                    summary_invalid=summary_invalid,
+                                                    summary_valid=summary_valid,
+                                                    summary_valid_in_core=summary_valid_in_core,
+                                                    summary_percent_valid_in_core=summary_percent_valid_in_core,
+                                                    summary_percent_total_valid_in_core=
+                                                    summary_percent_total_valid_in_core))
                     snp_summary_header += '{strain_name}\n'.format(strain_name='\t'.join(strain_names))
                     snp_summary.write(snp_summary_header)
-                    snp_summary.write(snp_summary_body)
+                    snp_summary.writelines(snp_summary_body)
                     pos_summary.write(pos_summary_header)
-                    pos_summary.write(pos_summary_body)
+                    pos_summary.writelines(pos_summary_body)
 
     @staticmethod
-    def run_fasttree(group_fasta_dict, strain_consolidated_ref_dict, strain_groups, logfile):
+    def run_fasttree(group_fasta_dict, strain_consolidated_ref_dict, strain_groups, logfile, threads=1):
         """
-        Create maximum-likelihood tree using FastTree
+        Create maximum-likelihood tree using FastTree. One FastTree job is run per group, and the jobs are run
+        concurrently. The available threads are allocated to the jobs based on the size of their alignments, and jobs
+        allocated more than one thread use FastTreeMP (if it is installed). The wall time of each job is recorded in
+        the logfile basename + _fasttree_times.txt
         :param group_fasta_dict: type DICT: Dictionary of species code: group name: FASTA file created for the group
         :param strain_consolidated_ref_dict: type DICT: Dictionary of strain name: extracted reference genome name
         :param strain_groups: type DICT: Dictionary of strain name: list of group(s) for which the strain contains the
         defining SNP
         :param logfile: type STR: Absolute path to logfile basename
+        :param threads: type INT: Number of threads available to FastTree. Default is 1
         :return: species_group_trees: Dictionary of species code: group name: dictionary of tree type: absolute path
         to FastTree output tree
         """
         # Initialise a dictionary to store the absolute paths of the output trees
         species_group_trees = dict()
+        # List of species, group, FASTA file, and output tree of every tree that must be created
+        jobs = list()
+        # Set of every group that contains at least one strain
+        populated_groups = set(group for groups in strain_groups.values() for group in groups)
         for species, group_dict in group_fasta_dict.items():
             # Initialise the species key in the dictionary if necessary
             if species not in species_group_trees:
                 species_group_trees[species] = dict()
-            for strain_name, best_ref in strain_consolidated_ref_dict.items():
-                for group, fasta_file in group_dict.items():
-                    if group in strain_groups[strain_name]:
-                        # Initialise the group key in the dictionary if necessary
-                        if group not in species_group_trees[species]:
-                            species_group_trees[species][group] = dict()
-                        # Set the path of the working dir
-                        output_dir = os.path.dirname(fasta_file)
-                        best_tree = os.path.join(output_dir,
-                                                 'best_tree.tre'
-                                                 .format(species=species,
-                                                         group=group))
-                        species_group_trees[species][group]['best_tree'] = best_tree
-                        # Create a system call to FastTree
-                        fasttree_cmd = 'FastTree -gamma  -nt {fasta_file} > {tree_file}' \
-                            .format(fasta_file=fasta_file,
-                                    tree_file=best_tree)
-                        # Run the system call if the output best tree doesn't already exist
-                        if not os.path.isfile(best_tree):
-                            out, err = run_subprocess(command=fasttree_cmd)
-                            # Write the stdout and stderr to the main logfiles
-                            write_to_logfile(out=out,
-                                             err=err,
-                                             logfile=logfile)
+            for group, fasta_file in group_dict.items():
+                if group not in populated_groups:
+                    continue
+                # Set the path of the working dir
+                output_dir = os.path.dirname(fasta_file)
+                best_tree = os.path.join(output_dir, 'best_tree.tre')
+                species_group_trees[species][group] = {'best_tree': best_tree}
+                # Only create the tree if the output best tree doesn't already exist
+                if not os.path.isfile(best_tree):
+                    jobs.append((species, group, fasta_file, best_tree))
+        if not jobs:
+            return species_group_trees
+        # Determine the number of sequences and the length of each alignment
+        dimensions = [TreeMethods.alignment_dimensions(fasta_file=fasta_file)
+                      for species, group, fasta_file, best_tree in jobs]
+        job_threads = TreeMethods.allocate_threads(job_sizes=[num_seqs * length for num_seqs, length in dimensions],
+                                                   threads=threads)
+        # FastTreeMP uses OpenMP to parallelise a single tree. Use the serial FastTree if it is not installed
+        multithreaded = shutil.which('FastTreeMP') is not None
+        job_args = list()
+        for (species, group, fasta_file, best_tree), num_threads in zip(jobs, job_threads):
+            if num_threads > 1 and multithreaded:
+                fasttree_cmd = 'OMP_NUM_THREADS={threads} FastTreeMP -gamma  -nt {fasta_file} > {tree_file}' \
+                    .format(threads=num_threads,
+                            fasta_file=fasta_file,
+                            tree_file=best_tree)
+            else:
+                fasttree_cmd = 'FastTree -gamma  -nt {fasta_file} > {tree_file}' \
+                    .format(fasta_file=fasta_file,
+                            tree_file=best_tree)
+            job_args.append((fasttree_cmd,))
+        # Run the largest jobs first. Every job runs concurrently when there are more threads than jobs
+        order = sorted(range(len(jobs)), key=lambda job: dimensions[job][0] * dimensions[job][1], reverse=True)
+        with ThreadPool(processes=max(1, min(int(threads), len(jobs)))) as pool:
+            results = pool.starmap(TreeMethods.timed_subprocess, [job_args[job] for job in order])
+        job_results = dict(zip(order, results))
+        times_file = '{logfile}_fasttree_times.txt'.format(logfile=logfile)
+        write_header = not os.path.isfile(times_file)
+        with open(times_file, 'a+') as times:
+            if write_header:
+                times.write('Species\tGroup\tSequences\tSites\tThreads\tWallTime\n')
+            for job, (species, group, fasta_file, best_tree) in enumerate(jobs):
+                out, err, wall_time = job_results[job]
+                # Write the stdout and stderr to the main logfiles
+                write_to_logfile(out=out,
+                                 err=err,
+                                 logfile=logfile)
+                times.write('{species}\t{group}\t{num_seqs}\t{length}\t{threads}\t{wall_time:.2f}\n'
+                            .format(species=species,
+                                    group=group,
+                                    num_seqs=dimensions[job][0],
+                                    length=dimensions[job][1],
+                                    threads=job_threads[job] if multithreaded else 1,
+                                    wall_time=wall_time))
         return species_group_trees
 
+    @staticmethod
+    def alignment_dimensions(fasta_file):
+        """
+        Determine the number of sequences in an alignment, and the length of its first sequence
+        :param fasta_file: type STR: Absolute path to the FASTA-formatted alignment
+        :return: num_seqs: Number of sequences in the alignment
+        :return: length: Length of the first sequence of the alignment
+        """
+        num_seqs = 0
+        length = 0
+        with open(fasta_file, 'r') as fasta:
+            for line in fasta:
+                if line.startswith('>'):
+                    num_seqs += 1
+                elif num_seqs == 1:
+                    length += len(line.rstrip())
+        return num_seqs, length
+
+    @staticmethod
+    def allocate_threads(job_sizes, threads):
+        """
+        Allocate threads to concurrent jobs. Every job is allocated a single thread. When there are fewer jobs than
+        threads, the remaining threads are allocated in proportion to the size of each job
+        :param job_sizes: type LIST: Size of each job
+        :param threads: type INT: Total number of threads
+        :return: job_threads: List of the number of threads allocated to each job
+        """
+        job_threads = [1] * len(job_sizes)
+        spare_threads = int(threads) - len(job_sizes)
+        total_size = sum(job_sizes)
+        if spare_threads <= 0 or not total_size:
+            return job_threads
+        shares = [spare_threads * size / total_size for size in job_sizes]
+        for job, share in enumerate(shares):
+            job_threads[job] += int(share)
+        # Allocate the threads left over from rounding down to the jobs with the largest remainders
+        remainders = sorted(range(len(shares)), key=lambda job: shares[job] - int(shares[job]), reverse=True)
+        for job in remainders[:spare_threads - sum(int(share) for share in shares)]:
+            job_threads[job] += 1
+        return job_threads
+
+    @staticmethod
+    def timed_subprocess(command):
+        """
+        Run a system call, and record its wall time
+        :param command: type STR: System call to run
+        :return: out: stdout of the system call
+        :return: err: stderr of the system call
+        :return: wall_time: Wall time of the system call in seconds
+        """
+        start = time.time()
+        out, err = run_subprocess(command=command)
+        return out, err, time.time() - start
+
     @staticmethod
     def parse_tree_order(species_group_trees):
         """
@@ -1455,8 +1937,10 @@ class TreeMethods(object):
                     tree_name = os.path.basename(tree_file)
                     # Set the name of the destination file
                     destination_file = os.path.join(tree_path, tree_name)
-                    # Copy the file to the destination folder
-                    if not os.path.isfile(destination_file):
+                    # Copy the file to the destination folder. Replace previous copies only if the tree changed e.g.
+                    # samples were added to the analysis
+                    if not os.path.isfile(destination_file) or not filecmp.cmp(tree_file, destination_file,
+                                                                               shallow=False):
                         shutil.copyfile(src=tree_file,
                                         dst=destination_file)
 
@@ -1578,8 +2062,8 @@ class TreeMethods(object):
         Use SeqIO to parse the best reference genome GenBank file for annotating SNP locations
         :param reference_strain_dict: type DICT: Dictionary of strain name: absolute path to reference genome
         :param strain_best_ref_set_dict: type DICT: Dictionary of strain name: set of strain-specific reference genomes
-        :return: full_best_ref_gbk_dict: Dictionary of best ref: ref position: SeqIO parsed GenBank file-sourced
-        records from closest reference genome for that position
+        :return: full_best_ref_gbk_dict: Dictionary of best ref: FeatureIndex of ref position: SeqIO parsed GenBank
+        file-sourced records from closest reference genome for that position
         """
         # Initialise a dictionary to store the SeqIO parsed GenBank files
         best_ref_gbk_dict = dict()
@@ -1594,60 +2078,95 @@ class TreeMethods(object):
                     gbk_dict = SeqIO.to_dict(SeqIO.parse(gbk_file, "genbank"))
                     # Add the GenBank dictionary to the best reference-specific dictionary
                     best_ref_gbk_dict[best_ref] = gbk_dict
-        # Initialise a dictionary to store all the positions, and associated information
+        # Initialise a dictionary to store the position index of the features of every best reference
         full_best_ref_gbk_dict = dict()
         for best_ref, gbk_dict in best_ref_gbk_dict.items():
-            full_best_ref_gbk_dict[best_ref] = dict()
-            for ref_name, record in gbk_dict.items():
-                for feature in record.features:
-                    # Ignore the full record
-                    if feature.type != 'source':
-                        # Iterate through the full length of the feature, and add each position to the dictionary
-                        for i in range(int(feature.location.start), int(feature.location.end) + 1):
-                            full_best_ref_gbk_dict[best_ref][i] = feature
+            # Index the features of all the records, ignoring the full records
+            full_best_ref_gbk_dict[best_ref] = \
+                FeatureIndex.from_features(feature for record in gbk_dict.values() for feature in record.features
+                                           if feature.type != 'source')
         return full_best_ref_gbk_dict
 
     @staticmethod
     def load_genbank_file_single(reference_strain_dict):
         """
-        Use SeqIO to parse the best reference genome GenBank file for annotating SNP locations
+        Load the position index of the features in the best reference genome GenBank file for annotating SNP
+        locations. The index is cached next to the GenBank file, and parsed with SeqIO only if the cache is missing or
+        outdated
         :param reference_strain_dict: type DICT: Dictionary of strain name: absolute path to reference genome
-        :return: full_best_ref_gbk_dict: Dictionary of best ref: ref position: SeqIO parsed GenBank file-sourced
-        records from closest reference genome for that position
+        :return: full_best_ref_gbk_dict: Dictionary of reference chromosome: FeatureIndex of ref position: SeqIO
+        parsed GenBank file-sourced records from closest reference genome for that position
         """
-        # Initialise a dictionary to store the SeqIO parsed GenBank files
+        # Initialise a dictionary to store the parsed GenBank files
         best_ref_gbk_dict = dict()
         full_best_ref_gbk_dict = dict()
         for strain_name, best_ref_file in reference_strain_dict.items():
             best_ref = os.path.splitext(best_ref_file)[0]
             gbf_file = best_ref_file.replace('.fasta', '.gbf')
-            # Only parse the file if it has not already been parsed
+            # Only load the file if it has not already been loaded
             if best_ref not in best_ref_gbk_dict:
-                # Use SeqIO to first parse the GenBank file, and convert the parsed object to a dictionary
-                gbk_dict = SeqIO.to_dict(SeqIO.parse(gbf_file, "genbank"))
-                # Add the GenBank dictionary to the best reference-specific dictionary
-                best_ref_gbk_dict[best_ref] = gbk_dict
-        for best_ref, gbk_dict in best_ref_gbk_dict.items():
+                best_ref_gbk_dict[best_ref] = TreeMethods.load_feature_indices(gbk_file=gbf_file)
+        for best_ref, record_indices in best_ref_gbk_dict.items():
             full_best_ref_gbk_dict[best_ref] = dict()
-            for ref_name, record in gbk_dict.items():
-                if record.name not in full_best_ref_gbk_dict:
-                    full_best_ref_gbk_dict[record.name] = dict()
-                for feature in record.features:
-                    # Ignore the full record
-                    if feature.type != 'source':
-                        # Iterate through the full length of the feature, and add each position to the dictionary
-                        for i in range(int(feature.location.start), int(feature.location.end) + 1):
-                            full_best_ref_gbk_dict[record.name][i] = feature
+            for record_name, feature_index in record_indices.items():
+                full_best_ref_gbk_dict[record_name] = feature_index
         return full_best_ref_gbk_dict
 
+    @staticmethod
+    def load_feature_indices(gbk_file):
+        """
+        Create a FeatureIndex of the features of every record in a GenBank file. The indices are cached in a
+        _features.json.gz file next to the GenBank file, and the cache is reused as long as the size and modification
+        time of the GenBank file are unchanged
+        :param gbk_file: type STR: Name and absolute path of the GenBank file
+        :return: record_indices: Dictionary of record name: FeatureIndex
+        """
+        cache_file = '{base}_features.json.gz'.format(base=os.path.splitext(gbk_file)[0])
+        gbk_stat = os.stat(gbk_file)
+        try:
+            with gzip.open(cache_file, 'rt') as cache:
+                cached = json.load(cache)
+            if cached['size'] == gbk_stat.st_size and cached['mtime'] == gbk_stat.st_mtime_ns:
+                return {record_name: FeatureIndex.from_dict(index_dict)
+                        for record_name, index_dict in cached['records'].items()}
+        # Missing, unreadable, or outdated cache files are simply replaced
+        except (OSError, ValueError, KeyError, TypeError, EOFError):
+            pass
+        record_indices = dict()
+        for record in SeqIO.parse(gbk_file, 'genbank'):
+            # Ignore the full record. As with the previous per-position dictionaries, features of records sharing a
+            # name are combined, with later features taking precedence
+            features = record_indices.get(record.name, list())
+            features.extend(feature for feature in record.features if feature.type != 'source')
+            record_indices[record.name] = features
+        record_indices = {record_name: FeatureIndex.from_features(features)
+                          for record_name, features in record_indices.items()}
+        temp_file = '{cache_file}.{pid}.tmp'.format(cache_file=cache_file, pid=os.getpid())
+        try:
+            with gzip.open(temp_file, 'wt') as cache:
+                json.dump({
+                    'size': gbk_stat.st_size,
+                    'mtime': gbk_stat.st_mtime_ns,
+                    'records': {record_name: feature_index.to_dict()
+                                for record_name, feature_index in record_indices.items()}
+                }, cache)
+            os.replace(temp_file, cache_file)
+        # A read-only reference folder only means that the GenBank file will be parsed again on the next run
+        except OSError:
+            pass
+        finally:
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+        return record_indices
+
     @staticmethod
     def annotate_snps(group_strain_snp_sequence, full_best_ref_gbk_dict, strain_best_ref_set_dict, ref_snp_positions):
         """
         Use GenBank records to annotate each SNP with 'gene', 'locus', and 'product' details
         :param group_strain_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
         reference chromosome: position: strain-specific sequence
-        :param full_best_ref_gbk_dict: type DICT: Dictionary of best ref: ref position: SeqIO parsed GenBank
-        file-sourced records from closest reference genome for that position
+        :param full_best_ref_gbk_dict: type DICT: Dictionary of reference chromosome: FeatureIndex of ref position:
+        SeqIO parsed GenBank file-sourced records from closest reference genome for that position
         :param strain_best_ref_set_dict: type DICT: Dictionary of strain name: set of strain-specific reference genomes
         :param ref_snp_positions: type DICT: Dictionary of reference chromosome name: absolute position: reference base
          call
@@ -1750,23 +2269,209 @@ class TreeMethods(object):
                                         species_group_snp_num_dict[species][group][ref_chrom][pos] += 1
         return species_group_snp_num_dict
 
+    @staticmethod
+    def group_codon_effects(species, group, strain_dict, species_group_best_ref, strain_parsed_vcf_dict,
+                            species_group_annotated_snps_dict, reference_strain_dict, species_group_snp_num_dict,
+                            iupac):
+        """
+        Determine the codon effects of every (strain, position) pair of a single group in one batch
+        :param species: type STR: Species code of the group
+        :param group: type STR: Name of the group
+        :param strain_dict: type DICT: Dictionary of strain name: reference chromosome: position: strain-specific
+        sequence
+        :param species_group_best_ref: type DICT: Dictionary of species code: group name: best ref
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: GVCFStore of parsed VCF data
+        :param species_group_annotated_snps_dict: type DICT: Dictionary of species code: group name: reference
+        chromosome: reference position: annotation dictionary
+        :param reference_strain_dict: type DICT: Dictionary of strain name: absolute path to reference genome
+        :param species_group_snp_num_dict: type DICT: Dictionary of species code: group name: reference chromosome:
+        position: number of strains that have a SNP at that position
+        :param iupac: type DICT: Dictionary of degenerate code: nucleotides included in group
+        :return: codon_effects: Dictionary of column name: NumPy array with an entry for every (strain, position) pair
+        that falls within a complete codon of a coding sequence
+        """
+        # Extract the name of the reference genome from the species_group_best_ref dictionary using the species code
+        # and the group name
+        best_ref = species_group_best_ref[species][group]
+        ref_file = reference_strain_dict[best_ref]
+        ref_records = dict()
+        # Dictionary of reference chromosome: sequence string, of (reference chromosome, start, end, strand): raw and
+        # strand-specific coding sequences, and of SNP sequence: reverse complement
+        ref_seqs = dict()
+        cds_cache = dict()
+        reverse_complements = dict()
+        columns = {column: list() for column in ('strain', 'ref_chrom', 'pos', 'cds_strand', 'snp_nt_seq_raw',
+                                                 'snp_nt_seq_alt', 'snp_nt_seq_cds', 'ref_nt_seq_raw',
+                                                 'ref_nt_seq_cds')}
+        ref_codons = list()
+        offsets = list()
+        for strain_name, ref_dict in strain_dict.items():
+            if strain_name == best_ref:
+                continue
+            for ref_chrom in ref_dict:
+                # Iterate through all the SNP positions found in the group
+                for pos in species_group_snp_num_dict[species][group][ref_chrom]:
+                    # Extract the SNP sequence from the ref_dict
+                    try:
+                        snp_seq = ref_dict[ref_chrom][pos]
+                    # If the strain does not have an entry at that position, it matches the reference sequence
+                    except KeyError:
+                        snp_seq = strain_dict[best_ref][ref_chrom][pos]
+                    # Extract the location of the coding sequence from the reference chromosome containing the SNP
+                    # position
+                    location = species_group_annotated_snps_dict[species][group][ref_chrom][pos]['location']
+                    # rRNA products are not coding
+                    product = species_group_annotated_snps_dict[species][group][ref_chrom][pos]['product']
+                    # 'None' locations and rRNA products do not correspond to coding regions. Deletions do not have a
+                    # corresponding amino acid sequence
+                    if location == 'None' or 'ribosomal RNA' in product or snp_seq == '-':
+                        continue
+                    # Extract the raw and strand-specific coding sequences of the reference genome containing the SNP
+                    # position. These are only determined once per coding sequence
+                    cds_key = (ref_chrom, int(location.start), int(location.end), location.strand)
+                    if cds_key not in cds_cache:
+                        if ref_chrom not in ref_seqs:
+                            if not ref_records:
+                                ref_records = SeqIO.to_dict(SeqIO.parse(ref_file, 'fasta'))
+                            ref_seqs[ref_chrom] = str(ref_records[ref_chrom].seq)
+                        raw_nt_seq = ref_seqs[ref_chrom][int(location.start):int(location.end)]
+                        # The reference sequence of coding sequences on the negative strand is treated as the reverse
+                        # complement
+                        cds_cache[cds_key] = (raw_nt_seq, raw_nt_seq if location.strand == 1
+                                              else str(Seq(raw_nt_seq).reverse_complement()))
+                    raw_nt_seq, ref_nt_seq = cds_cache[cds_key]
+                    # If the SNP is a degenerate base, parse the 'ALT' entry from the gVCF file
+                    if snp_seq in iupac:
+                        # The 'ALT' entry contains the alternate base, and the reference: C,<*>. Split the entry on
+                        # the comma, and update the snp_seq variable with the alternate base
+                        snp_seq = strain_parsed_vcf_dict[strain_name][ref_chrom][pos]['ALT'].split(',')[0]
+                    # Create a variable to store the raw SNP sequence
+                    alt_seq = snp_seq
+                    # If the coding sequence containing the SNP position is on the positive strand, the location of the
+                    # SNP is calculated by subtracting the defined start pos of the coding sequence (+1 due to 0-based
+                    # indexing) from the global SNP pos e.g. 49340 (pos) - 48999 (location.start) + 1 = 342 (snp_loc)
+                    if location.strand == 1:
+                        snp_loc = pos - int(location.start) + 1
+                    # If the coding sequence containing the SNP position is on the negative strand, the location of the
+                    # SNP is calculated by subtracting the global SNP position from the end of the defined end position
+                    # of the coding sequence e.g. 3216 (location.end) - 2118 (pos) = 1098 (snp_loc)
+                    else:
+                        snp_loc = int(location.end) - pos
+                        # Convert the snp sequence to be the reverse complement
+                        if snp_seq not in reverse_complements:
+                            reverse_complements[snp_seq] = str(Seq(snp_seq).reverse_complement())
+                        snp_seq = reverse_complements[snp_seq]
+                    # The codon containing the SNP starts at the position of the amino acid residue within the
+                    # translated sequence multiplied by three e.g. 342 (snp_loc) // 3 * 3 = 342
+                    codon_start = snp_loc // 3 * 3
+                    # SNPs beyond the end of the coding sequence, or in an incomplete final codon, do not have a codon
+                    # to translate, so they are treated as non-coding
+                    if snp_loc < 0 or codon_start + 3 > len(ref_nt_seq):
+                        continue
+                    ref_codon = ref_nt_seq[codon_start:codon_start + 3]
+                    columns['strain'].append(strain_name)
+                    columns['ref_chrom'].append(ref_chrom)
+                    columns['pos'].append(pos)
+                    columns['cds_strand'].append(location.strand)
+                    columns['snp_nt_seq_raw'].append(snp_seq)
+                    columns['snp_nt_seq_alt'].append(alt_seq)
+                    columns['snp_nt_seq_cds'].append((snp_seq + ref_nt_seq[snp_loc + 1:snp_loc + 2])[0])
+                    columns['ref_nt_seq_raw'].append(raw_nt_seq[snp_loc])
+                    columns['ref_nt_seq_cds'].append(ref_nt_seq[snp_loc])
+                    ref_codons.append(ref_codon)
+                    offsets.append(snp_loc - codon_start)
+        # Substitute the SNP sequences into the reference codons, and translate and classify all the codons at once
+        codon_effects = CodonEffects.codon_effects(ref_codons=ref_codons,
+                                                   offsets=offsets,
+                                                   snp_seqs=columns['snp_nt_seq_raw'])
+        for column, values in columns.items():
+            codon_effects[column] = numpy.array(values, dtype=numpy.int64) if column == 'pos' else numpy.array(values)
+        return codon_effects
+
+    @staticmethod
+    def determine_codon_effects(group_strain_snp_sequence, species_group_best_ref, strain_parsed_vcf_dict,
+                                species_group_annotated_snps_dict, reference_strain_dict, species_group_snp_num_dict,
+                                iupac, threads=1):
+        """
+        Determine the reference and strain codons, amino acid residues, and the synonymous/nonsynonymous/stop effect
+        class of every SNP that falls within a coding sequence
+        :param group_strain_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
+        reference chromosome: position: strain-specific sequence
+        :param species_group_best_ref: type DICT: Dictionary of species code: group name: best ref
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: GVCFStore of parsed VCF data
+        :param species_group_annotated_snps_dict: type DICT: Dictionary of species code: group name: reference
+        chromosome: reference position: annotation dictionary
+        :param reference_strain_dict: type DICT: Dictionary of strain name: absolute path to reference genome
+        :param species_group_snp_num_dict: type DICT: Dictionary of species code: group name: reference chromosome:
+        position: number of strains that have a SNP at that position
+        :param iupac: type DICT: Dictionary of degenerate code: nucleotides included in group
+        :param threads: type INT: Number of groups to process concurrently
+        :return: species_group_codon_effects: Dictionary of species code: group name: column name: NumPy array
+        """
+        # Only supply each group with its own entries of the dictionaries, and the GVCFStores of its own strains, as
+        # the arguments are pickled to the worker processes
+        group_args = list()
+        for species, group_dict in group_strain_snp_sequence.items():
+            for group, strain_dict in group_dict.items():
+                annotated_snps = species_group_annotated_snps_dict.get(species, dict()).get(group, dict())
+                snp_num = species_group_snp_num_dict.get(species, dict()).get(group, dict())
+                group_args.append((species, group, strain_dict,
+                                   {species: {group: species_group_best_ref[species][group]}},
+                                   {strain_name: strain_parsed_vcf_dict[strain_name] for strain_name in strain_dict
+                                    if strain_name in strain_parsed_vcf_dict},
+                                   {species: {group: annotated_snps}},
+                                   reference_strain_dict,
+                                   {species: {group: snp_num}},
+                                   iupac))
+        # The codon extraction is a pure-Python loop, so the groups are processed in a multiprocessing pool rather than
+        # in threads, which would serialise on the GIL
+        processes = max(min(int(threads), len(group_args)), 1)
+        if processes > 1:
+            p = multiprocessing.Pool(processes=processes)
+            group_effects = p.starmap(TreeMethods.group_codon_effects, group_args, chunksize=1)
+            # Close and join the pool
+            p.close()
+            p.join()
+        else:
+            group_effects = [TreeMethods.group_codon_effects(*group_arg) for group_arg in group_args]
+        species_group_codon_effects = dict()
+        for group_arg, codon_effects in zip(group_args, group_effects):
+            species, group = group_arg[:2]
+            if species not in species_group_codon_effects:
+                species_group_codon_effects[species] = dict()
+            species_group_codon_effects[species][group] = codon_effects
+        return species_group_codon_effects
+
     @staticmethod
     def determine_aa_sequence(group_strain_snp_sequence, species_group_best_ref, strain_parsed_vcf_dict,
                               species_group_annotated_snps_dict, reference_strain_dict, species_group_snp_num_dict,
-                              iupac):
+                              iupac, threads=1, species_group_codon_effects=None):
         """
         Determine the amino acid residue at the SNP position
         :param group_strain_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
         reference chromosome: position: strain-specific sequence
         :param species_group_best_ref: type DICT: Dictionary of species code: group name: best ref
-        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: dictionary of parsed VCF data
+        :param strain_parsed_vcf_dict: type DICT: Dictionary of strain name: GVCFStore of parsed VCF data
         :param species_group_annotated_snps_dict: type DICT: Dictionary of species code: group name: reference
         :param reference_strain_dict: type DICT: Dictionary of strain name: absolute path to reference genome
         :param species_group_snp_num_dict: type DICT: Dictionary of species code: group name: reference chromosome:
         position: number of strains that have a SNP at that position
         :param iupac: type DICT: Dictionary of degenerate code: nucleotides included in group
+        :param threads: type INT: Number of groups to process concurrently
+        :param species_group_codon_effects: type DICT: Optional dictionary of species code: group name: column name:
+        NumPy array created by determine_codon_effects. Determined here if not supplied
         :return translated_snp_residue_dict: Dictionary of species: group: ref_chrom: pos: {pos-specific sequence info}
         """
+        if species_group_codon_effects is None:
+            species_group_codon_effects = \
+                TreeMethods.determine_codon_effects(group_strain_snp_sequence=group_strain_snp_sequence,
+                                                    species_group_best_ref=species_group_best_ref,
+                                                    strain_parsed_vcf_dict=strain_parsed_vcf_dict,
+                                                    species_group_annotated_snps_dict=species_group_annotated_snps_dict,
+                                                    reference_strain_dict=reference_strain_dict,
+                                                    species_group_snp_num_dict=species_group_snp_num_dict,
+                                                    iupac=iupac,
+                                                    threads=threads)
         # Initialise a dictionary to store the annotations for the group-specific SNPs
         translated_snp_residue_dict = dict()
         ref_translated_snp_residue_dict = dict()
@@ -1776,122 +2481,80 @@ class TreeMethods(object):
                 translated_snp_residue_dict[species] = dict()
                 ref_translated_snp_residue_dict[species] = dict()
             for group, strain_dict in group_dict.items():
-                # Extract the name of the reference genome from the species_group_best_ref dictionary using the species
-                # code and the group name
                 best_ref = species_group_best_ref[species][group]
-                # Use SeqIO to parse all the records in the reference FASTA file
-                ref_records = SeqIO.to_dict(SeqIO.parse(reference_strain_dict[best_ref], 'fasta'))
                 # Initialise the group key in the dictionary as required
                 if group not in translated_snp_residue_dict[species]:
                     translated_snp_residue_dict[species][group] = dict()
                     ref_translated_snp_residue_dict[species][group] = dict()
+                # The reference sequence information of each reference chromosome is taken from the last strain with
+                # that reference chromosome
+                chrom_last_strain = dict()
                 for strain_name, ref_dict in strain_dict.items():
                     if strain_name != best_ref:
-                        # Add the strain_name to the nested dictionary
                         if strain_name not in translated_snp_residue_dict[species][group]:
                             translated_snp_residue_dict[species][group][strain_name] = dict()
                         for ref_chrom in ref_dict:
-                            # Initialise the ref_chrom key in the dictionary as required
-                            if ref_chrom not in translated_snp_residue_dict[species][group][strain_name]:
-                                translated_snp_residue_dict[species][group][strain_name][ref_chrom] = dict()
-                                ref_translated_snp_residue_dict[species][group][ref_chrom] = dict()
-                                # Iterate through all the SNP positions found in the group
-                                for pos in species_group_snp_num_dict[species][group][ref_chrom]:
-                                    # Extract the SNP sequence from the ref_dict
-                                    try:
-                                        snp_seq = ref_dict[ref_chrom][pos]
-                                    # If the strain does not have an entry at that position, it matches the reference
-                                    # sequence
-                                    except KeyError:
-                                        snp_seq = strain_dict[best_ref][ref_chrom][pos]
-                                    # Extract the location of the coding sequence from the reference chromosome
-                                    # containing the SNP position
-                                    location = \
-                                        species_group_annotated_snps_dict[species][group][ref_chrom][pos]['location']
-                                    # rRNA products are not coding
-                                    product = \
-                                        species_group_annotated_snps_dict[species][group][ref_chrom][pos]['product']
-                                    # 'None' locations and rRNA products do not correspond to coding regions.
-                                    # Deletions do not have a corresponding amino acid sequence
-                                    if location != 'None' and 'ribosomal RNA' not in product and snp_seq != '-':
-                                        # Extract the coding sequence of reference genome containing the SNP position
-                                        ref_nt_seq = ref_records[ref_chrom].seq[location.start:location.end]
-                                        # If the SNP is a degenerate base, parse the 'ALT' entry from the gVCF file
-                                        if snp_seq in iupac:
-                                            # The 'ALT' entry contains the alternate base, and the reference: C,<*>
-                                            alt_dict = strain_parsed_vcf_dict[strain_name][ref_chrom][pos]['ALT']
-                                            # Split the entry on the comma, and update the snp_seq variable with
-                                            # the alternate base from C,<*>
-                                            snp_seq = alt_dict.split(',')[0]
-                                        # Create a variable to store the raw SNP sequence
-                                        alt_seq = snp_seq
-                                        # If the coding sequence containing the SNP position is on the positive strand,
-                                        # the location of the SNP is calculated by subtracting the defined start pos
-                                        # of the coding sequence (+1 due to 0-based indexing) from the global SNP pos
-                                        if location.strand == 1:
-                                            # e.g. 49340 (pos) - 48999 (location.start) + 1 = 342 (snp_loc)
-                                            '''
-                                            CDS 49000..49497
-                                            /locus_tag="PELMLHNL_01252"
-                                            '''
-                                            snp_loc = pos - location.start + 1
-                                        # If the coding sequence containing the SNP position is on the negative strand,
-                                        # the location of the SNP is calculated by subtracting the global SNP position
-                                        # from the end of the defined end position of the coding sequence (don't need
-                                        # to worry about 0-based indexing)
-                                        else:
-                                            # The reference sequence is treated as the reverse complement
-                                            ref_nt_seq = ref_nt_seq.reverse_complement()
-                                            # e.g. 3216 (location.end) - 2118 (pos) = 1098 (snp_loc)
-                                            '''
-                                            CDS complement(1285..3216)
-                                            /gene="ccmF_1"
-                                            '''
-                                            snp_loc = location.end - pos
-                                            # Convert the snp sequence to be the reverse complement
-                                            snp_seq = Seq(snp_seq)
-                                            snp_seq = str(snp_seq.reverse_complement())
-                                        # Strings are not mutable, so convert the coding sequence to a list in
-                                        # anticipation of modifying the sequence at the SNP position
-                                        snp_nt_seq = list(ref_nt_seq)
-                                        # Update the list at the SNP index with the new sequence: e.g. at position 342,
-                                        # the base 'T' is substituted with a 'G'
-                                        snp_nt_seq[snp_loc] = snp_seq
-                                        # Convert the list to be a Biopython Seq object
-                                        snp_nt_seq = Seq(''.join(snp_nt_seq))
-                                        # Determine the position of the amino acid residue within the translated
-                                        # sequence by dividing the location in the nucleic acid sequence by three and
-                                        # rounding down e.g. 342 (snp_loc) / 3 = 114
-                                        aa_loc = math.floor(snp_loc / 3)
-                                        # Populate the dictionary with all the necessary data
-                                        translated_snp_residue_dict[species][group][strain_name][ref_chrom][pos] = {
-                                            'snp_nt_seq_raw': snp_seq,
-                                            'snp_nt_seq_alt': alt_seq,
-                                            'snp_nt_seq_cds': snp_nt_seq[snp_loc],
-                                            'snp_aa_seq_cds': str(snp_nt_seq.translate())[aa_loc],
-                                            'ref_nt_seq_raw': ref_records[ref_chrom].seq[location.start:location.end]
-                                            [snp_loc],
-                                            'ref_nt_seq_cds': ref_nt_seq[snp_loc],
-                                            'ref_aa_seq_cds': str(ref_nt_seq.translate())[aa_loc],
-                                            'cds_strand': location.strand
-                                        }
-                                        ref_translated_snp_residue_dict[species][group][ref_chrom][pos] = {
-                                            'ref_nt_seq_raw': ref_records[ref_chrom].seq[location.start:location.end]
-                                            [snp_loc],
-                                            'ref_nt_seq_cds': ref_nt_seq[snp_loc],
-                                            'ref_aa_seq_cds': str(ref_nt_seq.translate())[aa_loc],
-                                            'cds_strand': location.strand
-                                        }
+                            translated_snp_residue_dict[species][group][strain_name][ref_chrom] = dict()
+                            ref_translated_snp_residue_dict[species][group][ref_chrom] = dict()
+                            chrom_last_strain[ref_chrom] = strain_name
+                # Populate the dictionaries with all the necessary data
+                codon_effects = species_group_codon_effects[species][group]
+                for strain_name, ref_chrom, pos, snp_nt_seq_raw, snp_nt_seq_alt, snp_nt_seq_cds, snp_aa_seq_cds, \
+                        ref_nt_seq_raw, ref_nt_seq_cds, ref_aa_seq_cds, cds_strand in \
+                        zip(*(codon_effects[column].tolist() for column in
+                              ('strain', 'ref_chrom', 'pos', 'snp_nt_seq_raw', 'snp_nt_seq_alt', 'snp_nt_seq_cds',
+                               'alt_aa', 'ref_nt_seq_raw', 'ref_nt_seq_cds', 'ref_aa', 'cds_strand'))):
+                    translated_snp_residue_dict[species][group][strain_name][ref_chrom][pos] = {
+                        'snp_nt_seq_raw': snp_nt_seq_raw,
+                        'snp_nt_seq_alt': snp_nt_seq_alt,
+                        'snp_nt_seq_cds': snp_nt_seq_cds,
+                        'snp_aa_seq_cds': snp_aa_seq_cds,
+                        'ref_nt_seq_raw': ref_nt_seq_raw,
+                        'ref_nt_seq_cds': ref_nt_seq_cds,
+                        'ref_aa_seq_cds': ref_aa_seq_cds,
+                        'cds_strand': cds_strand
+                    }
+                    if strain_name == chrom_last_strain[ref_chrom]:
+                        ref_translated_snp_residue_dict[species][group][ref_chrom][pos] = {
+                            'ref_nt_seq_raw': ref_nt_seq_raw,
+                            'ref_nt_seq_cds': ref_nt_seq_cds,
+                            'ref_aa_seq_cds': ref_aa_seq_cds,
+                            'cds_strand': cds_strand
+                        }
         return translated_snp_residue_dict, ref_translated_snp_residue_dict
 
     @staticmethod
-    def create_snp_matrix(species_group_best_ref, group_strain_snp_sequence, matrix_path):
+    def write_codon_effects(species_group_codon_effects, summary_path):
+        """
+        Write the codon effects of every SNP within a coding sequence to a tab-delimited file
+        :param species_group_codon_effects: type DICT: Dictionary of species code: group name: column name: NumPy array
+        :param summary_path: type STR: Absolute path to folder in which summary reports are to be created
+        """
+        make_path(summary_path)
+        columns = ('strain', 'ref_chrom', 'pos', 'cds_strand', 'ref_codon', 'alt_codon', 'ref_aa', 'alt_aa', 'effect')
+        lines = ['Species\tGroup\tStrain\tRefChrom\tPos\tStrand\tRefCodon\tAltCodon\tRefAA\tAltAA\tEffect\n']
+        for species, group_dict in species_group_codon_effects.items():
+            for group, codon_effects in group_dict.items():
+                for row in zip(*(codon_effects[column].tolist() for column in columns)):
+                    lines.append('\t'.join([species, group] + [str(value) for value in row]) + '\n')
+        with open(os.path.join(summary_path, 'codon_effects.tsv'), 'w') as effects_file:
+            effects_file.writelines(lines)
+
+    @staticmethod
+    def create_snp_matrix(species_group_best_ref, group_strain_snp_sequence, matrix_path, threads=1,
+                          chunk_size=10000, max_memory=None):
         """
         Create a matrix of the pairwise SNPs between each strain
         :param species_group_best_ref: type DICT: Dictionary of species code: group name: best ref
         :param group_strain_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
         reference chromosome: position: strain-specific sequence
         :param matrix_path: type STR: Absolute path to folder in which matrix files are to be created
+        :param threads: type INT: Number of blocks of SNP positions to process concurrently. Default is 1
+        :param chunk_size: type INT: Number of SNP positions in each block. Limits the memory used for large groups.
+        Default is 10000
+        :param max_memory: type INT: Size in bytes above which the encoded alignment of a group is stored in a
+        memory-mapped file in matrix_path rather than in memory. Default is None (always in memory)
+        :return: snp_matrix: Dictionary of strain name: strain name: number of pairwise SNPs
         """
         # Create the matrix_path if required
         make_path(matrix_path)
@@ -1901,78 +2564,319 @@ class TreeMethods(object):
             for group, strain_dict in group_dict.items():
                 # Extract the name of the reference strain
                 consolidated_ref = species_group_best_ref[species][group]
-                # Iterate through the dictionary twice - get a strain name to be used to compare against the other
-                # strains
-                for compare_strain in group_strain_snp_sequence[species][group]:
-                    # Initialise the SNP dictionary with the target name
-                    snp_matrix[compare_strain] = dict()
+                # Encode the sequences of the group as a matrix of strains x SNP positions
+                memmap_file = os.path.join(matrix_path, '{species}_{group}_alignment.dat'.format(species=species,
+                                                                                                 group=group))
+                strain_names, alignment = TreeMethods.encode_snp_alignment(strain_dict=strain_dict,
+                                                                           max_memory=max_memory,
+                                                                           memmap_file=memmap_file)
+                # Count the SNPs between every query strain (rows) and target strain (columns)
+                pairwise_snps = TreeMethods.pairwise_snp_counts(alignment=alignment,
+                                                                ref_row=strain_names.index(consolidated_ref),
+                                                                threads=threads,
+                                                                chunk_size=chunk_size)
+                # Remove the memory-mapped alignment, if one was created
+                del alignment
+                if os.path.isfile(memmap_file):
+                    os.remove(memmap_file)
+                for compare_index, compare_strain in enumerate(strain_names):
                     # The target strain will not have any SNPs against itself, but this needs to be recorded for
                     # creating the square matrix file
-                    snp_matrix[compare_strain][compare_strain] = 0
-                    # Iterate through the dictionary again to get the query strain
-                    for strain_name, ref_dict in group_strain_snp_sequence[species][group].items():
-                        # Query strain must be different than target strain
+                    snp_matrix[compare_strain] = {compare_strain: 0}
+                    for strain_index, strain_name in enumerate(strain_names):
                         if strain_name != compare_strain:
-                            # Initialise the keys in the snp_matrix dictionary as required
-                            if strain_name not in snp_matrix[compare_strain]:
-                                snp_matrix[compare_strain].update({strain_name: 0})
-                            # Iterate through the reference chromosomes, and position dictionaries nested in the
-                            # reference dictionary
-                            for ref_chrom, pos_dict in ref_dict.items():
-                                # Extract the position and sequence at that position on the reference chromosome
-                                for pos, seq in pos_dict.items():
-                                    # Determine the sequence of the target strain at this position
-                                    try:
-                                        # If this position is in the dictionary, extract the sequence from the
-                                        # dictionary
-                                        compare_seq = \
-                                            group_strain_snp_sequence[species][group][compare_strain][ref_chrom][pos]
-                                    except KeyError:
-                                        # If this position is not in the dictionary, then it is because it matches the
-                                        # reference sequence, so that should be used
-                                        compare_seq = \
-                                            group_strain_snp_sequence[species][group][consolidated_ref][ref_chrom][pos]
-                                    # If the target and query sequences do not match, increment the snp_matrix counter
-                                    if seq != compare_seq:
-                                        snp_matrix[compare_strain][strain_name] += 1
-                # Write the snp_matrix dictionary to a .csv file
-                with open(os.path.join(matrix_path, 'snv_matrix.tsv'), 'w') as matrix_file:
-                    # Initialise variables to store the header, and body strings
-                    header = 'Strain\t'
-                    body = str()
-                    # A count that is incremented for each query strain, so that a list can be accessed by the
-                    # current index
-                    count = 0
-                    # Iterate through all the strains in the snp_matrix dictionary
-                    for ref, compare_dict in sorted(snp_matrix.items()):
-                        # The reference strain is special, so add '(ref)' to the strain name
-                        if ref == consolidated_ref:
-                            ref += ' (ref)'
-                        # Update the header with the strain name
-                        header += '{ref}\t'.format(ref=ref)
-                        # Boolean on whether the name of the current query strain has been printed yet
-                        print_strain = True
-                        # Iterate through all the strains compared to this target strain
-                        for query, num_snps in sorted(compare_dict.items()):
-                            # Only include the strain name if it hasn't already been added to the strain column
-                            if print_strain:
-                                # Extract the strain name from the dictionary based on its sorted position
-                                strain = sorted(compare_dict.items())[count][0]
-                                # Add the '(ref)' string when processing the reference strain
-                                if strain == consolidated_ref:
-                                    strain += ' (ref)'
-                                body += '{query}\t'.format(query=strain)
-                                # Set the boolean to False, so that the strain name isn't added again in this row
-                                print_strain = False
-                                # Increment the count for the next sample name
-                                count += 1
-                            # Add the number of SNPs between the query and target genomes
-                            body += '{num_snps}\t'.format(num_snps=num_snps)
-                        # Add a newline character to separate each query strain
-                        body += '\n'
-                    header += '\n'
-                    matrix_file.write(header)
-                    matrix_file.write(body)
+                            snp_matrix[compare_strain][strain_name] = int(pairwise_snps[strain_index, compare_index])
+                TreeMethods.write_snp_matrix(snp_matrix=snp_matrix,
+                                             consolidated_ref=consolidated_ref,
+                                             matrix_path=matrix_path)
+        return snp_matrix
+
+    @staticmethod
+    def encode_snp_alignment(strain_dict, max_memory=None, memmap_file=None):
+        """
+        Encode the strain-specific sequences of a group as a matrix with a row for each strain, and a column for each
+        SNP position. Every distinct sequence string is given an integer code starting at 1. Positions without a stored
+        sequence are 0
+        :param strain_dict: type DICT: Dictionary of strain name: reference chromosome: position: sequence
+        :param max_memory: type INT: Size in bytes above which the matrix is stored in memmap_file. Default is None
+        :param memmap_file: type STR: Absolute path to the file in which to store matrices larger than max_memory
+        :return: strain_names: List of strain names in row order
+        :return: alignment: NumPy array of sequence codes
+        """
+        strain_names = list(strain_dict)
+        # Determine the sorted positions of every reference chromosome, and the first column of each chromosome
+        chrom_positions = dict()
+        for ref_dict in strain_dict.values():
+            for ref_chrom, pos_dict in ref_dict.items():
+                chrom_positions.setdefault(ref_chrom, set()).update(pos_dict)
+        chrom_offsets = dict()
+        num_columns = 0
+        for ref_chrom, position_set in chrom_positions.items():
+            chrom_positions[ref_chrom] = numpy.array(sorted(position_set), dtype=numpy.int64)
+            chrom_offsets[ref_chrom] = num_columns
+            num_columns += len(position_set)
+        # Find the columns and codes of every stored sequence
+        seq_codes = dict()
+        entries = list()
+        for row, ref_dict in enumerate(strain_dict.values()):
+            for ref_chrom, pos_dict in ref_dict.items():
+                if not pos_dict:
+                    continue
+                positions = numpy.fromiter(pos_dict, dtype=numpy.int64, count=len(pos_dict))
+                columns = chrom_offsets[ref_chrom] + numpy.searchsorted(chrom_positions[ref_chrom], positions)
+                codes = [seq_codes.setdefault(seq, len(seq_codes) + 1) for seq in pos_dict.values()]
+                entries.append((row, columns, codes))
+        # Use the smallest integer type able to store all the codes
+        dtype = numpy.uint8 if len(seq_codes) < 2 ** 8 else numpy.uint16 if len(seq_codes) < 2 ** 16 \
+            else numpy.uint32
+        shape = (len(strain_names), num_columns)
+        # Matrices larger than the memory limit are stored in a memory-mapped file on disk, and only the blocks of
+        # positions being compared are paged into memory by pairwise_snp_counts
+        if max_memory and memmap_file and shape[0] * shape[1] * numpy.dtype(dtype).itemsize > int(max_memory):
+            alignment = numpy.memmap(memmap_file, dtype=dtype, mode='w+', shape=shape)
+        else:
+            alignment = numpy.zeros(shape, dtype=dtype)
+        for row, columns, codes in entries:
+            alignment[row, columns] = codes
+        return strain_names, alignment
+
+    @staticmethod
+    def pairwise_snp_counts(alignment, ref_row, threads=1, chunk_size=10000):
+        """
+        Count the pairwise SNPs between all the strains in an encoded alignment. As in the original nested comparison,
+        the SNPs between a query and a target strain are counted at every position with a stored sequence in the
+        query strain, and positions without a stored sequence in the target strain use the reference sequence. The
+        number of matching positions is calculated for each sequence code as the product of indicator matrices, so the
+        comparisons are performed by BLAS rather than in Python. Blocks of chunk_size positions are processed
+        independently, and concurrently with threads, so only a block of indicator matrices is in memory at once. The
+        alignment is only read a block at a time, so it may be a memory-mapped array
+        :param alignment: type NUMPY.ARRAY: Encoded alignment created by encode_snp_alignment
+        :param ref_row: type INT: Row of the reference in the alignment
+        :param threads: type INT: Number of blocks to process concurrently
+        :param chunk_size: type INT: Number of positions in each block
+        :return: pairwise_snps: NumPy array of the number of SNPs between each query strain (rows) and target strain
+        (columns)
+        """
+        num_strains, num_positions = alignment.shape
+
+        def count_matches(start):
+            block = numpy.asarray(alignment[:, start:start + chunk_size])
+            # Positions without a stored sequence in the target strain use the reference sequence
+            target_block = numpy.where(block > 0, block, block[ref_row])
+            matches = numpy.zeros((num_strains, num_strains), dtype=numpy.float64)
+            for code in numpy.unique(block).tolist():
+                # Positions without a stored sequence in the query strain are not counted
+                if not code:
+                    continue
+                query = (block == code).astype(numpy.float32)
+                target = (target_block == code).astype(numpy.float32)
+                matches += numpy.dot(query, target.T)
+            # Count the positions with a stored sequence in each query strain
+            return matches, numpy.count_nonzero(block, axis=1)
+
+        starts = list(range(0, num_positions, chunk_size))
+        if int(threads) > 1 and len(starts) > 1:
+            # NumPy releases the GIL, so a thread pool processes the blocks concurrently without copying the alignment
+            p = ThreadPool(processes=min(int(threads), len(starts)))
+            block_matches = p.map(count_matches, starts)
+            p.close()
+            p.join()
+        else:
+            block_matches = [count_matches(start) for start in starts]
+        matches = sum(match for match, _ in block_matches) if block_matches \
+            else numpy.zeros((num_strains, num_strains))
+        stored = sum(count for _, count in block_matches) if block_matches else numpy.zeros(num_strains, dtype=int)
+        # The number of SNPs is the number of positions with a stored sequence in the query strain that do not match
+        return stored[:, numpy.newaxis] - numpy.rint(matches).astype(numpy.int64)
+
+    @staticmethod
+    def write_snp_matrix(snp_matrix, consolidated_ref, matrix_path):
+        """
+        Write the pairwise SNP counts to snv_matrix.tsv
+        :param snp_matrix: type DICT: Dictionary of strain name: strain name: number of pairwise SNPs
+        :param consolidated_ref: type STR: Name of the reference genome
+        :param matrix_path: type STR: Absolute path to folder in which matrix files are to be created
+        """
+        # Create the matrix_path if required
+        make_path(matrix_path)
+        # Write the snp_matrix dictionary to a .csv file
+        with open(os.path.join(matrix_path, 'snv_matrix.tsv'), 'w') as matrix_file:
+            # Initialise variables to store the header, and body strings
+            header = 'Strain\t'
+            body = str()
+            # A count that is incremented for each query strain, so that a list can be accessed by the
+            # current index
+            count = 0
+            # Iterate through all the strains in the snp_matrix dictionary
+            for ref, compare_dict in sorted(snp_matrix.items()):
+                # The reference strain is special, so add '(ref)' to the strain name
+                if ref == consolidated_ref:
+                    ref += ' (ref)'
+                # Update the header with the strain name
+                header += '{ref}\t'.format(ref=ref)
+                # Boolean on whether the name of the current query strain has been printed yet
+                print_strain = True
+                # Iterate through all the strains compared to this target strain
+                for query, num_snps in sorted(compare_dict.items()):
+                    # Only include the strain name if it hasn't already been added to the strain column
+                    if print_strain:
+                        # Extract the strain name from the dictionary based on its sorted position
+                        strain = sorted(compare_dict.items())[count][0]
+                        # Add the '(ref)' string when processing the reference strain
+                        if strain == consolidated_ref:
+                            strain += ' (ref)'
+                        body += '{query}\t'.format(query=strain)
+                        # Set the boolean to False, so that the strain name isn't added again in this row
+                        print_strain = False
+                        # Increment the count for the next sample name
+                        count += 1
+                    # Add the number of SNPs between the query and target genomes
+                    body += '{num_snps}\t'.format(num_snps=num_snps)
+                # Add a newline character to separate each query strain
+                body += '\n'
+            header += '\n'
+            matrix_file.write(header)
+            matrix_file.write(body)
+
+    @staticmethod
+    def update_snp_matrix(previous_snp_matrix, previous_snp_sequence, species_group_best_ref,
+                          group_strain_snp_sequence, matrix_path):
+        """
+        Update the matrix of pairwise SNPs of a previous analysis with additional strains. Only the counts of the new
+        strains are determined from all their positions. The counts between strains of the previous analysis are
+        adjusted for the positions that were added to, or removed from the analysis, as the sequences at all other
+        positions are unchanged
+        :param previous_snp_matrix: type DICT: Dictionary of strain name: strain name: number of pairwise SNPs from the
+        previous analysis
+        :param previous_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
+        reference chromosome: position: strain-specific sequence from the previous analysis
+        :param species_group_best_ref: type DICT: Dictionary of species code: group name: best ref
+        :param group_strain_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
+        reference chromosome: position: strain-specific sequence
+        :param matrix_path: type STR: Absolute path to folder in which matrix files are to be created
+        :return: snp_matrix: Dictionary of strain name: strain name: number of pairwise SNPs
+        """
+        snp_matrix = dict()
+        for species, group_dict in group_strain_snp_sequence.items():
+            for group, strain_dict in group_dict.items():
+                consolidated_ref = species_group_best_ref[species][group]
+                previous_strain_dict = previous_snp_sequence.get(species, dict()).get(group, dict())
+                for compare_strain in strain_dict:
+                    snp_matrix[compare_strain] = dict()
+                    snp_matrix[compare_strain][compare_strain] = 0
+                    for strain_name, ref_dict in strain_dict.items():
+                        if strain_name == compare_strain:
+                            continue
+                        try:
+                            num_snps = previous_snp_matrix[compare_strain][strain_name]
+                            previous_ref_dict = previous_strain_dict[strain_name]
+                            previous_compare_dict = previous_strain_dict[compare_strain]
+                        # Strains without a previous count are compared at every position
+                        except KeyError:
+                            snp_matrix[compare_strain][strain_name] = TreeMethods.count_pairwise_snps(
+                                ref_dict=ref_dict,
+                                compare_dict=strain_dict[compare_strain],
+                                consolidated_ref_dict=strain_dict[consolidated_ref])
+                            continue
+                        # Remove the SNPs at positions that are no longer part of the analysis
+                        removed_dict = {ref_chrom: {pos: seq for pos, seq in pos_dict.items()
+                                                    if pos not in ref_dict.get(ref_chrom, dict())}
+                                        for ref_chrom, pos_dict in previous_ref_dict.items()}
+                        num_snps -= TreeMethods.count_pairwise_snps(
+                            ref_dict=removed_dict,
+                            compare_dict=previous_compare_dict,
+                            consolidated_ref_dict=previous_strain_dict[consolidated_ref])
+                        # Add the SNPs at the positions that are new to the analysis
+                        added_dict = {ref_chrom: {pos: seq for pos, seq in pos_dict.items()
+                                                  if pos not in previous_ref_dict.get(ref_chrom, dict())}
+                                      for ref_chrom, pos_dict in ref_dict.items()}
+                        num_snps += TreeMethods.count_pairwise_snps(
+                            ref_dict=added_dict,
+                            compare_dict=strain_dict[compare_strain],
+                            consolidated_ref_dict=strain_dict[consolidated_ref])
+                        snp_matrix[compare_strain][strain_name] = num_snps
+                TreeMethods.write_snp_matrix(snp_matrix=snp_matrix,
+                                             consolidated_ref=consolidated_ref,
+                                             matrix_path=matrix_path)
+        return snp_matrix
+
+    @staticmethod
+    def count_pairwise_snps(ref_dict, compare_dict, consolidated_ref_dict):
+        """
+        Count the number of positions at which the sequence of a query strain differs from the sequence of a target
+        strain. Positions missing from the target strain use the reference sequence
+        :param ref_dict: type DICT: Dictionary of reference chromosome: position: sequence of the query strain
+        :param compare_dict: type DICT: Dictionary of reference chromosome: position: sequence of the target strain
+        :param consolidated_ref_dict: type DICT: Dictionary of reference chromosome: position: reference sequence
+        :return: num_snps: Number of pairwise SNPs
+        """
+        num_snps = 0
+        for ref_chrom, pos_dict in ref_dict.items():
+            for pos, seq in pos_dict.items():
+                try:
+                    compare_seq = compare_dict[ref_chrom][pos]
+                except KeyError:
+                    compare_seq = consolidated_ref_dict[ref_chrom][pos]
+                if seq != compare_seq:
+                    num_snps += 1
+        return num_snps
+
+    @staticmethod
+    def save_analysis_state(state_file, strain_names, group_positions_set, group_strain_snp_sequence, snp_matrix):
+        """
+        Save the results of an analysis required to add strains to it later without reprocessing the existing strains
+        :param state_file: type STR: Absolute path of the gzip-compressed JSON file to create
+        :param strain_names: type LIST: Names of all the strains included in the analysis
+        :param group_positions_set: type DICT: Dictionary of species code: group name: reference chromosome: set of
+        SNP positions that passed all filters
+        :param group_strain_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
+        reference chromosome: position: strain-specific sequence
+        :param snp_matrix: type DICT: Dictionary of strain name: strain name: number of pairwise SNPs
+        """
+        state = {
+            'strains': sorted(strain_names),
+            'group_positions': {species: {group: {ref_chrom: sorted(position_set)
+                                                  for ref_chrom, position_set in ref_dict.items()}
+                                          for group, ref_dict in group_dict.items()}
+                                for species, group_dict in group_positions_set.items()},
+            # JSON keys must be strings, so store the positions and sequences of each chromosome as two lists
+            'snp_sequence': {species: {group: {strain_name: {ref_chrom: [list(pos_dict), list(pos_dict.values())]
+                                                             for ref_chrom, pos_dict in ref_dict.items()}
+                                               for strain_name, ref_dict in strain_dict.items()}
+                                       for group, strain_dict in group_dict.items()}
+                             for species, group_dict in group_strain_snp_sequence.items()},
+            'snp_matrix': snp_matrix
+        }
+        # Write to a temporary file first, so that an interrupted run does not leave a truncated state file
+        temp_file = '{state_file}.tmp'.format(state_file=state_file)
+        with gzip.open(temp_file, 'wt') as state_json:
+            json.dump(state, state_json)
+        os.replace(temp_file, state_file)
+
+    @staticmethod
+    def load_analysis_state(state_file):
+        """
+        Load the results of a previous analysis saved with save_analysis_state
+        :param state_file: type STR: Absolute path of the gzip-compressed JSON file
+        :return: strain_names: Set of the names of all the strains included in the previous analysis
+        :return: group_positions_set: Dictionary of species code: group name: reference chromosome: set of SNP
+        positions that passed all filters
+        :return: group_strain_snp_sequence: Dictionary of species code: group name: strain name: reference chromosome:
+        position: strain-specific sequence
+        :return: snp_matrix: Dictionary of strain name: strain name: number of pairwise SNPs
+        """
+        with gzip.open(state_file, 'rt') as state_json:
+            state = json.load(state_json)
+        group_positions_set = {species: {group: {ref_chrom: set(positions)
+                                                 for ref_chrom, positions in ref_dict.items()}
+                                         for group, ref_dict in group_dict.items()}
+                               for species, group_dict in state['group_positions'].items()}
+        group_strain_snp_sequence = {species: {group: {strain_name: {ref_chrom: dict(zip(*pos_lists))
+                                                                     for ref_chrom, pos_lists in ref_dict.items()}
+                                                       for strain_name, ref_dict in strain_dict.items()}
+                                               for group, strain_dict in group_dict.items()}
+                                     for species, group_dict in state['snp_sequence'].items()}
+        return set(state['strains']), group_positions_set, group_strain_snp_sequence, state['snp_matrix']
 
     @staticmethod
     def rank_snps(species_group_snp_num_dict):
@@ -2070,9 +2974,12 @@ class TreeMethods(object):
     @staticmethod
     def create_summary_table(species_group_sorted_snps, species_group_order_dict, species_group_best_ref,
                              group_strain_snp_sequence, species_group_annotated_snps_dict, translated_snp_residue_dict,
-                             ref_translated_snp_residue_dict, species_group_num_snps, summary_path, molecule):
+                             ref_translated_snp_residue_dict, species_group_num_snps, summary_path, molecule,
+                             max_cells=10000000, changed_groups=None):
         """
-        Create an Excel table that summarises the sorted SNP positions, and adds the annotations
+        Create an Excel table that summarises the sorted SNP positions, and adds the annotations. Tables that exceed
+        the size limits of an Excel worksheet, or that have more than max_cells cells are written as tab-delimited
+        files instead. When adding strains to a previous analysis, the existing tables of unchanged groups are kept
         :param species_group_sorted_snps: type DICT: Dictionary of species code: group name: reference chromosome:
         ordered list of SNP positions
         :param species_group_order_dict: type DICT: Dictionary of species code: group name: list of ordered strains
@@ -2089,206 +2996,328 @@ class TreeMethods(object):
         group-specific SNP positions
         :param summary_path: type STR: Absolute path to folder in which summary reports are to be created
         :param molecule: type STR: String of whether the desired outputs are nucleotide (nt) or amino acid residue (aa)
+        :param max_cells: type INT: Largest number of cells to write to an Excel table. Default is 10000000
+        :param changed_groups: type DICT: Dictionary of species code: set of groups that changed since the previous
+        analysis (see changed_groups). Default is None: the tables of all the groups are created
+        :return: summary_tables: List of the absolute paths of the created tables
         """
+        summary_tables = list()
         for species, group_dict in species_group_order_dict.items():
             for group, ordered_strain_list in group_dict.items():
+                if changed_groups is not None and group not in changed_groups.get(species, set()):
+                    existing_tables = [os.path.join(summary_path, '{molecule}_snv_sorted_table.{extension}'
+                                                    .format(molecule=molecule,
+                                                            extension=extension))
+                                       for extension in ('xlsx', 'tsv')]
+                    existing_tables = [summary_table for summary_table in existing_tables
+                                       if os.path.isfile(summary_table)]
+                    if existing_tables:
+                        summary_tables.extend(existing_tables)
+                        continue
                 # Extract the name of the reference genome from the species_group_best_ref genome
                 consolidated_ref = species_group_best_ref[species][group]
                 total_snps = species_group_num_snps[species][group]
-                # Initialise a variable to store the current column for the report; each reference chromosome will
-                # be added to the report, and cannot overwrite the previous results
-                current_col = 0
-                # Set the name of the summary table
-                summary_table = os.path.join(summary_path, '{molecule}_snv_sorted_table.xlsx'
-                                             .format(molecule=molecule))
-                # Create an xlsxwriter workbook object
-                wb = xlsxwriter.Workbook(summary_table)
-                # Create a worksheet in the workbook
-                ws = wb.add_worksheet()
-                # Create all the necessary formats for the workbook
-                header, courier, bold_courier, top_bold_courier, annotation, format_dict, ambiguous_format = \
-                    TreeMethods.format_workbook(wb=wb,
-                                                molecule=molecule)
-                # Initialise a variable to store the current row under consideration
-                row = 0
-                # Merge all the cells in the first row from the second column until the column corresponding to
-                # the length of the total number of group-specific SNP positions
-                ws.merge_range(first_row=row,
-                               first_col=1,
-                               last_row=0,
-                               last_col=total_snps,
-                               data='SNV Position',
-                               cell_format=top_bold_courier)
-                # Adjust the width of the columns from the 2nd until the column corresponding to the total number
-                # of SNPs to 2
-                ws.set_column(first_col=1,
-                              last_col=total_snps,
-                              width=2)
-                # Write the 'Strain' header
-                ws.write_string(row=row,
-                                col=0,
-                                string='Strain',
-                                cell_format=top_bold_courier)
-                # Determine the height of the cells for the annotation results
-                annotation_height = 0
+                # Create a list of the reference chromosome, ordered SNP positions, and the annotation of each SNP
+                # position for every block of columns in the table. Each reference chromosome is added to the table as
+                # a separate block
+                blocks = list()
                 for num_snps, chrom_dict in species_group_sorted_snps[species][group].items():
                     for ref_chrom, snp_order in chrom_dict.items():
-                        # Determine the height to use based on the group-specific SNP with the longest annotation
-                        # (multiplied by 5 as determined by trial and error)
-                        try:
-                            annotation_list = list()
-                            for pos in snp_order:
-                                annotation_dict = species_group_annotated_snps_dict[species][group][ref_chrom][pos]
-                                annotation_string = '{product};{gene};{locus}'.format(
-                                    product=annotation_dict['product'],
-                                    gene=annotation_dict['gene'],
-                                    locus=annotation_dict['locus'])
-                                annotation_list.append(annotation_string)
-                            current_height = 5 * max([len(annotation) for annotation in annotation_list])
-                            # Determine the height to use for the header. Each cell consists of the ref chromosome name
-                            # and the SNP pos (e.g. NC_002945.4_1057) rotated 270 degrees, so the cell has a height
-                            # equal to the length of the header multiplied by 6 (as determined by trial and error)
-                            max_snp_length = max([len(str(snp)) for snp in snp_order])
-                            snp_height = 6 * (max_snp_length + len(ref_chrom))
-                            # Adjust the row height
-                            ws.set_row(row=1,
-                                       height=snp_height)
-                        except ValueError:
-                            current_height = annotation_height
-                        # As there are multiple reference chromosomes to consider, ensure that the length of the longest
-                        # annotation of all chromosomes is being used
-                        annotation_height = current_height if current_height > annotation_height else annotation_height
-                for num_snps, chrom_dict in species_group_sorted_snps[species][group].items():
-                    for ref_chrom, snp_order in chrom_dict.items():
-                        row = 1
-                        # Extract the strain_dict (dictionary of strain name: pos: pos sequence) from the dictionary
-                        strain_dict = group_strain_snp_sequence[species][group]
-                        # Extract consolidated reference genome pos: sequence dictionary
-                        ref_dict = strain_dict[consolidated_ref][ref_chrom]
-                        # Set the width of the first column to be the longest of the following items: 1) the length
-                        # of the longest strain name, 2) the length of the consolidated reference, 3) length of the word
-                        # 'Annotation'; the longest hardcoded string in the column
-                        strain_length = max([len(consolidated_ref), len(max(strain_dict)), 10])
-                        ws.set_column(first_col=0,
-                                      last_col=0,
-                                      width=strain_length)
-
-                        # Write the header consisting of the reference chromosome + '_' + SNP position
-                        # (e.g. NC_002945.4_1057) for every ordered SNP
-                        for i, entry in enumerate(snp_order):
-                            ws.write_string(row=row,
-                                            col=current_col + i + 1,
-                                            string='{ref_chrom}_{entry}'.format(ref_chrom=ref_chrom,
-                                                                                entry=entry),
-                                            cell_format=header)
-                        # Increment the row for the reference genome sequences
-                        row += 1
-                        # Add the name of the consolidated reference sequence to the 'Strain' column
-                        ws.write_string(row=row,
-                                        col=0,
-                                        string=consolidated_ref,
-                                        cell_format=courier)
-                        # Iterate through the sorted SNPs, and write the reference sequence for each position
-                        for i, pos in enumerate(snp_order):
-                            if molecule == 'nt':
-                                ws.write_string(row=row,
-                                                col=current_col + i + 1,
-                                                string=ref_dict[pos],
-                                                cell_format=bold_courier)
-                            else:
-                                # Determine the sequence at the current position, and the format to use to write the
-                                # sequence in the report
-                                sequence, base_format = TreeMethods.format_sequence(
-                                    pos=pos,
-                                    sequence_dict=ref_translated_snp_residue_dict[species][group][ref_chrom],
-                                    ref_dict=ref_dict,
-                                    bold_courier=bold_courier,
-                                    format_dict=format_dict,
-                                    ambiguous_format=ambiguous_format,
-                                    molecule=molecule,
-                                    ref=True)
-                                ws.write_string(row=row,
-                                                col=current_col + i + 1,
-                                                string=sequence,
-                                                cell_format=base_format)
-                        # Increment the row
-                        row += 1
-                        # Freeze the panes, so that the row containing the reference sequence is at the bottom of the
-                        # frozen pane, and the column with the strain names is always present
-                        ws.freeze_panes(row=row,
-                                        col=1)
-                        # Add the strain-specific data to the table
-                        for strain_name in ordered_strain_list:
-                            # Continue to unpack the dictionary to obtain sequence_dict: a dictionary of pos: pos seq
-                            try:
-                                sequence_dict = strain_dict[strain_name][ref_chrom]
-                            except KeyError:
-                                sequence_dict = strain_dict[consolidated_ref][ref_chrom]
-                            # Don't need to look at the reference genome when finding SNPs
-                            if strain_name != consolidated_ref:
-                                # Write the strain name in the 'Strain' column
-                                ws.write_string(row=row,
-                                                col=0,
-                                                string=strain_name,
-                                                cell_format=courier)
-                                for i, pos in enumerate(snp_order):
-                                    if molecule == 'nt':
-                                        # Determine the sequence of the nucleotide at the current position, and any
-                                        # special formatting required
-                                        sequence, base_format = TreeMethods.format_sequence(
-                                            pos=pos,
-                                            sequence_dict=sequence_dict,
-                                            ref_dict=ref_dict,
-                                            bold_courier=bold_courier,
-                                            format_dict=format_dict,
-                                            ambiguous_format=ambiguous_format,
-                                            molecule=molecule)
-                                    # For amino acid reports, use the translated_snp_residue_dict instead
-                                    else:
-                                        sequence_dict = \
-                                            translated_snp_residue_dict[species][group][strain_name][ref_chrom]
-                                        sequence, base_format = TreeMethods.format_sequence(
-                                            pos=pos,
-                                            sequence_dict=sequence_dict,
-                                            ref_dict=ref_dict,
-                                            bold_courier=bold_courier,
-                                            format_dict=format_dict,
-                                            ambiguous_format=ambiguous_format,
-                                            molecule=molecule)
-                                    # Write the sequence in the appropriate format
-                                    ws.write_string(row=row,
-                                                    col=current_col + i + 1,
-                                                    string=sequence,
-                                                    cell_format=base_format)
-                                # Increment the row for each sequence
-                                row += 1
-
-                        # Add the string 'Annotation' to the 'Strain' column
-                        ws.write_string(row=row,
-                                        col=0,
-                                        string='Annotation',
-                                        cell_format=top_bold_courier)
-                        # Set the row height to the previously calculated height
-                        ws.set_row(row=row,
-                                   height=annotation_height)
-                        # Extract the 'product' annotations for the SNP from the species_group_annotated_snps_dict
-                        for i, pos in enumerate(snp_order):
+                        annotations = list()
+                        for pos in snp_order:
                             annotation_dict = species_group_annotated_snps_dict[species][group][ref_chrom][pos]
-                            annotation_string = '{product};{gene};{locus}'.format(product=annotation_dict['product'],
-                                                                                  gene=annotation_dict['gene'],
-                                                                                  locus=annotation_dict['locus'])
-                            ws.write_string(row=row,
-                                            col=current_col + i + 1,
-                                            string=annotation_string,
-                                            cell_format=annotation)
-                        current_col += len(snp_order)
-                        # Increment the row
-                        row += 1
-                        # Set the final row to a height of 1
-                        ws.set_row(row=row,
-                                   height=1)
-                # Close the workbook
-                wb.close()
+                            annotations.append('{product};{gene};{locus}'.format(product=annotation_dict['product'],
+                                                                                 gene=annotation_dict['gene'],
+                                                                                 locus=annotation_dict['locus']))
+                        blocks.append((ref_chrom, snp_order, annotations))
+                # The reference genome does not get its own row in the strain-specific part of the table
+                num_rows = 4 + len([strain_name for strain_name in ordered_strain_list
+                                    if strain_name != consolidated_ref])
+                num_columns = 1 + max(total_snps, sum(len(snp_order) for ref_chrom, snp_order, annotations in blocks))
+                # Tables that are too large for Excel (or too slow to create) are written as tab-delimited files
+                xlsx = num_columns <= XLSX_MAX_COLUMNS and num_rows <= XLSX_MAX_ROWS and \
+                    num_rows * num_columns <= max_cells
+                # Set the name of the summary table
+                summary_table = os.path.join(summary_path, '{molecule}_snv_sorted_table.{extension}'
+                                             .format(molecule=molecule,
+                                                     extension='xlsx' if xlsx else 'tsv'))
+                # Rows of the table are created on demand as they are written
+                summary_rows = TreeMethods.summary_table_rows(
+                    blocks=blocks,
+                    ordered_strain_list=ordered_strain_list,
+                    consolidated_ref=consolidated_ref,
+                    strain_dict=group_strain_snp_sequence[species][group],
+                    translated_snp_residue_dict=translated_snp_residue_dict[species][group] if molecule != 'nt'
+                    else dict(),
+                    ref_translated_snp_residue_dict=ref_translated_snp_residue_dict[species][group]
+                    if molecule != 'nt' else dict(),
+                    molecule=molecule)
+                if xlsx:
+                    TreeMethods.write_summary_xlsx(summary_table=summary_table,
+                                                   blocks=blocks,
+                                                   summary_rows=summary_rows,
+                                                   strain_dict=group_strain_snp_sequence[species][group],
+                                                   consolidated_ref=consolidated_ref,
+                                                   total_snps=total_snps,
+                                                   molecule=molecule)
+                else:
+                    TreeMethods.write_summary_tsv(summary_table=summary_table,
+                                                  blocks=blocks,
+                                                  summary_rows=summary_rows)
+                summary_tables.append(summary_table)
+        return summary_tables
+
+    @staticmethod
+    def summary_table_rows(blocks, ordered_strain_list, consolidated_ref, strain_dict, translated_snp_residue_dict,
+                           ref_translated_snp_residue_dict, molecule):
+        """
+        Generator of the sequence rows of the summary table: the consolidated reference genome followed by each strain.
+        Every cell is paired with the key of its format: None for the bold courier format, or the nucleotide base/amino
+        acid residue used to look up its format in the format dictionary
+        :param blocks: type LIST: List of reference chromosome, ordered list of SNP positions, list of annotations for
+        every block of columns in the table
+        :param ordered_strain_list: type LIST: List of ordered strains
+        :param consolidated_ref: type STR: Name of the consolidated reference genome
+        :param strain_dict: type DICT: Dictionary of strain name: reference chromosome: position: strain-specific
+        sequence
+        :param translated_snp_residue_dict: type DICT: Dictionary of strain_name: ref_chrom: pos:
+        {pos-specific sequence info}. Only used for amino acid tables
+        :param ref_translated_snp_residue_dict: type DICT: Dictionary of ref_chrom: pos: {pos-specific sequence info}.
+        Only used for amino acid tables
+        :param molecule: type STR: Creating nucleotide or amino acid outputs
+        :return: Tuples of the name in the 'Strain' column, and a list of (sequence, format key) for every SNP position
+        """
+        # Reference genome sequence of every column
+        ref_sequences = [[strain_dict[consolidated_ref][ref_chrom][pos] for pos in snp_order] if molecule == 'nt'
+                         else [] for ref_chrom, snp_order, annotations in blocks]
+        cells = list()
+        for block, (ref_chrom, snp_order, annotations) in enumerate(blocks):
+            if molecule == 'nt':
+                cells.extend((sequence, None) for sequence in ref_sequences[block])
+            else:
+                # Missing keys are due to the SNP position falling in a non-coding region
+                sequence_dict = ref_translated_snp_residue_dict[ref_chrom]
+                for pos in snp_order:
+                    try:
+                        sequence = sequence_dict[pos]['ref_aa_seq_cds']
+                    except KeyError:
+                        sequence = 'NC'
+                    cells.append((sequence, sequence))
+        yield consolidated_ref, cells
+        for strain_name in ordered_strain_list:
+            # Don't need to look at the reference genome when finding SNPs
+            if strain_name == consolidated_ref:
+                continue
+            cells = list()
+            for block, (ref_chrom, snp_order, annotations) in enumerate(blocks):
+                if molecule == 'nt':
+                    # Continue to unpack the dictionary to obtain sequence_dict: a dictionary of pos: pos seq
+                    try:
+                        sequence_dict = strain_dict[strain_name][ref_chrom]
+                    except KeyError:
+                        sequence_dict = strain_dict[consolidated_ref][ref_chrom]
+                    for pos, ref_sequence in zip(snp_order, ref_sequences[block]):
+                        # A missing key indicates that the strain-specific sequence matches the reference sequence
+                        sequence = sequence_dict.get(pos, ref_sequence)
+                        # Sequences that match the reference sequence use the standard bold courier format
+                        cells.append((sequence, None if sequence == ref_sequence else sequence))
+                # For amino acid reports, use the translated_snp_residue_dict instead. A missing key is either because
+                # of a deletion or that the SNP position falls in a non-coding region
+                else:
+                    sequence_dict = translated_snp_residue_dict[strain_name][ref_chrom]
+                    for pos in snp_order:
+                        try:
+                            sequence = sequence_dict[pos]['snp_aa_seq_cds']
+                        except KeyError:
+                            sequence = '-'
+                        cells.append((sequence, sequence))
+            yield strain_name, cells
+
+    @staticmethod
+    def write_summary_xlsx(summary_table, blocks, summary_rows, strain_dict, consolidated_ref, total_snps, molecule):
+        """
+        Write the summary table to an Excel workbook. The workbook is created in constant memory mode, so every row is
+        written in order, and is flushed to disk once the next row is started
+        :param summary_table: type STR: Absolute path of the workbook to create
+        :param blocks: type LIST: List of reference chromosome, ordered list of SNP positions, list of annotations for
+        every block of columns in the table
+        :param summary_rows: type GENERATOR: Rows of the table created by summary_table_rows
+        :param strain_dict: type DICT: Dictionary of strain name: reference chromosome: position: strain-specific
+        sequence
+        :param consolidated_ref: type STR: Name of the consolidated reference genome
+        :param total_snps: type INT: Total number of group-specific SNP positions
+        :param molecule: type STR: Creating nucleotide or amino acid outputs
+        """
+        # Create an xlsxwriter workbook object
+        wb = xlsxwriter.Workbook(summary_table, {'constant_memory': True})
+        # Create a worksheet in the workbook
+        ws = wb.add_worksheet()
+        # Create all the necessary formats for the workbook
+        header, courier, bold_courier, top_bold_courier, annotation, format_dict, ambiguous_format = \
+            TreeMethods.format_workbook(wb=wb,
+                                        molecule=molecule)
+        # Dictionary of format key: format. Sequences that do not exist in format_dict (e.g. degenerate bases, or
+        # missing sequences) use the 'ambiguous' format
+        cell_formats = {None: bold_courier}
+        # Merge all the cells in the first row from the second column until the column corresponding to the length of
+        # the total number of group-specific SNP positions
+        ws.merge_range(first_row=0,
+                       first_col=1,
+                       last_row=0,
+                       last_col=total_snps,
+                       data='SNV Position',
+                       cell_format=top_bold_courier)
+        # Adjust the width of the columns from the 2nd until the column corresponding to the total number of SNPs to 2
+        ws.set_column(first_col=1,
+                      last_col=total_snps,
+                      width=2)
+        # Write the 'Strain' header
+        ws.write_string(row=0,
+                        col=0,
+                        string='Strain',
+                        cell_format=top_bold_courier)
+        if not blocks:
+            wb.close()
+            return
+        # Determine the height of the cells for the annotation results based on the group-specific SNP with the
+        # longest annotation (multiplied by 5 as determined by trial and error)
+        annotation_height = max([5 * max(len(annotation) for annotation in annotations)
+                                 for ref_chrom, snp_order, annotations in blocks if annotations] + [0])
+        # Set the width of the first column to be the longest of the following items: 1) the length of the longest
+        # strain name, 2) the length of the consolidated reference, 3) length of the word 'Annotation'; the longest
+        # hardcoded string in the column
+        ws.set_column(first_col=0,
+                      last_col=0,
+                      width=max([len(consolidated_ref), len(max(strain_dict)), 10]))
+        row = 1
+        col = 1
+        for ref_chrom, snp_order, annotations in blocks:
+            if snp_order:
+                # Determine the height to use for the header. Each cell consists of the ref chromosome name and the SNP
+                # pos (e.g. NC_002945.4_1057) rotated 270 degrees, so the cell has a height equal to the length of the
+                # header multiplied by 6 (as determined by trial and error)
+                max_snp_length = max([len(str(snp)) for snp in snp_order])
+                ws.set_row(row=row,
+                           height=6 * (max_snp_length + len(ref_chrom)))
+            # Write the header consisting of the reference chromosome + '_' + SNP position (e.g. NC_002945.4_1057) for
+            # every ordered SNP
+            for entry in snp_order:
+                ws.write_string(row=row,
+                                col=col,
+                                string='{ref_chrom}_{entry}'.format(ref_chrom=ref_chrom,
+                                                                    entry=entry),
+                                cell_format=header)
+                col += 1
+        row += 1
+        # Freeze the panes, so that the row containing the reference sequence is at the bottom of the frozen pane, and
+        # the column with the strain names is always present
+        ws.freeze_panes(row=row + 1,
+                        col=1)
+        # Write the consolidated reference genome, and each strain in the order of the phylogenetic tree
+        for name, cells in summary_rows:
+            ws.write_string(row=row,
+                            col=0,
+                            string=name,
+                            cell_format=courier)
+            for col, (sequence, format_key) in enumerate(cells, start=1):
+                try:
+                    cell_format = cell_formats[format_key]
+                except KeyError:
+                    cell_format = cell_formats.setdefault(format_key, format_dict.get(format_key, ambiguous_format))
+                ws.write_string(row=row,
+                                col=col,
+                                string=sequence,
+                                cell_format=cell_format)
+            row += 1
+        # Add the string 'Annotation' to the 'Strain' column
+        ws.set_row(row=row,
+                   height=annotation_height)
+        ws.write_string(row=row,
+                        col=0,
+                        string='Annotation',
+                        cell_format=top_bold_courier)
+        # Write the 'product' annotations for the SNPs
+        col = 1
+        for ref_chrom, snp_order, annotations in blocks:
+            for annotation_string in annotations:
+                ws.write_string(row=row,
+                                col=col,
+                                string=annotation_string,
+                                cell_format=annotation)
+                col += 1
+        # Set the final row to a height of 1. Rows without any cells are not written in constant memory mode, so the
+        # row is given a formatted blank cell
+        ws.set_row(row=row + 1,
+                   height=1)
+        ws.write_blank(row=row + 1,
+                       col=0,
+                       blank=None,
+                       cell_format=courier)
+        # Close the workbook
+        wb.close()
+
+    @staticmethod
+    def write_summary_tsv(summary_table, blocks, summary_rows):
+        """
+        Write the summary table as a tab-delimited file with the same layout as the Excel workbook (without the merged
+        'SNV Position' row or any formatting)
+        :param summary_table: type STR: Absolute path of the file to create
+        :param blocks: type LIST: List of reference chromosome, ordered list of SNP positions, list of annotations for
+        every block of columns in the table
+        :param summary_rows: type GENERATOR: Rows of the table created by summary_table_rows
+        """
+        with open(summary_table, 'w') as summary:
+            summary.write('\t'.join(['Strain'] + ['{ref_chrom}_{entry}'.format(ref_chrom=ref_chrom,
+                                                                                entry=entry)
+                                                  for ref_chrom, snp_order, annotations in blocks
+                                                  for entry in snp_order]) + '\n')
+            if not blocks:
+                return
+            for name, cells in summary_rows:
+                summary.write('\t'.join([name] + [sequence for sequence, format_key in cells]) + '\n')
+            summary.write('\t'.join(['Annotation'] + [annotation_string for ref_chrom, snp_order, annotations in blocks
+                                                      for annotation_string in annotations]) + '\n')
+
+    @staticmethod
+    def create_summary_tables(species_group_sorted_snps, species_group_order_dict, species_group_best_ref,
+                              group_strain_snp_sequence, species_group_annotated_snps_dict, translated_snp_residue_dict,
+                              ref_translated_snp_residue_dict, species_group_num_snps, summary_path, threads=1,
+                              max_cells=10000000, changed_groups=None):
+        """
+        Create the nucleotide and amino acid summary tables. With more than one thread, the two tables are created
+        concurrently in separate processes
+        :param species_group_sorted_snps: type DICT: Dictionary of species code: group name: reference chromosome:
+        ordered list of SNP positions
+        :param species_group_order_dict: type DICT: Dictionary of species code: group name: list of ordered strains
+        :param species_group_best_ref: type DICT: Dictionary of species code: group name: best ref
+        :param group_strain_snp_sequence: type DICT: Dictionary of species code: group name: strain name:
+        reference chromosome: position: strain-specific sequence
+        :param species_group_annotated_snps_dict: type DICT: Dictionary of species code: group name: reference
+        chromosome: reference position: annotation dictionary
+        :param translated_snp_residue_dict: type DICT: Dictionary of species: group: strain_name: ref_chrom: pos:
+        {pos-specific sequence info}
+        :param ref_translated_snp_residue_dict: type DICT: Dictionary of species: group: ref_chrom: pos:
+        {pos-specific sequence info}
+        :param species_group_num_snps: type DICT: Dictionary of species code: group name: total number of
+        group-specific SNP positions
+        :param summary_path: type STR: Absolute path to folder in which summary reports are to be created
+        :param threads: type INT: Number of processes to use. Default is 1
+        :param max_cells: type INT: Largest number of cells to write to an Excel table. Default is 10000000
+        :param changed_groups: type DICT: Dictionary of species code: set of groups that changed since the previous
+        analysis (see changed_groups). Default is None: the tables of all the groups are created
+        :return: summary_tables: List of the absolute paths of the created tables
+        """
+        table_args = [(species_group_sorted_snps, species_group_order_dict, species_group_best_ref,
+                       group_strain_snp_sequence, species_group_annotated_snps_dict, translated_snp_residue_dict,
+                       ref_translated_snp_residue_dict, species_group_num_snps, summary_path, molecule, max_cells,
+                       changed_groups)
+                      for molecule in ('nt', 'aa')]
+        if int(threads) > 1:
+            with multiprocessing.Pool(processes=len(table_args)) as pool:
+                molecule_tables = pool.starmap(TreeMethods.create_summary_table, table_args)
+        else:
+            molecule_tables = [TreeMethods.create_summary_table(*args) for args in table_args]
+        return [summary_table for summary_tables in molecule_tables for summary_table in summary_tables]
 
     @staticmethod
     def format_workbook(wb, molecule, font_size=8):
@@ -2445,65 +3474,3 @@ class TreeMethods(object):
                                               'font_size': font_size,
                                               'bold': True})
         return header, courier, bold_courier, top_bold_courier, annotation, format_dict, ambiguous_format
-
-    @staticmethod
-    def format_sequence(pos, sequence_dict, ref_dict, bold_courier, format_dict, ambiguous_format, molecule, ref=False):
-        """
-        Add the necessary formatting to the current position
-        :param pos: type INT: Current position in the sequence of the reference chromosome
-        :param sequence_dict: type DICT: Dictionary of strain-specific SNP data. Accessed with pos
-        :param ref_dict: type DICT: Dictionary of the reference genome-specific location data. Accessed with pos
-        :param bold_courier: XLSX writer formatting block for bold courier
-        :param format_dict: type DICT: Dictionary of nucleotide/amino acid-specific XLSX writer formats
-        :param ambiguous_format: XLSX writer formatting block for sequences that do not exist in format_dict
-        :param molecule: type STR: Creating nucleotide or amino acid outputs
-        :param ref: type BOOL: Create outputs for a reference genome rather than a query strain
-        :return: sequence: The nucleotide base or amino acid residue at the current position of the strain under
-        consideration
-        return: base_format: The location-specific formatting to apply to the cell containing the sequence
-        """
-        # Extract the position-specific sequence from the dictionary
-        if molecule == 'nt':
-            try:
-                sequence = sequence_dict[pos]
-            # A missing key indicates that the strain-specific sequence matches the reference sequence
-            except KeyError:
-                sequence = ref_dict[pos]
-        else:
-            # The reference dictionary does not include the 'strain_name' key, and missing keys are due to the fact
-            # that the SNP position falls in a non-coding region
-            if ref:
-                try:
-                    sequence = sequence_dict[pos]['ref_aa_seq_cds']
-                except KeyError:
-                    sequence = 'NC'
-            # Extract the strain-specific amino acid sequence at the SNP position
-            else:
-                try:
-                    sequence = sequence_dict[pos]['snp_aa_seq_cds']
-                # If the key is missing from the dictionary it is either because of a deletion or that the SNP position
-                # falls in a non-coding region
-                except KeyError:
-                    sequence = '-'
-        # Determine the format to use for the cell based on the sequence
-        # If the sequence matches the reference sequence, it uses the standard black text on
-        # white background format
-        base_format = bold_courier
-        if molecule == 'nt':
-            if sequence != ref_dict[pos]:
-                # If the sequence is one of A, C, G, T, or N, extract the appropriate format
-                # from the dictionary
-                try:
-                    base_format = format_dict[sequence]
-                # If the sequence is a degenerate base (e.g. M), or missing (-), use the
-                # 'ambiguous' format
-                except KeyError:
-                    base_format = ambiguous_format
-        else:
-            try:
-                base_format = format_dict[sequence]
-            # If the sequence is a degenerate base (e.g. M), or missing (-), use the
-            # 'ambiguous' format
-            except KeyError:
-                base_format = ambiguous_format
-        return sequence, base_format
@@ -1,15 +1,25 @@
 #!/usr/bin/env python3
 from olctools.accessoryFunctions.accessoryFunctions import filer, make_path, relative_symlink, run_subprocess, \
     write_to_logfile
+from cowsnphr_src.task_graph import TaskGraph
 import multiprocessing
+import subprocess
+import threading
 from glob import glob
+import logging
 import shutil
 import gzip
 import os
+import time
 import re
 
 __author__ = 'adamkoziol'
 
+# Estimated memory of a postprocess_variants job: a fixed cost for the deepvariant runtime, plus a multiple of the size
+# of the compressed call_variants output and non-variant site records, which are decompressed and merged in memory
+POSTPROCESS_BASE_MEMORY = 1 << 30
+POSTPROCESS_MEMORY_FACTOR = 10
+
 
 class VCFMethods(object):
     @staticmethod
@@ -63,25 +73,32 @@ class VCFMethods(object):
         return strain_name_dict
 
     @staticmethod
-    def file_link(strain_folder_dict, strain_name_dict):
+    def file_link(strain_folder_dict, strain_name_dict, link=True):
         """
         Create folders for each strain. Create relative symlinks to the original FASTQ files from within the folder
         :param strain_folder_dict: type DICT: Dictionary of strain folder path: FASTQ files
         :param strain_name_dict: type DICT: Dictionary of base strain name: strain folder path
+        :param link: type BOOL: Create the folders and symlinks. If False, only the paths of the symlinks are
+        determined e.g. for a dry run. Default is True
         :return: strain_fastq_dict: Dictionary of strain name: list of absolute path(s) of FASTQ file(s)
         """
         #
         strain_fastq_dict = dict()
         for strain_name, strain_folder in strain_name_dict.items():
             # Create the strain folder path if required
-            make_path(strain_folder)
+            if link:
+                make_path(strain_folder)
             # Use the strain_folder value from the strain_name_dict as the key to extract the list of FASTQ files
             # associated with each strain
             for fastq_file in strain_folder_dict[strain_folder]:
                 # Create relative symlinks between the original FASTQ files and the strain folder
-                symlink_path = relative_symlink(src_file=fastq_file,
-                                                output_dir=strain_folder,
-                                                export_output=True)
+                if link:
+                    symlink_path = relative_symlink(src_file=fastq_file,
+                                                    output_dir=strain_folder,
+                                                    export_output=True)
+                # The symlinks have the same names as the FASTQ files
+                else:
+                    symlink_path = os.path.join(strain_folder, os.path.basename(fastq_file))
                 # Add the absolute path of the symlink to the dictionary
                 try:
                     strain_fastq_dict[strain_name].append(symlink_path)
@@ -644,6 +661,295 @@ class VCFMethods(object):
                                  logfile=logfile)
         return quast_report_dict
 
+    @staticmethod
+    def allocate_strain_threads(num_strains, threads, max_strain_threads=8):
+        """
+        Determine the number of strains to process concurrently, and the number of threads to allocate to each strain
+        :param num_strains: type INT: Number of strains to process
+        :param threads: type INT: Total number of threads available
+        :param max_strain_threads: type INT: Number of threads per strain used to determine how many strains are
+        processed concurrently. Any remaining threads are shared between the concurrent strains
+        :return: concurrent_strains: Number of strains to process concurrently
+        :return: strain_threads: Number of threads allocated to each strain
+        """
+        threads = max(1, int(threads))
+        # Process as many strains concurrently as there are blocks of max_strain_threads threads
+        concurrent_strains = max(1, min(num_strains, threads // max(1, min(int(max_strain_threads), threads))))
+        # Share all the threads between the concurrent strains
+        strain_threads = max(1, threads // concurrent_strains)
+        return concurrent_strains, strain_threads
+
+    @staticmethod
+    def add_read_tasks(graph, strain_name, fastq_files, strain_name_dict, strain_mapper_index_dict, threads, logfile,
+                       reference_mapper, dependencies=None, inputs=None):
+        """
+        Add the read-processing stages (map -> index -> unmapped reads -> SKESA -> quast) of a single strain to a task
+        graph. The tasks are named map:, index:, unmapped:, skesa:, and quast: followed by the strain name, and each
+        returns the strain-specific dictionary created by its stage. As the stages only return the paths of their
+        outputs when the outputs already exist, they also restore the results of up to date tasks
+        :param graph: TaskGraph object
+        :param strain_name: type STR: Name of the strain
+        :param fastq_files: type LIST: List of the FASTQ files of the strain
+        :param strain_name_dict: type DICT: Dictionary of strain name: strain-specific working folder
+        :param strain_mapper_index_dict: type DICT: Dictionary of strain name: Absolute path to reference strain index.
+        Read when the mapping task is run, so it may be populated by one of the dependencies
+        :param threads: type INT: Number of threads to request for the analyses
+        :param logfile: type STR: Absolute path to logfile basename
+        :param reference_mapper: type STR: Name of the reference mapping software to use. Choices are bwa and bowtie2
+        :param dependencies: type LIST: Names of tasks that must complete before the reads are mapped
+        :param inputs: type LIST: Absolute paths of additional files (e.g. the reference genome) read by the mapping
+        """
+        strain_folder = strain_name_dict[strain_name]
+        sorted_bam = os.path.join(strain_folder, '{sn}_sorted.bam'.format(sn=strain_name))
+        unmapped_reads = os.path.join(strain_folder, '{sn}_unmapped.fastq.gz'.format(sn=strain_name))
+        skesa_assembly_file = os.path.join(strain_folder, 'skesa', '{sn}_unmapped.fasta'.format(sn=strain_name))
+
+        def sorted_bam_dict():
+            return graph.results['map:{sn}'.format(sn=strain_name)]
+
+        def unmapped_reads_dict():
+            return graph.results['unmapped:{sn}'.format(sn=strain_name)]
+
+        def map_reads():
+            return VCFMethods.map_ref_genome(strain_fastq_dict={strain_name: fastq_files},
+                                             strain_name_dict=strain_name_dict,
+                                             strain_mapper_index_dict=strain_mapper_index_dict,
+                                             threads=threads,
+                                             logfile=logfile,
+                                             reference_mapper=reference_mapper)
+
+        def index_bam():
+            return VCFMethods.samtools_index(strain_sorted_bam_dict=sorted_bam_dict(),
+                                             strain_name_dict=strain_name_dict,
+                                             threads=threads,
+                                             logfile=logfile)
+
+        def extract_reads():
+            return VCFMethods.extract_unmapped_reads(strain_sorted_bam_dict=sorted_bam_dict(),
+                                                     strain_name_dict=strain_name_dict,
+                                                     threads=threads,
+                                                     logfile=logfile)
+
+        def assemble_reads():
+            return VCFMethods.assemble_unmapped_reads(strain_unmapped_reads_dict=unmapped_reads_dict(),
+                                                      strain_name_dict=strain_name_dict,
+                                                      threads=threads,
+                                                      logfile=logfile)
+
+        def run_quast():
+            return VCFMethods.quast(
+                strain_skesa_output_fasta_dict=graph.results['skesa:{sn}'.format(sn=strain_name)],
+                strain_unmapped_reads_dict=unmapped_reads_dict(),
+                strain_sorted_bam_dict=sorted_bam_dict(),
+                threads=threads,
+                logfile=logfile)
+        # Name of the task, function, dependencies, inputs, and outputs of each stage
+        stages = [
+            ('map', map_reads, list(dependencies or list()), list(fastq_files) + list(inputs or list()),
+             [sorted_bam]),
+            ('index', index_bam, ['map'], [sorted_bam], [sorted_bam + '.bai']),
+            ('unmapped', extract_reads, ['map'], [sorted_bam], [unmapped_reads]),
+            ('skesa', assemble_reads, ['unmapped'], [unmapped_reads], [skesa_assembly_file]),
+            ('quast', run_quast, ['skesa', 'index'], [skesa_assembly_file, sorted_bam],
+             [os.path.join(os.path.dirname(skesa_assembly_file), 'transposed_report.tsv')])
+        ]
+        stage_names = {stage[0] for stage in stages}
+        for stage, function, stage_dependencies, stage_inputs, stage_outputs in stages:
+            graph.add_task(name='{stage}:{sn}'.format(stage=stage,
+                                                      sn=strain_name),
+                           function=function,
+                           dependencies=['{stage}:{sn}'.format(stage=dependency, sn=strain_name)
+                                         if dependency in stage_names else dependency
+                                         for dependency in stage_dependencies],
+                           inputs=stage_inputs,
+                           outputs=stage_outputs,
+                           threads=threads,
+                           restore=function)
+
+    @staticmethod
+    def read_task_results(graph, strain_names):
+        """
+        Combine the strain-specific results of the read-processing tasks of a completed task graph
+        :param graph: TaskGraph object
+        :param strain_names: type iterable: Names of the strains in the desired order
+        :return: strain_sorted_bam_dict: Dictionary of strain name: absolute path to sorted BAM files
+        :return: strain_unmapped_reads_dict: Dictionary of strain name: absolute path to unmapped reads FASTQ file
+        :return: strain_skesa_output_fasta_dict: Dictionary of strain name: absolute path to SKESA assembly
+        :return: quast_report_dict: Dictionary of strain name: absolute path to quast report
+        """
+        strain_sorted_bam_dict = dict()
+        strain_unmapped_reads_dict = dict()
+        strain_skesa_output_fasta_dict = dict()
+        quast_report_dict = dict()
+        for strain_name in strain_names:
+            strain_sorted_bam_dict.update(graph.results['map:{sn}'.format(sn=strain_name)])
+            strain_unmapped_reads_dict.update(graph.results['unmapped:{sn}'.format(sn=strain_name)])
+            strain_skesa_output_fasta_dict.update(graph.results['skesa:{sn}'.format(sn=strain_name)])
+            quast_report_dict.update(graph.results['quast:{sn}'.format(sn=strain_name)])
+        return strain_sorted_bam_dict, strain_unmapped_reads_dict, strain_skesa_output_fasta_dict, quast_report_dict
+
+    @staticmethod
+    def add_variant_tasks(graph, strain_name, strain_name_dict, strain_reference_abs_path_dict, vcf_path, home,
+                          threads, logfile, deepvariant_version, variant_caller, working_path=None,
+                          dependencies=None, inputs=None, after=None, worker=None, shards=None):
+        """
+        Add the variant calling of a single strain to a task graph as three pipelined phases. The examples are made by
+        one make_examples task per shard (see add_make_examples_tasks), so that the shards of different strains share
+        the thread budget. The call_variants: task (named with the strain name) then runs call_variants, and the
+        postprocess: task runs postprocess_variants, copies the gVCF file to the vcf_path, and returns the
+        strain-specific strain_vcf_dict. As each phase of a strain only waits for the previous phase of the same
+        strain, the phases of different strains overlap. The read-processing tasks of the strain must be in the graph
+        :param graph: TaskGraph object
+        :param strain_name: type STR: Name of the strain
+        :param strain_name_dict: type DICT: Dictionary of strain name: absolute path to strain-specific working dir
+        :param strain_reference_abs_path_dict: type DICT: Dictionary of strain name: absolute path to best reference
+        genome. Read when the task is run, so it may be populated by one of the dependencies
+        :param vcf_path: type STR: Absolute path to folder in which all .gvcf.gz files are to be copied
+        :param home: type STR: Absolute path to $HOME
+        :param threads: type INT: Number of threads to use in call_variants
+        :param logfile: type STR: Absolute path to logfile basename
+        :param deepvariant_version: type STR: Version number of deepvariant docker image to use
+        :param variant_caller: type STR: Variant calling software to use. Choices are deepvariant, and
+        deepvariant-gpu
+        :param working_path: type STR: Absolute path to an additional volume to mount to docker container
+        :param dependencies: type LIST: Names of additional tasks that must complete before variants are called
+        :param inputs: type LIST: Absolute paths of additional files (e.g. the reference genome) read by the task
+        :param after: type LIST: Names of tasks (e.g. the postprocess: task of an earlier strain) that must complete
+        before the examples are made. Bounds the number of strains queued between make_examples and
+        postprocess_variants
+        :param worker: Optional DeepVariantWorker that runs the deepvariant commands in a long-running container
+        :param shards: type INT: Number of make_examples shards (--task) of the strain. The shards are independent of
+        the number of strains processed concurrently, so that the outputs do not depend on the number of strains.
+        Default is threads
+        """
+        # Split the examples into the total number of threads, as deepvariant_make_examples does
+        shards = shards or threads
+        strain_folder = strain_name_dict[strain_name]
+        sorted_bam = os.path.join(strain_folder, '{sn}_sorted.bam'.format(sn=strain_name))
+        deepvariant_dir = os.path.join(strain_folder, 'deepvariant')
+        call_variants_output = os.path.join(deepvariant_dir, '{sn}_call_variants_output_tfrecord.gz'
+                                            .format(sn=strain_name))
+        vcf_file_name = os.path.join(vcf_path, '{sn}.gvcf.gz'.format(sn=strain_name))
+        strain_variant_path_dict = {strain_name: deepvariant_dir}
+        strain_gvcf_tfrecords_dict = {
+            strain_name: '{gvcf_tfrecords}@{shards}.gz'
+            .format(gvcf_tfrecords=os.path.join(deepvariant_dir, '{sn}_gvcf'.format(sn=strain_name)),
+                    shards=shards)
+        }
+        shard_tasks = VCFMethods.add_make_examples_tasks(
+            graph=graph,
+            strain_name=strain_name,
+            sorted_bam=sorted_bam,
+            strain_name_dict=strain_name_dict,
+            strain_reference_abs_path_dict=strain_reference_abs_path_dict,
+            vcf_path=vcf_path,
+            home=home,
+            shards=shards,
+            logfile=logfile,
+            deepvariant_version=deepvariant_version,
+            working_path=working_path,
+            dependencies=['index:{sn}'.format(sn=strain_name)] + list(dependencies or list()),
+            inputs=[sorted_bam + '.bai'] + list(inputs or list()),
+            after=after,
+            worker=worker)
+
+        def call_variants():
+            # Only call variants if the strain was successfully mapped
+            if strain_name not in graph.results['map:{sn}'.format(sn=strain_name)]:
+                return dict()
+            return VCFMethods.deepvariant_call_variants(strain_variant_path_dict=strain_variant_path_dict,
+                                                        strain_name_dict=strain_name_dict,
+                                                        vcf_path=vcf_path,
+                                                        home=home,
+                                                        threads=threads,
+                                                        logfile=logfile,
+                                                        working_path=working_path,
+                                                        deepvariant_version=deepvariant_version,
+                                                        variant_caller=variant_caller,
+                                                        worker=worker)
+
+        def postprocess_variants():
+            strain_call_variants_dict = graph.results['call_variants:{sn}'.format(sn=strain_name)]
+            strain_vcf_dict = dict()
+            for variant_strain in strain_call_variants_dict:
+                strain_vcf_dict.update(VCFMethods.deepvariant_postprocess_variants(
+                    strain_name=variant_strain,
+                    strain_call_variants_dict=strain_call_variants_dict,
+                    strain_variant_path_dict=strain_variant_path_dict,
+                    strain_name_dict=strain_name_dict,
+                    strain_reference_abs_path_dict=strain_reference_abs_path_dict,
+                    strain_gvcf_tfrecords_dict=strain_gvcf_tfrecords_dict,
+                    vcf_path=vcf_path,
+                    home=home,
+                    logfile=logfile,
+                    deepvariant_version=deepvariant_version,
+                    working_path=working_path,
+                    worker=worker))
+            VCFMethods.copy_vcf_files(strain_vcf_dict=strain_vcf_dict,
+                                      vcf_path=vcf_path)
+            return strain_vcf_dict
+
+        def restore_variants():
+            # Use the copy of the gVCF file if the deepvariant working directory has been removed
+            gvcf_file = os.path.join(deepvariant_dir, '{sn}.gvcf.gz'.format(sn=strain_name))
+            if not os.path.isfile(gvcf_file):
+                gvcf_file = vcf_file_name
+            return {strain_name: gvcf_file}
+        graph.add_task(name='call_variants:{sn}'.format(sn=strain_name),
+                       function=call_variants,
+                       dependencies=shard_tasks,
+                       inputs=list(inputs or list()),
+                       outputs=[call_variants_output],
+                       scratch=[vcf_file_name],
+                       threads=threads,
+                       restore=lambda: {strain_name: call_variants_output})
+        graph.add_task(name='postprocess:{sn}'.format(sn=strain_name),
+                       function=postprocess_variants,
+                       dependencies=['call_variants:{sn}'.format(sn=strain_name)],
+                       inputs=[call_variants_output] + list(inputs or list()),
+                       outputs=[vcf_file_name],
+                       scratch=[os.path.join(deepvariant_dir, '{sn}{suffix}'.format(sn=strain_name,
+                                                                                    suffix=suffix))
+                                for suffix in ('.vcf.gz', '.gvcf.gz')],
+                       restore=restore_variants,
+                       memory=lambda: VCFMethods.postprocess_memory(
+                           call_variants_output=call_variants_output,
+                           gvcf_tfrecords=strain_gvcf_tfrecords_dict[strain_name]))
+
+    @staticmethod
+    def postprocess_memory(call_variants_output, gvcf_tfrecords):
+        """
+        Estimate the peak memory of a postprocess_variants job from the sizes of its inputs. The gVCF file is created
+        from the non-variant site records, so their size determines the size of the gVCF file
+        :param call_variants_output: type STR: Absolute path to the call_variants output file
+        :param gvcf_tfrecords: type STR: Sharded path of the non-variant site records e.g. strain_gvcf@4.gz
+        :return: Estimated memory in bytes
+        """
+        base, shards = gvcf_tfrecords.rsplit('@', 1)
+        shards = int(shards.split('.')[0])
+        # Expand the sharded path into the names of the shards e.g. strain_gvcf-00000-of-00004.gz
+        input_files = [call_variants_output] + glob('{base}-*-of-{shards:05d}.gz'.format(base=base,
+                                                                                       shards=shards))
+        input_size = sum(os.path.getsize(input_file) for input_file in input_files if os.path.isfile(input_file))
+        return POSTPROCESS_BASE_MEMORY + POSTPROCESS_MEMORY_FACTOR * input_size
+
+    @staticmethod
+    def available_memory():
+        """
+        Determine the memory available to new processes without swapping
+        :return: Available memory in bytes
+        """
+        try:
+            with open('/proc/meminfo', 'r') as meminfo:
+                for line in meminfo:
+                    # e.g. MemAvailable:   12345678 kB
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        # Fall back to the free physical memory on systems without /proc/meminfo
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
     @staticmethod
     def parse_quast_report(quast_report_dict, summary_path):
         """
@@ -791,9 +1097,96 @@ class VCFMethods(object):
                                          .format(strain_name=strain_name))))
         return strain_examples_dict, strain_variant_path, strain_gvcf_tfrecords_dict
 
+    @staticmethod
+    def add_make_examples_tasks(graph, strain_name, sorted_bam, strain_name_dict, strain_reference_abs_path_dict,
+                                vcf_path, home, shards, logfile, deepvariant_version, working_path=None,
+                                dependencies=None, inputs=None, after=None, worker=None):
+        """
+        Add one single-threaded deepvariant make_examples task per shard of a strain to a task graph. The tasks are
+        named make_examples: followed by the strain name and the shard number. As the copy of the final gVCF file in
+        the vcf_path is no longer valid once the examples are remade, it is removed before an out of date shard is run
+        :param graph: TaskGraph object
+        :param strain_name: type STR: Name of the strain
+        :param sorted_bam: type STR: Absolute path to the sorted BAM file of the strain
+        :param strain_name_dict: type DICT: Dictionary of strain name: absolute path to strain-specific working dir
+        :param strain_reference_abs_path_dict: type DICT: Dictionary of strain name: absolute path to best reference
+        genome. Read when the tasks are run, so it may be populated by one of the dependencies
+        :param vcf_path: type STR: Absolute path to folder in which all .gvcf.gz files are to be copied
+        :param home: type STR: Absolute path to $HOME
+        :param shards: type INT: Number of shards into which the examples of the strain are split
+        :param logfile: type STR: Absolute path to logfile basename
+        :param deepvariant_version: type STR: Version number of deepvariant docker image to use
+        :param working_path: type STR: Absolute path to an additional volume to mount to docker container
+        :param dependencies: type LIST: Names of tasks that must complete before the examples are made
+        :param inputs: type LIST: Absolute paths of additional files (e.g. the reference genome) read by the tasks
+        :param after: type LIST: Names of tasks that must complete before the examples are made, without making the
+        tasks out of date
+        :param worker: Optional DeepVariantWorker that runs make_examples in a long-running container
+        :return: task_names: List of the names of the tasks
+        """
+        strain_folder = strain_name_dict[strain_name]
+        deepvariant_dir = os.path.join(strain_folder, 'deepvariant')
+        output_example = '{output}_tfrecord'.format(output=os.path.join(deepvariant_dir, strain_name))
+        gvcf_tfrecords = '{output}_gvcf'.format(output=os.path.join(deepvariant_dir, strain_name))
+        vcf_file_name = os.path.join(vcf_path, '{sn}.gvcf.gz'.format(sn=strain_name))
+        # Create the string of volume to mount to the container. Add the working path if it has been provided
+        volumes = '{home}:{home}'.format(home=home) if not working_path \
+            else '{home}:{home} -v {working_path}:{working_path}'.format(home=home,
+                                                                         working_path=working_path)
+        task_names = list()
+        for task in range(shards):
+            # Names of the sharded outputs created by deepvariant e.g. strain_tfrecord-00001-of-00004.gz
+            shard_outputs = ['{base}-{task:05d}-of-{shards:05d}.gz'.format(base=base,
+                                                                           task=task,
+                                                                           shards=shards)
+                             for base in (output_example, gvcf_tfrecords)]
+
+            def make_examples(task=task, shard_outputs=shard_outputs):
+                make_path(deepvariant_dir)
+                # Use the same system call as deepvariant_make_examples for a single --task
+                make_example_cmd = '/opt/deepvariant/bin/make_examples --mode calling --ref {ref} --reads {bam} ' \
+                                   '--examples {output_example}@{threads}.gz --gvcf {gvcf_tfrecords}@{threads}.gz ' \
+                                   '--task {task}' \
+                    .format(ref=strain_reference_abs_path_dict[strain_name],
+                            bam=sorted_bam,
+                            output_example=output_example,
+                            threads=shards,
+                            gvcf_tfrecords=gvcf_tfrecords,
+                            task=task)
+                # Ensure that the BAM file exists, and that the final outputs and the outputs of this shard don't
+                # already exist
+                if os.path.isfile(sorted_bam) and not os.path.isfile(vcf_file_name) \
+                        and not all(os.path.isfile(output) for output in shard_outputs):
+                    if worker:
+                        out, err = worker.run(command=make_example_cmd,
+                                              strain_name=strain_name,
+                                              phase='make_examples')
+                    else:
+                        out, err = run_subprocess('docker run --rm -v {volumes} google/deepvariant:{dvv} {cmd}'
+                                                  .format(volumes=volumes,
+                                                          dvv=deepvariant_version,
+                                                          cmd=make_example_cmd))
+                    write_to_logfile(out=out,
+                                     err=err,
+                                     logfile=logfile,
+                                     samplelog=os.path.join(strain_folder, 'log.out'),
+                                     sampleerr=os.path.join(strain_folder, 'log.err'))
+            task_name = 'make_examples:{sn}:{task}'.format(sn=strain_name,
+                                                            task=task)
+            graph.add_task(name=task_name,
+                           function=make_examples,
+                           dependencies=dependencies,
+                           inputs=[sorted_bam] + list(inputs or list()),
+                           outputs=shard_outputs,
+                           scratch=[vcf_file_name],
+                           after=after)
+            task_names.append(task_name)
+        return task_names
+
     @staticmethod
     def deepvariant_call_variants(strain_variant_path_dict, strain_name_dict, vcf_path,
-                                  home, threads, logfile, variant_caller, deepvariant_version, working_path=None):
+                                  home, threads, logfile, variant_caller, deepvariant_version, working_path=None,
+                                  worker=None):
         """
         Perform variant calling. Process deepvariant examples files with call_variant
         :param strain_variant_path_dict: type DICT: Dictionary of strain name: absolute path to deepvariant output dir
@@ -806,6 +1199,8 @@ class VCFMethods(object):
         (has GPU support)
         :param deepvariant_version: type STR: Version number of deepvariant docker image to use
         :param working_path: type STR: Absolute path to an additional volume to mount to docker container
+        :param worker: Optional DeepVariantWorker that runs call_variants in a long-running container. The container
+        is started with the image matching variant_caller
         :return: strain_call_variants_dict: Dictionary of strain name: absolute path to deepvariant call_variants
         outputs
         """
@@ -827,34 +1222,36 @@ class VCFMethods(object):
                                                                              working_path=working_path)
             # Set the absolute path to the deepvariant model to be used by call_variants
             model = '/opt/models/wgs/model.ckpt'
+            # Set the call_variants command
+            call_variants_cmd = '/opt/deepvariant/bin/call_variants --outfile {output_file} ' \
+                                '--examples {output_example}@{threads}.gz --checkpoint {model}' \
+                .format(output_file=call_variants_output,
+                        output_example=output_example,
+                        threads=threads,
+                        model=model)
             # Set the system call.
             if variant_caller == 'deepvariant-gpu':
                 #  Use nvidia-docker to run call_variants with GPU support.
-                call_variants_cmd = 'nvidia-docker run --rm -v {volumes} ' \
-                                    'google/deepvariant-gpu:{dvv} ' \
-                                    '/opt/deepvariant/bin/call_variants --outfile {output_file} ' \
-                                    '--examples {output_example}@{threads}.gz --checkpoint {model} ' \
+                docker_cmd = 'nvidia-docker run --rm -v {volumes} google/deepvariant-gpu:{dvv} {cmd}' \
                     .format(volumes=volumes,
                             dvv=deepvariant_version,
-                            output_file=call_variants_output,
-                            output_example=output_example,
-                            threads=threads,
-                            model=model)
+                            cmd=call_variants_cmd)
             else:
                 # Use docker to run call_variants.
-                call_variants_cmd = 'docker run --rm -v {volumes} google/deepvariant:{dvv} ' \
-                                    '/opt/deepvariant/bin/call_variants --outfile {output_file} ' \
-                                    '--examples {output_example}@{threads}.gz --checkpoint {model}' \
+                docker_cmd = 'docker run --rm -v {volumes} google/deepvariant:{dvv} {cmd}' \
                     .format(volumes=volumes,
                             dvv=deepvariant_version,
-                            output_file=call_variants_output,
-                            output_example=output_example,
-                            threads=threads,
-                            model=model)
+                            cmd=call_variants_cmd)
             # Run the system call if the output file and the final outputs don't already exist
             vcf_file_name = os.path.join(vcf_path, '{sn}.gvcf.gz'.format(sn=strain_name))
             if not os.path.isfile(vcf_file_name) and not os.path.isfile(call_variants_output):
-                out, err = run_subprocess(call_variants_cmd)
+                if worker:
+                    # Run call_variants in the long-running container
+                    out, err = worker.run(command=call_variants_cmd,
+                                          strain_name=strain_name,
+                                          phase='call_variants')
+                else:
+                    out, err = run_subprocess(docker_cmd)
                 # Write STDOUT and STDERR to the logfile
                 write_to_logfile(out=out,
                                  err=err,
@@ -867,9 +1264,11 @@ class VCFMethods(object):
     def deepvariant_postprocess_variants_multiprocessing(strain_call_variants_dict, strain_variant_path_dict,
                                                          strain_name_dict, strain_reference_abs_path_dict,
                                                          strain_gvcf_tfrecords_dict, vcf_path, home, logfile, threads,
-                                                         deepvariant_version, working_path=None):
+                                                         deepvariant_version, working_path=None, max_memory=None):
         """
-        Create .gvcf.gz outputs
+        Create .gvcf.gz outputs. Each postprocess_variants job runs in its own container, so the number of concurrent
+        jobs is limited by both the number of threads (and CPUs), and by the estimated memory of the jobs
+        (see postprocess_memory) fitting in the available memory
         :param strain_call_variants_dict: type DICT: Dictionary of strain name: absolute path to deepvariant
         call_variants outputs
         :param strain_variant_path_dict: type DICT: Dictionary of strain name: absolute path to deepvariant output dir
@@ -881,44 +1280,46 @@ class VCFMethods(object):
         :param vcf_path: type STR: Absolute path to folder in which all symlinks to .vcf files are to be created
         :param home: type STR: Absolute path to $HOME
         :param logfile: type STR: Absolute path to logfile basename
-        :param threads: type INT: Number of concurrent processes to spawn
+        :param threads: type INT: Maximum number of concurrent jobs
         :param deepvariant_version: type STR: Version number of deepvariant docker image to use
         :param working_path: type STR: Absolute path to an additional volume to mount to docker container
+        :param max_memory: type INT: Memory (bytes) shared by the concurrent jobs. Default is None (the memory
+        available when the jobs are started)
         :return: strain_vcf_dict: Dictionary of strain name: absolute path to deepvariant output VCF file
         """
         # Initialise a dictionary to store the absolute path of the .vcf.gz output files
         strain_vcf_dict = dict()
-        # Create a multiprocessing pool. Limit the number of processes to the number of threads
-        p = multiprocessing.Pool(processes=threads)
-        # Create a list of all the strain names
-        strain_list = [strain_name for strain_name in strain_call_variants_dict]
-        # Determine the number of strains present in the analyses
-        list_length = len(strain_list)
-        # Use multiprocessing.Pool.starmap to process the samples in parallel
-        # Supply the list of strains, as well as a list the length of the number of strains of each required variable
-        for vcf_dict in p.starmap(VCFMethods.deepvariant_postprocess_variants,
-                                  zip(strain_list,
-                                      [strain_call_variants_dict] * list_length,
-                                      [strain_variant_path_dict] * list_length,
-                                      [strain_name_dict] * list_length,
-                                      [strain_reference_abs_path_dict] * list_length,
-                                      [strain_gvcf_tfrecords_dict] * list_length,
-                                      [vcf_path] * list_length,
-                                      [home] * list_length,
-                                      [logfile] * list_length,
-                                      [deepvariant_version] * list_length,
-                                      [working_path] * list_length)):
+        graph = TaskGraph()
+        for strain_name in strain_call_variants_dict:
+            graph.add_task(name='postprocess:{sn}'.format(sn=strain_name),
+                           function=lambda strain_name=strain_name: VCFMethods.deepvariant_postprocess_variants(
+                               strain_name=strain_name,
+                               strain_call_variants_dict=strain_call_variants_dict,
+                               strain_variant_path_dict=strain_variant_path_dict,
+                               strain_name_dict=strain_name_dict,
+                               strain_reference_abs_path_dict=strain_reference_abs_path_dict,
+                               strain_gvcf_tfrecords_dict=strain_gvcf_tfrecords_dict,
+                               vcf_path=vcf_path,
+                               home=home,
+                               logfile=logfile,
+                               deepvariant_version=deepvariant_version,
+                               working_path=working_path),
+                           memory=VCFMethods.postprocess_memory(
+                               call_variants_output=strain_call_variants_dict[strain_name],
+                               gvcf_tfrecords=strain_gvcf_tfrecords_dict[strain_name]))
+        # Do not run more jobs than there are CPUs
+        graph.run(threads=min(int(threads), multiprocessing.cpu_count()),
+                  max_memory=max_memory if max_memory else VCFMethods.available_memory())
+        for strain_name in strain_call_variants_dict:
             # Update the dictionaries
-            strain_vcf_dict.update(vcf_dict)
-        # Close and join the pool
-        p.close()
-        p.join()
+            strain_vcf_dict.update(graph.results['postprocess:{sn}'.format(sn=strain_name)])
         return strain_vcf_dict
 
     @staticmethod
     def deepvariant_postprocess_variants(strain_name, strain_call_variants_dict, strain_variant_path_dict,
                                          strain_name_dict, strain_reference_abs_path_dict, strain_gvcf_tfrecords_dict,
-                                         vcf_path, home, logfile, deepvariant_version, working_path=None):
+                                         vcf_path, home, logfile, deepvariant_version, working_path=None,
+                                         worker=None):
         """
         Run the postprocess_variants script in the deepvariant Docker images. Creates global VCF output files
         :param strain_name: type STR: Name of strain currently being processed
@@ -935,6 +1336,7 @@ class VCFMethods(object):
         :param logfile: type STR: Absolute path to logfile basename
         :param deepvariant_version: type STR: Version number of deepvariant docker image to use
         :param working_path: type STR: Absolute path to an additional volume to mount to docker container
+        :param worker: Optional DeepVariantWorker that runs postprocess_variants in a long-running container
         :return: strain_vcf_dict: Dictionary of strain name: absolute path to .gvcf.gz output file
         """
         # Initialise a dictionary to store the absolute path of the .vcf.gz output files
@@ -955,15 +1357,12 @@ class VCFMethods(object):
         volumes = '{home}:{home}'.format(home=home) if not working_path \
             else '{home}:{home} -v {working_path}:{working_path}'.format(home=home,
                                                                          working_path=working_path)
-        # Set the system call. Use docker to run postprocess_variants
-        postprocess_variants_cmd = 'docker run --rm -v {volumes} google/deepvariant:{dvv}' \
-                                   ' /opt/deepvariant/bin/postprocess_variants --ref {ref} ' \
+        # Set the postprocess_variants command
+        postprocess_variants_cmd = '/opt/deepvariant/bin/postprocess_variants --ref {ref} ' \
                                    '--nonvariant_site_tfrecord_path {gvcf_records} ' \
                                    '--infile {call_variants_output} --outfile {vcf_file} ' \
                                    '--gvcf_outfile {gvcf_file}' \
-            .format(volumes=volumes,
-                    dvv=deepvariant_version,
-                    ref=ref_genome,
+            .format(ref=ref_genome,
                     gvcf_records=gvcf_records,
                     call_variants_output=call_variants_output,
                     vcf_file=vcf_file,
@@ -972,7 +1371,17 @@ class VCFMethods(object):
         vcf_file_name = os.path.join(vcf_path, '{sn}.gvcf.gz'.format(sn=strain_name))
         # Run the system call if the output file and the final output file don't exist
         if not os.path.isfile(vcf_file_name) and not os.path.isfile(gvcf_file):
-            out, err = run_subprocess(postprocess_variants_cmd)
+            if worker:
+                # Run postprocess_variants in the long-running container
+                out, err = worker.run(command=postprocess_variants_cmd,
+                                      strain_name=strain_name,
+                                      phase='postprocess_variants')
+            else:
+                # Use docker to run postprocess_variants
+                out, err = run_subprocess('docker run --rm -v {volumes} google/deepvariant:{dvv} {cmd}'
+                                          .format(volumes=volumes,
+                                                  dvv=deepvariant_version,
+                                                  cmd=postprocess_variants_cmd))
             # Write STDOUT and STDERR to the logfile
             write_to_logfile(out=out,
                              err=err,
@@ -1101,3 +1510,456 @@ class VCFMethods(object):
             if os.path.isfile(vcf_file):
                 shutil.copyfile(src=vcf_file,
                                 dst=os.path.join(vcf_path, vcf_file_name))
+
+class DeepVariantWorker(object):
+    """
+    Long-running deepvariant container shared by the make_examples, call_variants, and postprocess_variants jobs of
+    every strain. The container is started with the first job, and each job is run in it with docker exec, so the
+    container start-up, image setup, and volume mounts are paid once per run rather than once per job. Each job is
+    still a separate deepvariant process, so call_variants loads the model checkpoint for every strain. Jobs may be
+    submitted concurrently by the tasks of the task graph. If the container cannot be started, each job is run in a
+    new container, as without the worker. With local, the jobs are run directly on the host (e.g. with a local
+    deepvariant installation, or a stand-in in tests) instead. The duration of every job is recorded, and the overhead
+    of a cold docker run is compared with that of a docker exec in the warm container when it is stopped, to estimate
+    the time saved per strain
+    """
+
+    def start(self):
+        """
+        Start the container if it is not already running. If the container is not running once started (e.g. the
+        image could not be pulled, or the volumes could not be mounted), the jobs are run in new containers instead
+        """
+        with self.lock:
+            if self.local or self.started or self.cold:
+                return
+            start = time.time()
+            # Keep the container running until it is stopped. It is removed (--rm) once stopped
+            out, err = run_subprocess('{docker} run -d --rm --name {name} -v {volumes} {image} sleep infinity'
+                                      .format(docker=self.docker,
+                                              name=self.name,
+                                              volumes=self.volumes,
+                                              image=self.image))
+            write_to_logfile(out=out,
+                             err=err,
+                             logfile=self.logfile)
+            self.startup_time = time.time() - start
+            out, err = run_subprocess('{docker} inspect -f {{{{.State.Running}}}} {name}'.format(docker=self.docker,
+                                                                                                 name=self.name))
+            if out.strip() == 'true':
+                self.started = True
+            else:
+                write_to_logfile(out=out,
+                                 err=err,
+                                 logfile=self.logfile)
+                logging.warning('Could not start the deepvariant container {name}. Running each deepvariant job in a '
+                                'new container'.format(name=self.name))
+                self.cold = True
+
+    def run(self, command, strain_name, phase):
+        """
+        Run a deepvariant command in the container
+        :param command: type STR: deepvariant command e.g. /opt/deepvariant/bin/call_variants ...
+        :param strain_name: type STR: Name of the strain processed by the command
+        :param phase: type STR: deepvariant phase (make_examples, call_variants, or postprocess_variants)
+        :return: out: STDOUT of the command
+        :return: err: STDERR of the command
+        """
+        self.start()
+        start = time.time()
+        if self.local:
+            out, err = run_subprocess(command)
+        elif self.cold:
+            out, err = run_subprocess('{docker} run --rm -v {volumes} {image} {cmd}'.format(docker=self.docker,
+                                                                                            volumes=self.volumes,
+                                                                                            image=self.image,
+                                                                                            cmd=command))
+        else:
+            out, err = run_subprocess('{docker} exec {name} {cmd}'.format(docker=self.docker,
+                                                                          name=self.name,
+                                                                          cmd=command))
+        with self.lock:
+            self.job_times.append((phase, strain_name, time.time() - start))
+        return out, err
+
+    def measure_overhead(self):
+        """
+        Time a trivial command run in a new container, and in the warm container
+        :return: cold: Seconds taken by docker run
+        :return: warm: Seconds taken by docker exec
+        """
+        start = time.time()
+        run_subprocess('{docker} run --rm -v {volumes} {image} true'.format(docker=self.docker,
+                                                                            volumes=self.volumes,
+                                                                            image=self.image))
+        cold = time.time() - start
+        start = time.time()
+        run_subprocess('{docker} exec {name} true'.format(docker=self.docker,
+                                                          name=self.name))
+        return cold, time.time() - start
+
+    def stop(self, report_file=None):
+        """
+        Stop the container, and optionally append the job timings to a report file
+        :param report_file: type STR: Absolute path to the report file. Default is None
+        """
+        overhead = self.measure_overhead() if self.started and report_file and self.job_times else None
+        with self.lock:
+            if self.started:
+                run_subprocess('{docker} stop {name}'.format(docker=self.docker,
+                                                             name=self.name))
+                self.started = False
+        if not report_file or not self.job_times:
+            return
+        write_header = not os.path.isfile(report_file)
+        with open(report_file, 'a+') as report:
+            if write_header:
+                report.write('Phase\tStrain\tSeconds\n')
+            for phase, strain_name, seconds in self.job_times:
+                report.write('{phase}\t{sn}\t{seconds:.2f}\n'.format(phase=phase,
+                                                                     sn=strain_name,
+                                                                     seconds=seconds))
+            if overhead:
+                cold, warm = overhead
+                strains = len(set(strain_name for _, strain_name, _ in self.job_times))
+                report.write('# Container start: {start:.2f}s, docker run overhead: {cold:.2f}s, docker exec overhead: '
+                             '{warm:.2f}s, jobs: {jobs}, estimated time saved per strain: {saved:.2f}s\n'
+                             .format(start=self.startup_time,
+                                     cold=cold,
+                                     warm=warm,
+                                     jobs=len(self.job_times),
+                                     saved=((cold - warm) * len(self.job_times) - self.startup_time) / strains))
+            elif self.cold:
+                report.write('# The deepvariant container could not be started. Each job was run in a new '
+                             'container\n')
+        self.job_times = list()
+
+    def __init__(self, home, deepvariant_version, logfile, variant_caller='deepvariant', working_path=None,
+                 local=False):
+        self.logfile = logfile
+        self.local = local
+        # Use nvidia-docker to run the container with GPU support
+        self.docker = 'nvidia-docker' if variant_caller == 'deepvariant-gpu' else 'docker'
+        self.image = 'google/deepvariant:{dvv}'.format(dvv=deepvariant_version)
+        # Create the string of volume to mount to the container. Add the working path if it has been provided
+        self.volumes = '{home}:{home}'.format(home=home) if not working_path \
+            else '{home}:{home} -v {working_path}:{working_path}'.format(home=home,
+                                                                         working_path=working_path)
+        self.name = 'cowsnphr_deepvariant_{pid}'.format(pid=os.getpid())
+        self.lock = threading.Lock()
+        self.started = False
+        # Set if the container could not be started, so that the jobs are run in new containers
+        self.cold = False
+        self.startup_time = 0
+        # List of (phase, strain name, seconds) of the jobs that were run
+        self.job_times = list()
+
+
+class VariantCaller(object):
+    """
+    Base class of the variant calling backends. A backend adds the tasks that create the gVCF file of a strain to a
+    TaskGraph, after the read-processing tasks of the strain (see VCFMethods.add_read_tasks). The result of the final
+    task of each strain is the strain-specific strain_vcf_dict, and the gVCF files are copied to the vcf_path
+    """
+
+    def add_tasks(self, graph, strain_name, strain_name_dict, strain_reference_abs_path_dict, vcf_path, threads,
+                  logfile, dependencies=None, inputs=None, after=None, shards=None):
+        """
+        Add the variant calling tasks of a single strain to a task graph
+        :param graph: TaskGraph object
+        :param strain_name: type STR: Name of the strain
+        :param strain_name_dict: type DICT: Dictionary of strain name: absolute path to strain-specific working dir
+        :param strain_reference_abs_path_dict: type DICT: Dictionary of strain name: absolute path to best reference
+        genome. Read when the tasks are run, so it may be populated by one of the dependencies
+        :param vcf_path: type STR: Absolute path to folder in which all .gvcf.gz files are to be copied
+        :param threads: type INT: Number of threads to use in the analyses
+        :param logfile: type STR: Absolute path to logfile basename
+        :param dependencies: type LIST: Names of additional tasks that must complete before variants are called
+        :param inputs: type LIST: Absolute paths of additional files (e.g. the reference genome) read by the tasks
+        :param after: type LIST: Names of tasks that must complete before variant calling starts, without making the
+        tasks out of date
+        :param shards: type INT: Number of shards into which backends that shard their work split each strain.
+        Default is threads
+        """
+        raise NotImplementedError
+
+    def final_task(self, strain_name):
+        """
+        Name of the last variant calling task of a strain
+        :param strain_name: type STR: Name of the strain
+        :return: Name of the task that returns the strain-specific strain_vcf_dict
+        """
+        raise NotImplementedError
+
+    def finish(self, logfile):
+        """
+        Release the resources held by the backend once the task graph has been run
+        :param logfile: type STR: Absolute path to logfile basename
+        """
+        pass
+
+
+class DeepVariantCaller(VariantCaller):
+    """
+    Call variants with make_examples, call_variants, and postprocess_variants in the deepvariant Docker image. Unless
+    warm is False, the jobs of all the strains are run in a single long-running container (see DeepVariantWorker)
+    """
+
+    def add_tasks(self, graph, strain_name, strain_name_dict, strain_reference_abs_path_dict, vcf_path, threads,
+                  logfile, dependencies=None, inputs=None, after=None, shards=None):
+        VCFMethods.add_variant_tasks(graph=graph,
+                                     strain_name=strain_name,
+                                     strain_name_dict=strain_name_dict,
+                                     strain_reference_abs_path_dict=strain_reference_abs_path_dict,
+                                     vcf_path=vcf_path,
+                                     home=self.home,
+                                     threads=threads,
+                                     logfile=logfile,
+                                     deepvariant_version=self.deepvariant_version,
+                                     variant_caller=self.variant_caller,
+                                     working_path=self.working_path,
+                                     dependencies=dependencies,
+                                     inputs=inputs,
+                                     after=after,
+                                     worker=self.worker,
+                                     shards=shards)
+
+    def final_task(self, strain_name):
+        return 'postprocess:{sn}'.format(sn=strain_name)
+
+    def finish(self, logfile):
+        # Stop the container, and report the job timings in the logfile basename + _deepvariant_times.txt
+        if self.worker:
+            self.worker.stop(report_file='{logfile}_deepvariant_times.txt'.format(logfile=logfile))
+
+    def __init__(self, home, deepvariant_version, logfile, variant_caller='deepvariant', working_path=None,
+                 warm=True):
+        self.home = home
+        self.deepvariant_version = deepvariant_version
+        self.variant_caller = variant_caller
+        self.working_path = working_path
+        self.worker = DeepVariantWorker(home=home,
+                                        deepvariant_version=deepvariant_version,
+                                        logfile=logfile,
+                                        variant_caller=variant_caller,
+                                        working_path=working_path) if warm else None
+
+
+class PileupCaller(VariantCaller):
+    """
+    Lightweight, container-free variant caller. The samtools mpileup of every reference position is parsed in-process,
+    and single base substitutions supported by at least min_alt_fraction of the reads are called. The output uses the
+    gVCF layout of deepvariant: reference blocks with MIN_DP (zero coverage blocks have a MIN_DP of 0), PASS
+    substitutions, and RefCall sites with minority alternate alleles. Indels are not called. Intended for rapid
+    reanalysis of closely related (e.g. outbreak) strains
+    """
+
+    # Removes the read start markers (with their mapping quality character), and the read end markers
+    read_markers = re.compile(r'\^.|\$')
+    # Finds the length of the inserted or deleted sequence following a read base
+    indel = re.compile(r'[+-](\d+)')
+
+    def add_tasks(self, graph, strain_name, strain_name_dict, strain_reference_abs_path_dict, vcf_path, threads,
+                  logfile, dependencies=None, inputs=None, after=None, shards=None):
+        strain_folder = strain_name_dict[strain_name]
+        sorted_bam = os.path.join(strain_folder, '{sn}_sorted.bam'.format(sn=strain_name))
+        gvcf_file = os.path.join(strain_folder, 'pileup', '{sn}.gvcf.gz'.format(sn=strain_name))
+        vcf_file_name = os.path.join(vcf_path, '{sn}.gvcf.gz'.format(sn=strain_name))
+
+        def call_variants():
+            # Only call variants if the strain was successfully mapped
+            if strain_name not in graph.results['map:{sn}'.format(sn=strain_name)]:
+                return dict()
+            strain_vcf_dict = {strain_name: self.call_strain(strain_name=strain_name,
+                                                             sorted_bam=sorted_bam,
+                                                             ref_fasta=strain_reference_abs_path_dict[strain_name],
+                                                             gvcf_file=gvcf_file,
+                                                             logfile=logfile)}
+            VCFMethods.copy_vcf_files(strain_vcf_dict=strain_vcf_dict,
+                                      vcf_path=vcf_path)
+            return strain_vcf_dict
+
+        def restore_variants():
+            # Use the copy of the gVCF file if the working directory has been removed
+            return {strain_name: gvcf_file if os.path.isfile(gvcf_file) else vcf_file_name}
+        graph.add_task(name=self.final_task(strain_name=strain_name),
+                       function=call_variants,
+                       dependencies=['index:{sn}'.format(sn=strain_name)] + list(dependencies or list()),
+                       inputs=[sorted_bam, sorted_bam + '.bai'] + list(inputs or list()),
+                       outputs=[vcf_file_name],
+                       scratch=[os.path.dirname(gvcf_file)],
+                       restore=restore_variants,
+                       after=after)
+
+    def final_task(self, strain_name):
+        return 'pileup:{sn}'.format(sn=strain_name)
+
+    def call_strain(self, strain_name, sorted_bam, ref_fasta, gvcf_file, logfile):
+        """
+        Run samtools mpileup on the sorted BAM file of a strain, and create its gVCF file
+        :param strain_name: type STR: Name of the strain
+        :param sorted_bam: type STR: Absolute path to the sorted BAM file
+        :param ref_fasta: type STR: Absolute path to the (faidx-indexed) reference genome
+        :param gvcf_file: type STR: Absolute path to the gVCF file to create
+        :param logfile: type STR: Absolute path to logfile basename
+        :return: gvcf_file: Absolute path to the gVCF file
+        """
+        if os.path.isfile(gvcf_file):
+            return gvcf_file
+        make_path(os.path.dirname(gvcf_file))
+        # Output every position of every reference sequence (-aa), so that zero coverage blocks are reported. Base
+        # alignment quality is disabled (-B), as it hides substitutions close to the ends of reads
+        pileup_cmd = ['samtools', 'mpileup', '-aa', '-B', '-Q', str(self.min_base_quality), '-q',
+                      str(self.min_mapping_quality), '-f', ref_fasta, sorted_bam]
+        with open(ref_fasta + '.fai', 'r') as fai:
+            contigs = [line.split('\t')[:2] for line in fai]
+        # Write to a temporary file, so that an interrupted run does not leave a truncated gVCF file
+        temp_file = gvcf_file + '.tmp'
+        with open('{logfile}_err.txt'.format(logfile=logfile), 'a+') as err:
+            pileup = subprocess.Popen(pileup_cmd, stdout=subprocess.PIPE, stderr=err, universal_newlines=True)
+            self.write_gvcf(strain_name=strain_name,
+                            pileup=pileup.stdout,
+                            gvcf_file=temp_file,
+                            contigs=contigs)
+            pileup.stdout.close()
+            if pileup.wait():
+                raise subprocess.CalledProcessError(pileup.returncode, ' '.join(pileup_cmd))
+        os.replace(temp_file, gvcf_file)
+        return gvcf_file
+
+    def write_gvcf(self, strain_name, pileup, gvcf_file, contigs):
+        """
+        Call variants from samtools mpileup output, and write the gVCF file
+        :param strain_name: type STR: Name of the strain
+        :param pileup: type iterable: Lines of samtools mpileup output (with the reference sequence supplied)
+        :param gvcf_file: type STR: Absolute path to the gzip-compressed gVCF file to create
+        :param contigs: type LIST: List of [name, length] of each reference sequence
+        """
+        with gzip.open(gvcf_file, 'wt') as gvcf:
+            gvcf.write('##fileformat=VCFv4.2\n'
+                       '##FILTER=<ID=PASS,Description="All filters passed">\n'
+                       '##FILTER=<ID=RefCall,Description="Alternate allele fraction is below the calling threshold.">\n'
+                       '##INFO=<ID=END,Number=1,Type=Integer,Description="End position (for use with symbolic '
+                       'alleles)">\n'
+                       '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n'
+                       '##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Conditional genotype quality">\n'
+                       '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">\n'
+                       '##FORMAT=<ID=MIN_DP,Number=1,Type=Integer,Description="Minimum DP observed within the GVCF '
+                       'block.">\n'
+                       '##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Read depth for each allele">\n'
+                       '##FORMAT=<ID=VAF,Number=A,Type=Float,Description="Variant allele fractions.">\n'
+                       '##FORMAT=<ID=PL,Number=G,Type=Integer,Description="Phred-scaled genotype likelihoods rounded '
+                       'to the closest integer">\n')
+            for name, length in contigs:
+                gvcf.write('##contig=<ID={name},length={length}>\n'.format(name=name,
+                                                                           length=length))
+            gvcf.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{sn}\n'.format(sn=strain_name))
+            # The open reference block: [chrom, start, end, ref, minimum depth, depth band]
+            block = None
+            for line in pileup:
+                chrom, pos, ref, depth, bases = line.split('\t')[:5]
+                pos = int(pos)
+                ref = ref.upper()
+                ref_count, alt, alt_count = self.count_bases(bases=bases if depth != '0' else str(),
+                                                             ref=ref)
+                depth = ref_count + alt_count if alt else ref_count
+                if alt and alt_count >= self.min_alt_depth:
+                    if block:
+                        gvcf.write(self.block_record(*block))
+                        block = None
+                    gvcf.write(self.site_record(chrom=chrom,
+                                                pos=pos,
+                                                ref=ref,
+                                                alt=alt,
+                                                ref_count=ref_count,
+                                                alt_count=alt_count))
+                    continue
+                # Blocks are split when the depth crosses zero (deletions) or the minimum depth
+                band = 0 if not depth else 1 if depth < self.min_depth else 2
+                if block and block[0] == chrom and block[2] == pos - 1 and block[5] == band:
+                    block[2] = pos
+                    block[4] = min(block[4], depth)
+                else:
+                    if block:
+                        gvcf.write(self.block_record(*block))
+                    block = [chrom, pos, pos, ref, depth, band]
+            if block:
+                gvcf.write(self.block_record(*block))
+
+    def count_bases(self, bases, ref):
+        """
+        Count the reads supporting the reference base and the most common alternate base at a pileup position
+        :param bases: type STR: Read bases column of the samtools mpileup output
+        :param ref: type STR: Reference base
+        :return: ref_count: Number of reads matching the reference
+        :return: alt: Most common alternate base, or an empty string if there is none (or the reference is ambiguous)
+        :return: alt_count: Number of reads supporting the alternate base
+        """
+        bases = self.read_markers.sub('', bases)
+        # Remove the inserted and deleted sequences following the read bases
+        if '+' in bases or '-' in bases:
+            pieces = list()
+            last = 0
+            for match in self.indel.finditer(bases):
+                pieces.append(bases[last:match.start()])
+                last = match.end() + int(match.group(1))
+            pieces.append(bases[last:])
+            bases = ''.join(pieces)
+        ref_count = bases.count('.') + bases.count(',')
+        if ref not in 'ACGT':
+            return ref_count, str(), 0
+        upper_bases = bases.upper()
+        alt_count, alt = max((upper_bases.count(base), base) for base in 'ACGT' if base != ref)
+        if not alt_count:
+            return ref_count, str(), 0
+        return ref_count, alt, alt_count
+
+    def block_record(self, chrom, start, end, ref, min_depth, band):
+        """
+        Create the gVCF line of a reference block. As with deepvariant, zero coverage blocks have a GQ of 1
+        """
+        quality = min(50, 3 * min_depth) if min_depth else 1
+        return '{chrom}\t{start}\t.\t{ref}\t<*>\t0\t.\tEND={end}\tGT:GQ:MIN_DP:PL\t0/0:{gq}:{min_dp}:0,{pl}\n' \
+            .format(chrom=chrom,
+                    start=start,
+                    ref=ref,
+                    end=end,
+                    gq=quality,
+                    min_dp=min_depth,
+                    pl='{gq},{pl}'.format(gq=quality, pl=10 * quality) if min_depth else '0,0')
+
+    def site_record(self, chrom, pos, ref, alt, ref_count, alt_count):
+        """
+        Create the gVCF line of a site with an alternate allele. The site is PASS if the alternate allele fraction is
+        at least min_alt_fraction, and RefCall otherwise
+        """
+        depth = ref_count + alt_count
+        fraction = alt_count / depth
+        called = fraction >= self.min_alt_fraction
+        # Phred-scaled support of the called genotype, capped in the same way as the deepvariant qualities
+        quality = min(99, 3 * abs(alt_count - ref_count))
+        return '{chrom}\t{pos}\t.\t{ref}\t{alt},<*>\t{qual}\t{filter}\t.\tGT:GQ:DP:AD:VAF:PL\t' \
+               '{gt}:{gq}:{depth}:{ref_count},{alt_count},0:{vaf:g},0:{pl},990,990,990\n' \
+            .format(chrom=chrom,
+                    pos=pos,
+                    ref=ref,
+                    alt=alt,
+                    qual=quality if called else 0,
+                    filter='PASS' if called else 'RefCall',
+                    gt='1/1' if called else '0/0',
+                    gq=quality,
+                    depth=depth,
+                    ref_count=ref_count,
+                    alt_count=alt_count,
+                    vaf=round(fraction, 6),
+                    pl='{q},{q},0'.format(q=10 * quality) if called else '0,{q},{q}'.format(q=10 * quality))
+
+    def __init__(self, min_alt_fraction=0.5, min_alt_depth=2, min_depth=10, min_base_quality=13,
+                 min_mapping_quality=0):
+        # Minimum fraction of the reads supporting an alternate base for it to be called (PASS)
+        self.min_alt_fraction = min_alt_fraction
+        # Minimum number of reads supporting an alternate base for the site to be reported (as PASS or RefCall)
+        self.min_alt_depth = min_alt_depth
+        # Reference blocks are split at this depth, so that low coverage regions have their own MIN_DP
+        self.min_depth = min_depth
+        self.min_base_quality = min_base_quality
+        self.min_mapping_quality = min_mapping_quality
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+from cowsnphr_src.feature_index import FeatureIndex
+from cowsnphr_src.tree_methods import TreeMethods
+from Bio.SeqFeature import BeforePosition, CompoundLocation, FeatureLocation, SeqFeature
+import pytest
+import json
+import gzip
+import os
+
+__author__ = 'adamkoziol'
+
+
+def create_features():
+    """
+    Create overlapping features: gene1 covers 10-50, and the later cds1 covers 30-40, so cds1 is returned for 30-40.
+    gene2 is on the negative strand, and is made up of two parts spanning 60-80
+    """
+    return [
+        SeqFeature(FeatureLocation(10, 50, strand=1), type='gene', qualifiers={'locus_tag': ['gene1']}),
+        SeqFeature(FeatureLocation(30, 40, strand=1), type='CDS', qualifiers={'locus_tag': ['cds1']}),
+        SeqFeature(CompoundLocation([FeatureLocation(BeforePosition(60), 65, strand=-1),
+                                     FeatureLocation(70, 80, strand=-1)]),
+                   type='gene', qualifiers={'locus_tag': ['gene2']})
+    ]
+
+
+def write_genbank(gbk_file, features):
+    """
+    Write a GenBank file of a 100 bp record named chrom containing a source feature, and the supplied features
+    :param gbk_file: type STR: Name and absolute path of the GenBank file
+    :param features: type LIST: List of feature type, GenBank location string, and locus tag
+    """
+    lines = ['LOCUS       chrom                    100 bp    DNA     linear   BCT 01-JAN-2020',
+             'DEFINITION  synthetic record.',
+             'ACCESSION   chrom',
+             'VERSION     chrom.1',
+             'FEATURES             Location/Qualifiers',
+             '     source          1..100']
+    for feature_type, location, tag in features:
+        lines.append('     {feature_type:<16}{location}'.format(feature_type=feature_type,
+                                                               location=location))
+        lines.append('                     /locus_tag="{tag}"'.format(tag=tag))
+    lines.append('ORIGIN')
+    for start in range(0, 100, 60):
+        lines.append('{pos:>9} {seq}'.format(pos=start + 1,
+                                             seq=' '.join(['a' * 10] * (min(60, 100 - start) // 10))))
+    lines.append('//')
+    with open(gbk_file, 'w') as gbk:
+        gbk.write('\n'.join(lines) + '\n')
+
+
+# GenBank representation of the features created by create_features
+GENBANK_FEATURES = [('gene', '11..50', 'gene1'),
+                    ('CDS', '31..40', 'cds1'),
+                    ('gene', 'complement(join(<61..65,71..80))', 'gene2')]
+
+
+def locus_tag(feature_index, pos):
+    return feature_index[pos].qualifiers['locus_tag'][0]
+
+
+def test_segments():
+    feature_index = FeatureIndex.from_features(create_features())
+    # The end positions of the segments are inclusive, and the positions between the parts of gene2 are covered
+    assert feature_index.starts.tolist() == [10, 30, 41, 60]
+    assert feature_index.ends.tolist() == [29, 40, 50, 80]
+    assert len(feature_index) == 20 + 11 + 10 + 21
+    assert list(feature_index)[:3] == [10, 11, 12]
+
+
+def test_lookup():
+    feature_index = FeatureIndex.from_features(create_features())
+    assert locus_tag(feature_index, 10) == 'gene1'
+    assert locus_tag(feature_index, 50) == 'gene1'
+    assert locus_tag(feature_index, 67) == 'gene2'
+    for pos in (0, 9, 51, 59, 81, 1000, -1):
+        assert pos not in feature_index
+        with pytest.raises(KeyError):
+            assert feature_index[pos]
+    # Positions that cannot be compared to the segments are not in the index
+    assert 'pos' not in feature_index
+
+
+def test_last_feature_wins():
+    features = create_features()
+    feature_index = FeatureIndex.from_features(features)
+    assert [locus_tag(feature_index, pos) for pos in (29, 30, 40, 41)] == ['gene1', 'cds1', 'cds1', 'gene1']
+    # When the overlapping features are in the opposite order, the larger feature covers all the positions, and the
+    # hidden feature is not stored
+    reordered_index = FeatureIndex.from_features([features[1], features[0], features[2]])
+    assert [locus_tag(reordered_index, pos) for pos in (29, 30, 40, 41)] == ['gene1'] * 4
+    assert [feature.qualifiers['locus_tag'][0] for feature in reordered_index.features] == ['gene1', 'gene2']
+
+
+def test_feature_indices():
+    feature_index = FeatureIndex.from_features(create_features())
+    positions = [5, 10, 35, 45, 55, 75]
+    feature_ids = feature_index.feature_indices(positions).tolist()
+    assert feature_ids[0] == -1 and feature_ids[4] == -1
+    for pos, feature_id in zip(positions, feature_ids):
+        if feature_id >= 0:
+            assert feature_index.features[feature_id] is feature_index[pos]
+
+
+def test_round_trip():
+    feature_index = FeatureIndex.from_features(create_features())
+    rebuilt_index = FeatureIndex.from_dict(json.loads(json.dumps(feature_index.to_dict())))
+    assert list(rebuilt_index) == list(feature_index)
+    for pos in feature_index:
+        assert str(rebuilt_index[pos].location) == str(feature_index[pos].location)
+        assert rebuilt_index[pos].qualifiers == feature_index[pos].qualifiers
+    # The fuzzy start position and the parts of the compound location are kept
+    location = rebuilt_index[60].location
+    assert isinstance(location, CompoundLocation)
+    assert isinstance(location.parts[0].start, BeforePosition)
+    assert location.strand == -1
+
+
+def test_load_feature_indices(tmp_path):
+    gbk_file = str(tmp_path / 'ref.gbk')
+    cache_file = str(tmp_path / 'ref_features.json.gz')
+    write_genbank(gbk_file, GENBANK_FEATURES)
+    record_indices = TreeMethods.load_feature_indices(gbk_file=gbk_file)
+    # The source feature is ignored
+    assert list(record_indices) == ['chrom']
+    assert record_indices['chrom'].starts.tolist() == [10, 30, 41, 60]
+    assert locus_tag(record_indices['chrom'], 35) == 'cds1'
+    assert os.path.isfile(cache_file)
+    assert not [file_name for file_name in os.listdir(str(tmp_path)) if file_name.endswith('.tmp')]
+
+
+def test_feature_cache_invalidation(tmp_path):
+    gbk_file = str(tmp_path / 'ref.gbk')
+    cache_file = str(tmp_path / 'ref_features.json.gz')
+    write_genbank(gbk_file, GENBANK_FEATURES)
+    TreeMethods.load_feature_indices(gbk_file=gbk_file)
+    # Modify the cache, so that it is possible to tell whether the cache or the GenBank file was used
+    with gzip.open(cache_file, 'rt') as cache:
+        cached = json.load(cache)
+    cached['records']['chrom']['features'][0]['qualifiers']['locus_tag'] = ['cached']
+    with gzip.open(cache_file, 'wt') as cache:
+        json.dump(cached, cache)
+    # The cache is used while the size and modification time of the GenBank file are unchanged
+    assert locus_tag(TreeMethods.load_feature_indices(gbk_file=gbk_file)['chrom'], 10) == 'cached'
+    # Updating the modification time of the GenBank file replaces the cache
+    gbk_stat = os.stat(gbk_file)
+    os.utime(gbk_file, ns=(gbk_stat.st_atime_ns, gbk_stat.st_mtime_ns + 10 ** 9))
+    assert locus_tag(TreeMethods.load_feature_indices(gbk_file=gbk_file)['chrom'], 10) == 'gene1'
+    with gzip.open(cache_file, 'rt') as cache:
+        assert json.load(cache)['mtime'] == os.stat(gbk_file).st_mtime_ns
+    # A GenBank file with different features is parsed again
+    write_genbank(gbk_file, GENBANK_FEATURES[:1])
+    assert locus_tag(TreeMethods.load_feature_indices(gbk_file=gbk_file)['chrom'], 35) == 'gene1'
+    # An unreadable cache is replaced
+    with open(cache_file, 'w') as cache:
+        cache.write('not a cache')
+    assert locus_tag(TreeMethods.load_feature_indices(gbk_file=gbk_file)['chrom'], 35) == 'gene1'
+    with gzip.open(cache_file, 'rt') as cache:
+        assert json.load(cache)['size'] == os.stat(gbk_file).st_size
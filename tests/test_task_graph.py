@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+from cowsnphr_src.task_graph import TaskGraph
+import pytest
+import time
+import os
+
+__author__ = 'adamkoziol'
+
+
+def write_file(path, contents):
+    with open(path, 'w') as output:
+        output.write(contents)
+
+
+def read_file(path):
+    with open(path, 'r') as input_file:
+        return input_file.read()
+
+
+def build_graph(tmp_path, calls, fail=False):
+    """
+    Create a graph of two tasks: copy reads input.txt and writes copy.txt, and upper reads copy.txt and writes
+    upper.txt. The names of the tasks are appended to calls when they are run
+    """
+    graph = TaskGraph(state_file=str(tmp_path / 'state.json'))
+    input_file = str(tmp_path / 'input.txt')
+    copy_file = str(tmp_path / 'copy.txt')
+    upper_file = str(tmp_path / 'upper.txt')
+
+    def copy():
+        calls.append('copy')
+        write_file(copy_file, read_file(input_file))
+        return copy_file
+
+    def upper():
+        calls.append('upper')
+        if fail:
+            raise RuntimeError('upper failed')
+        write_file(upper_file, read_file(copy_file).upper())
+        return upper_file
+    graph.add_task(name='copy',
+                   function=copy,
+                   inputs=[input_file],
+                   outputs=[copy_file],
+                   restore=lambda: copy_file)
+    graph.add_task(name='upper',
+                   function=upper,
+                   dependencies=['copy'],
+                   inputs=[copy_file],
+                   outputs=[upper_file],
+                   restore=lambda: upper_file)
+    return graph
+
+
+def test_run(tmp_path):
+    write_file(str(tmp_path / 'input.txt'), 'acgt')
+    calls = list()
+    graph = build_graph(tmp_path, calls)
+    assert graph.run(threads=2) == ['copy', 'upper']
+    assert calls == ['copy', 'upper']
+    assert read_file(str(tmp_path / 'upper.txt')) == 'ACGT'
+    assert graph.results == {'copy': str(tmp_path / 'copy.txt'),
+                             'upper': str(tmp_path / 'upper.txt')}
+    assert os.path.isfile(str(tmp_path / 'state.json'))
+
+
+def test_up_to_date(tmp_path):
+    write_file(str(tmp_path / 'input.txt'), 'acgt')
+    build_graph(tmp_path, list()).run()
+    calls = list()
+    graph = build_graph(tmp_path, calls)
+    assert graph.run() == []
+    assert calls == []
+    # The results of up to date tasks are restored
+    assert graph.results['upper'] == str(tmp_path / 'upper.txt')
+
+
+def test_resume_after_crash(tmp_path):
+    write_file(str(tmp_path / 'input.txt'), 'acgt')
+    calls = list()
+    with pytest.raises(RuntimeError):
+        build_graph(tmp_path, calls, fail=True).run()
+    assert calls == ['copy', 'upper']
+    # The completed task is recorded, so only the failed task is run on restart
+    calls = list()
+    assert build_graph(tmp_path, calls).run() == ['upper']
+    assert calls == ['upper']
+    assert read_file(str(tmp_path / 'upper.txt')) == 'ACGT'
+
+
+def test_stale_input(tmp_path):
+    write_file(str(tmp_path / 'input.txt'), 'acgt')
+    build_graph(tmp_path, list()).run()
+    # Changing the contents of an input makes the task, and every task that depends on it, out of date
+    write_file(str(tmp_path / 'input.txt'), 'ttaa')
+    calls = list()
+    assert build_graph(tmp_path, calls).run() == ['copy', 'upper']
+    assert calls == ['copy', 'upper']
+    assert read_file(str(tmp_path / 'upper.txt')) == 'TTAA'
+
+
+def test_modified_output(tmp_path):
+    write_file(str(tmp_path / 'input.txt'), 'acgt')
+    build_graph(tmp_path, list()).run()
+    # A modified output is recreated, and so are the outputs of the tasks that depend on it
+    write_file(str(tmp_path / 'copy.txt'), 'modified')
+    calls = list()
+    assert build_graph(tmp_path, calls).run() == ['copy', 'upper']
+    assert read_file(str(tmp_path / 'upper.txt')) == 'ACGT'
+
+
+def test_adopt_existing_outputs(tmp_path):
+    write_file(str(tmp_path / 'input.txt'), 'acgt')
+    write_file(str(tmp_path / 'copy.txt'), 'acgt')
+    calls = list()
+    # Outputs created before the state file existed are up to date
+    assert build_graph(tmp_path, calls).run() == ['upper']
+    assert calls == ['upper']
+
+
+def test_dry_run(tmp_path):
+    write_file(str(tmp_path / 'input.txt'), 'acgt')
+    calls = list()
+    assert build_graph(tmp_path, calls).run(dry_run=True) == ['copy', 'upper']
+    # Nothing is run or written
+    assert calls == []
+    assert sorted(os.listdir(str(tmp_path))) == ['input.txt']
+    build_graph(tmp_path, calls).run()
+    write_file(str(tmp_path / 'input.txt'), 'ttaa')
+    calls = list()
+    assert build_graph(tmp_path, calls).run(dry_run=True) == ['copy', 'upper']
+    assert calls == []
+    assert read_file(str(tmp_path / 'upper.txt')) == 'ACGT'
+
+
+def test_failure_waits_for_running_tasks(tmp_path):
+    graph = TaskGraph(state_file=str(tmp_path / 'state.json'))
+    slow_file = str(tmp_path / 'slow.txt')
+    calls = list()
+
+    def fail():
+        raise RuntimeError('fail')
+
+    def slow():
+        time.sleep(0.5)
+        write_file(slow_file, 'slow')
+        return slow_file
+    graph.add_task(name='slow',
+                   function=slow,
+                   outputs=[slow_file])
+    graph.add_task(name='fail',
+                   function=fail)
+    graph.add_task(name='later',
+                   function=lambda: calls.append('later'),
+                   dependencies=['slow'])
+    with pytest.raises(RuntimeError):
+        graph.run(threads=2)
+    # The running task completed and was recorded before the error was raised, and no new tasks were started
+    assert graph.results['slow'] == slow_file
+    assert 'slow' in graph.state['tasks']
+    assert calls == []
+
+
+def test_after(tmp_path):
+    write_file(str(tmp_path / 'input.txt'), 'acgt')
+    calls = list()
+    graph = build_graph(tmp_path, calls)
+    other_file = str(tmp_path / 'other.txt')
+
+    def other():
+        calls.append('other')
+        write_file(other_file, 'other')
+    graph.add_task(name='other',
+                   function=other,
+                   outputs=[other_file],
+                   after=['upper'])
+    graph.run(threads=3)
+    # The task is only started once the task it follows has completed
+    assert calls == ['copy', 'upper', 'other']
+    assert graph.timings['other'][0] >= graph.timings['upper'][1]
+    # Re-running the task it follows does not make the task out of date
+    write_file(str(tmp_path / 'input.txt'), 'ttaa')
+    graph = build_graph(tmp_path, list())
+    graph.add_task(name='other',
+                   function=other,
+                   outputs=[other_file],
+                   after=['upper'])
+    assert graph.run(dry_run=True) == ['copy', 'upper']
+
+
+def overlapping(graph, first, second):
+    return graph.timings[first][0] < graph.timings[second][1] and graph.timings[second][0] < graph.timings[first][1]
+
+
+def test_thread_budget(tmp_path):
+    graph = TaskGraph()
+    for name in ('a', 'b', 'c'):
+        graph.add_task(name=name,
+                       function=lambda: time.sleep(0.2),
+                       threads=2 if name != 'c' else 1)
+    graph.run(threads=3)
+    # The two tasks with two threads each do not fit in the budget together
+    assert not overlapping(graph, 'a', 'b')
+    assert overlapping(graph, 'a', 'c')
+
+
+def test_memory_budget(tmp_path):
+    graph = TaskGraph()
+    for name in ('a', 'b', 'c'):
+        graph.add_task(name=name,
+                       function=lambda: time.sleep(0.2),
+                       memory=100 if name != 'c' else (lambda: 50))
+    graph.run(threads=3,
+              max_memory=150)
+    assert not overlapping(graph, 'a', 'b')
+    assert overlapping(graph, 'a', 'c')
+
+
+def test_invalid_graph():
+    graph = TaskGraph()
+    graph.add_task(name='a',
+                   function=lambda: None,
+                   dependencies=['b'])
+    with pytest.raises(ValueError):
+        graph.add_task(name='a',
+                       function=lambda: None)
+    with pytest.raises(ValueError):
+        graph.run()
+    graph.add_task(name='b',
+                   function=lambda: None,
+                   dependencies=['a'])
+    with pytest.raises(ValueError):
+        graph.run()
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 from olctools.accessoryFunctions.accessoryFunctions import filer, make_path
 from cowsnphr_src.tree_methods import TreeMethods
+from cowsnphr_src.gvcf_store import PASS
 from cowsnphr_src.cowsnphr import COWSNPhR
+from Bio.SeqFeature import FeatureLocation
 from datetime import datetime
 import multiprocessing
 from glob import glob
@@ -79,6 +81,7 @@ species_group_num_snps = dict()
 species_group_sorted_snps = dict()
 translated_snp_residue_dict = dict()
 ref_translated_snp_residue_dict = dict()
+snp_matrix = dict()
 
 
 def test_invalid_path():
@@ -174,13 +177,38 @@ def test_gvcf_load():
         if strain_name != '13-1950':
             gvcf_vcf_dict[strain_name] = vcf_file
     strain_parsed_vcf_dict, strain_best_ref_dict, strain_best_ref_set_dict = \
-        TreeMethods.load_vcf(strain_vcf_dict=gvcf_vcf_dict)
+        TreeMethods.load_vcf(strain_vcf_dict=gvcf_vcf_dict,
+                             threads=threads)
     for strain_name, best_ref in strain_best_ref_dict.items():
         assert best_ref in ['NC_017250.1', 'NC_017251.1']
     assert strain_best_ref_set_dict['B13-0234'] == {'NC_017250.1', 'NC_017251.1'}
     with pytest.raises(KeyError):
         assert strain_parsed_vcf_dict['13-1941']
     assert strain_parsed_vcf_dict['B13-0235']['NC_017250.1'][8810]['QUAL'] == '70.1'
+    assert strain_parsed_vcf_dict['B13-0235']['NC_017250.1'].filter_at(8810) == PASS
+    assert strain_parsed_vcf_dict['B13-0237']['NC_017250.1'].is_deleted(58800)
+
+
+def test_gvcf_cache():
+    gvcf_vcf_dict = dict()
+    for strain_name, vcf_file in strain_vcf_dict.items():
+        if strain_name != '13-1950':
+            gvcf_vcf_dict[strain_name] = vcf_file
+    # The first call creates the cache files, and the second loads them
+    for _ in range(2):
+        cached_parsed_vcf_dict, cached_best_ref_dict, cached_best_ref_set_dict = \
+            TreeMethods.load_vcf(strain_vcf_dict=gvcf_vcf_dict,
+                                 threads=threads,
+                                 cache=True)
+        assert cached_best_ref_dict == strain_best_ref_dict
+        assert cached_best_ref_set_dict == strain_best_ref_set_dict
+        assert TreeMethods.summarise_gvcf_outputs(strain_parsed_vcf_dict=cached_parsed_vcf_dict) == \
+            TreeMethods.summarise_gvcf_outputs(strain_parsed_vcf_dict=strain_parsed_vcf_dict)
+        assert cached_parsed_vcf_dict['B13-0235']['NC_017250.1'][8810] == \
+            strain_parsed_vcf_dict['B13-0235']['NC_017250.1'][8810]
+    assert len(glob(os.path.join(file_path, '*_parsed.npz'))) == 5
+    for cache_file in glob(os.path.join(file_path, '*_parsed.npz')):
+        os.remove(cache_file)
 
 
 def test_summarise_vcf_outputs():
@@ -278,6 +306,11 @@ def test_density_filter_snps():
         assert 364560 in filtered_group_positions['species']['group']['NC_017250.1']
 
 
+def test_density_filter_snps_threads():
+    # The number of threads may be supplied as a string e.g. from the command line
+    assert TreeMethods.density_filter_snps(group_positions_set, threads='2') == filtered_group_positions
+
+
 def test_mask_ref_genome():
     global coords_dict
     coords_dict = TreeMethods.mask_ref_genome(reference_strain_dict, logfile)
@@ -300,6 +333,8 @@ def test_load_supplied_mask():
             maskfile=os.path.join(dependency_path, 'brucella/suis1/script_dependents/maskfile.bed'))
     assert 43351 in supplied_mask_pos_dict['B13-0234']['group']['NC_017250.1']
     assert 43355 not in supplied_mask_pos_dict['B13-0234']['group']['NC_017250.1']
+    assert supplied_mask_pos_dict['B13-0234']['group']['NC_017250.1'].contains([43351, 43355]).tolist() == \
+        [True, False]
 
 
 def test_filter_masked_snps():
@@ -361,6 +396,50 @@ def test_create_multifasta():
             assert os.path.getsize(fasta) > 100
 
 
+def test_changed_groups():
+    assert TreeMethods.changed_groups(previous_snp_sequence=group_strain_snp_sequence,
+                                      group_strain_snp_sequence=group_strain_snp_sequence) == {'species': set()}
+    # Removing a strain from the previous analysis is the same as adding it to the current analysis
+    previous_snp_sequence = {'species': {'group': {
+        strain_name: ref_dict for strain_name, ref_dict in group_strain_snp_sequence['species']['group'].items()
+        if strain_name != 'B13-0234'}}}
+    assert TreeMethods.changed_groups(previous_snp_sequence=previous_snp_sequence,
+                                      group_strain_snp_sequence=group_strain_snp_sequence) == {'species': {'group'}}
+
+
+def test_create_multifasta_changed_groups():
+    base_dict = dict()
+    for key, value in reference_link_dict.items():
+        base_dict[os.path.splitext(key)[0]] = value
+    fasta_file = group_fasta_dict['species']['group']
+    with open(fasta_file, 'r') as fasta:
+        alignment = fasta.read()
+    # A stand-in for the tree of the previous analysis
+    tree_file = os.path.join(os.path.dirname(fasta_file), 'best_tree.tre')
+    with open(tree_file, 'w') as tree:
+        tree.write('(A,B);')
+    mtime = os.stat(fasta_file).st_mtime_ns
+    # The alignment and tree of an unchanged group are left on disk
+    for changed_groups in ({'species': set()}, {'species': {'group'}}):
+        _, _, changed_fasta_dict = \
+            TreeMethods.create_multifasta(group_strain_snp_sequence=group_strain_snp_sequence,
+                                          fasta_path=fasta_path,
+                                          group_positions_set=group_positions_set,
+                                          strain_parsed_vcf_dict=strain_parsed_vcf_dict,
+                                          species_group_best_ref=species_group_best_ref,
+                                          reference_strain_dict=base_dict,
+                                          ident_group_positions=ident_group_positions,
+                                          changed_groups=changed_groups)
+        assert changed_fasta_dict == group_fasta_dict
+        if not changed_groups['species']:
+            assert os.stat(fasta_file).st_mtime_ns == mtime
+            assert os.path.isfile(tree_file)
+    # The alignment of a changed group is rewritten, rather than appended to, and its tree is removed
+    with open(fasta_file, 'r') as fasta:
+        assert fasta.read() == alignment
+    assert not os.path.isfile(tree_file)
+
+
 def test_run_fasttree():
     global species_group_trees
     species_group_trees = TreeMethods \
@@ -373,6 +452,22 @@ def test_run_fasttree():
             assert os.path.getsize(options_dict['best_tree']) > 100
 
 
+def test_run_fasttree_existing_trees(tmp_path):
+    # Groups without any strains are skipped, and existing trees are not recreated
+    group_fasta = dict()
+    for group in ('populated', 'empty'):
+        make_path(str(tmp_path / group))
+        group_fasta[group] = str(tmp_path / group / '{group}_alignment.fasta'.format(group=group))
+    best_tree = str(tmp_path / 'populated' / 'best_tree.tre')
+    with open(best_tree, 'w') as tree:
+        tree.write('(strain1,strain2);\n')
+    assert TreeMethods.run_fasttree(group_fasta_dict={'species': group_fasta},
+                                    strain_consolidated_ref_dict={'strain1': 'ref', 'strain2': 'ref'},
+                                    strain_groups={'strain1': ['populated'], 'strain2': ['populated']},
+                                    logfile=str(tmp_path / 'log')) == \
+        {'species': {'populated': {'best_tree': best_tree}}}
+
+
 def test_parse_tree_order():
     global species_group_order_dict
     species_group_order_dict = TreeMethods.parse_tree_order(species_group_trees=species_group_trees)
@@ -451,13 +546,167 @@ def test_determine_aa_sequence():
     assert ref_translated_snp_residue_dict['species']['group']['NC_017251.1'][2055257]['cds_strand'] == -1
 
 
+def test_determine_codon_effects():
+    species_group_codon_effects = \
+        TreeMethods.determine_codon_effects(
+            group_strain_snp_sequence=group_strain_snp_sequence,
+            species_group_best_ref=species_group_best_ref,
+            strain_parsed_vcf_dict=strain_parsed_vcf_dict,
+            species_group_annotated_snps_dict=species_group_annotated_snps_dict,
+            reference_strain_dict=reference_strain_dict,
+            species_group_snp_num_dict=species_group_snp_num_dict,
+            iupac=iupac,
+            threads=2)
+    codon_effects = species_group_codon_effects['species']['group']
+    row = list(zip(codon_effects['strain'], codon_effects['pos'])).index(('B13-0234', 1263210))
+    residue_dict = translated_snp_residue_dict['species']['group']['B13-0234']['NC_017251.1'][1263210]
+    assert codon_effects['ref_aa'][row] == 'L'
+    assert codon_effects['alt_aa'][row] == residue_dict['snp_aa_seq_cds']
+    assert codon_effects['effect'][row] == ('synonymous' if residue_dict['snp_aa_seq_cds'] == 'L' else
+                                            'stop' if residue_dict['snp_aa_seq_cds'] == '*' else 'nonsynonymous')
+
+
+def test_group_codon_effects_incomplete_codon(tmp_path):
+    # A coding sequence of three complete codons followed by an incomplete final codon
+    ref_fasta = str(tmp_path / 'ref.fasta')
+    with open(ref_fasta, 'w') as fasta:
+        fasta.write('>chrom\nATGAAATTTGC\n')
+    positions = [2, 9, 11]
+    annotation = {'location': FeatureLocation(0, 11, strand=1),
+                  'product': 'hypothetical protein'}
+    codon_effects = TreeMethods.group_codon_effects(
+        species='species',
+        group='group',
+        strain_dict={'strain': {'chrom': {pos: 'C' for pos in positions}},
+                     'ref': {'chrom': {pos: 'A' for pos in positions}}},
+        species_group_best_ref={'species': {'group': 'ref'}},
+        strain_parsed_vcf_dict=dict(),
+        species_group_annotated_snps_dict={'species': {'group': {'chrom': {pos: annotation for pos in positions}}}},
+        reference_strain_dict={'ref': ref_fasta},
+        species_group_snp_num_dict={'species': {'group': {'chrom': {pos: 1 for pos in positions}}}},
+        iupac=dict())
+    # Only the SNP in a complete codon (AAA > CAA) is included. The SNPs in the incomplete final codon and beyond the
+    # end of the coding sequence are treated as non-coding
+    assert codon_effects['pos'].tolist() == [2]
+    assert codon_effects['ref_codon'].tolist() == ['AAA']
+    assert codon_effects['alt_codon'].tolist() == ['CAA']
+    assert codon_effects['effect'].tolist() == ['nonsynonymous']
+
+
+def test_determine_codon_effects_processes(tmp_path):
+    # The groups are processed in a multiprocessing pool when more than one thread is requested
+    ref_fasta = str(tmp_path / 'ref.fasta')
+    with open(ref_fasta, 'w') as fasta:
+        fasta.write('>chrom\nATGAAATTTGC\n')
+    annotation = {'location': FeatureLocation(0, 11, strand=1),
+                  'product': 'hypothetical protein'}
+    group_positions = {'group1': [2, 5], 'group2': [4, 6]}
+    arguments = dict(
+        group_strain_snp_sequence={'species': {group: {'strain': {'chrom': {pos: 'C' for pos in positions}},
+                                                       'ref': {'chrom': {pos: 'A' for pos in positions}}}
+                                               for group, positions in group_positions.items()}},
+        species_group_best_ref={'species': {group: 'ref' for group in group_positions}},
+        strain_parsed_vcf_dict=dict(),
+        species_group_annotated_snps_dict={'species': {group: {'chrom': {pos: annotation for pos in positions}}
+                                                       for group, positions in group_positions.items()}},
+        reference_strain_dict={'ref': ref_fasta},
+        species_group_snp_num_dict={'species': {group: {'chrom': {pos: 1 for pos in positions}}
+                                                for group, positions in group_positions.items()}},
+        iupac=dict())
+    serial = TreeMethods.determine_codon_effects(threads=1, **arguments)
+    parallel = TreeMethods.determine_codon_effects(threads=2, **arguments)
+    for group, positions in group_positions.items():
+        assert parallel['species'][group]['pos'].tolist() == positions
+        for column, values in serial['species'][group].items():
+            assert parallel['species'][group][column].tolist() == values.tolist()
+    assert parallel['species']['group1']['alt_codon'].tolist() == ['CAA', 'CTT']
+
+
 def test_create_snp_matrix():
-    TreeMethods.create_snp_matrix(species_group_best_ref=species_group_best_ref,
-                                  group_strain_snp_sequence=group_strain_snp_sequence,
-                                  matrix_path=matrix_path)
+    global snp_matrix
+    snp_matrix = TreeMethods.create_snp_matrix(species_group_best_ref=species_group_best_ref,
+                                               group_strain_snp_sequence=group_strain_snp_sequence,
+                                               matrix_path=matrix_path)
     assert os.path.isfile(os.path.join(matrix_path, 'snv_matrix.tsv'))
 
 
+def test_create_snp_matrix_threads():
+    # The number of threads may be supplied as a string e.g. from the command line
+    assert TreeMethods.create_snp_matrix(species_group_best_ref=species_group_best_ref,
+                                         group_strain_snp_sequence=group_strain_snp_sequence,
+                                         matrix_path=matrix_path,
+                                         threads='2') == snp_matrix
+
+
+def test_create_snp_matrix_memmap():
+    # Alignments larger than max_memory are stored in a memory-mapped file, which is removed once the SNPs are counted
+    assert TreeMethods.create_snp_matrix(species_group_best_ref=species_group_best_ref,
+                                         group_strain_snp_sequence=group_strain_snp_sequence,
+                                         matrix_path=matrix_path,
+                                         threads=2,
+                                         chunk_size=10,
+                                         max_memory=1) == snp_matrix
+    assert not glob(os.path.join(matrix_path, '*_alignment.dat'))
+
+
+def test_encode_snp_alignment_memmap(tmp_path):
+    strain_dict = {'ref': {'chrom': {1: 'A', 5: 'C', 9: 'G'}},
+                   'strain1': {'chrom': {1: 'T', 5: 'C'}},
+                   'strain2': {'chrom': {9: 'T'}}}
+    memmap_file = str(tmp_path / 'alignment.dat')
+    strain_names, alignment = TreeMethods.encode_snp_alignment(strain_dict=strain_dict)
+    _, mapped = TreeMethods.encode_snp_alignment(strain_dict=strain_dict,
+                                                 max_memory=1,
+                                                 memmap_file=memmap_file)
+    assert os.path.isfile(memmap_file)
+    assert mapped.tolist() == alignment.tolist()
+    pairwise_snps = TreeMethods.pairwise_snp_counts(alignment=mapped,
+                                                    ref_row=strain_names.index('ref'),
+                                                    chunk_size=2)
+    assert pairwise_snps.tolist() == TreeMethods.pairwise_snp_counts(alignment=alignment,
+                                                                     ref_row=0).tolist()
+    # strain1 differs from the reference at position 1, and strain2 at position 9. Position 5 of strain2 is not
+    # stored, so the reference sequence is used
+    assert pairwise_snps[strain_names.index('strain1'), strain_names.index('ref')] == 1
+    assert pairwise_snps[strain_names.index('strain1'), strain_names.index('strain2')] == 1
+    assert pairwise_snps[strain_names.index('strain2'), strain_names.index('strain1')] == 1
+
+
+def test_analysis_state():
+    state_file = os.path.join(matrix_path, 'analysis_state.json.gz')
+    TreeMethods.save_analysis_state(state_file=state_file,
+                                    strain_names=list(strain_parsed_vcf_dict),
+                                    group_positions_set=filtered_group_positions,
+                                    group_strain_snp_sequence=group_strain_snp_sequence,
+                                    snp_matrix=snp_matrix)
+    previous_strains, previous_group_positions, previous_snp_sequence, previous_snp_matrix = \
+        TreeMethods.load_analysis_state(state_file=state_file)
+    assert previous_strains == set(strain_parsed_vcf_dict)
+    assert previous_group_positions == filtered_group_positions
+    assert previous_snp_sequence == group_strain_snp_sequence
+    assert previous_snp_matrix == snp_matrix
+
+
+def test_update_snp_matrix():
+    with open(os.path.join(matrix_path, 'snv_matrix.tsv'), 'r') as matrix_file:
+        matrix = matrix_file.read()
+    # Remove the positions on one chromosome from the previous analysis, so that the counts must be updated
+    previous_snp_sequence = {'species': {'group': {
+        strain_name: {ref_chrom: pos_dict for ref_chrom, pos_dict in ref_dict.items() if ref_chrom != 'NC_017250.1'}
+        for strain_name, ref_dict in group_strain_snp_sequence['species']['group'].items()}}}
+    previous_snp_matrix = TreeMethods.create_snp_matrix(species_group_best_ref=species_group_best_ref,
+                                                        group_strain_snp_sequence=previous_snp_sequence,
+                                                        matrix_path=matrix_path)
+    updated_snp_matrix = TreeMethods.update_snp_matrix(previous_snp_matrix=previous_snp_matrix,
+                                                       previous_snp_sequence=previous_snp_sequence,
+                                                       species_group_best_ref=species_group_best_ref,
+                                                       group_strain_snp_sequence=group_strain_snp_sequence,
+                                                       matrix_path=matrix_path)
+    assert updated_snp_matrix == snp_matrix
+    with open(os.path.join(matrix_path, 'snv_matrix.tsv'), 'r') as matrix_file:
+        assert matrix_file.read() == matrix
+
+
 def test_rank_snps():
     global species_group_snp_rank, species_group_num_snps
     species_group_snp_rank, species_group_num_snps \
@@ -515,6 +764,42 @@ def test_create_aa_summary_table():
     assert os.path.isfile(os.path.join(summary_path, 'aa_snv_sorted_table.xlsx')) == 1
 
 
+@pytest.mark.parametrize('molecule,rows', [
+    ('nt', [['ref', 'A', 'G'], ['strain1', 'T', 'G'], ['strain2', 'A', 'R']]),
+    ('aa', [['ref', 'M', 'NC'], ['strain1', 'L', '-'], ['strain2', '-', '-']])
+])
+def test_create_summary_table_tsv(tmp_path, molecule, rows):
+    annotations = {5: {'product': 'product1', 'gene': 'gene1', 'locus': 'locus1'},
+                   10: {'product': 'product2', 'gene': 'gene2', 'locus': 'locus2'}}
+    arguments = dict(
+        species_group_sorted_snps={'species': {'group': {2: {'chrom': [5, 10]}}}},
+        species_group_order_dict={'species': {'group': ['ref', 'strain1', 'strain2']}},
+        species_group_best_ref={'species': {'group': 'ref'}},
+        group_strain_snp_sequence={'species': {'group': {'ref': {'chrom': {5: 'A', 10: 'G'}},
+                                                         'strain1': {'chrom': {5: 'T'}},
+                                                         'strain2': {'chrom': {10: 'R'}}}}},
+        species_group_annotated_snps_dict={'species': {'group': {'chrom': annotations}}},
+        translated_snp_residue_dict={'species': {'group': {'strain1': {'chrom': {5: {'snp_aa_seq_cds': 'L'}}},
+                                                           'strain2': {'chrom': dict()}}}},
+        ref_translated_snp_residue_dict={'species': {'group': {'chrom': {5: {'ref_aa_seq_cds': 'M'}}}}},
+        species_group_num_snps={'species': {'group': 2}},
+        summary_path=str(tmp_path),
+        molecule=molecule)
+    # Tables with more than max_cells cells are written as tab-delimited files rather than Excel workbooks
+    summary_tables = TreeMethods.create_summary_table(max_cells=1, **arguments)
+    summary_table = str(tmp_path / '{molecule}_snv_sorted_table.tsv'.format(molecule=molecule))
+    assert summary_tables == [summary_table]
+    with open(summary_table, 'r') as summary:
+        assert [line.rstrip('\n').split('\t') for line in summary] == \
+            [['Strain', 'chrom_5', 'chrom_10']] + rows + \
+            [['Annotation', 'product1;gene1;locus1', 'product2;gene2;locus2']]
+    os.remove(summary_table)
+    # Smaller tables are written as Excel workbooks
+    assert TreeMethods.create_summary_table(**arguments) == \
+        [str(tmp_path / '{molecule}_snv_sorted_table.xlsx'.format(molecule=molecule))]
+    assert not os.path.isfile(summary_table)
+
+
 def test_folder_prep():
     global deep_variant_path
     # Set the name, and create folders to hold VCF files for the test run of the pipeline
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 from olctools.accessoryFunctions.accessoryFunctions import filer, make_path
-from cowsnphr_src.vcf_methods import VCFMethods
+from cowsnphr_src.vcf_methods import DeepVariantWorker, PileupCaller, VCFMethods
+from cowsnphr_src.tree_methods import TreeMethods
+from cowsnphr_src.gvcf_store import PASS
 from datetime import datetime
 from pathlib import Path
 import multiprocessing
@@ -429,6 +431,89 @@ def test_deepvariant_postprocess_variants():
         assert strain_vcf_dict['NC_002695']
 
 
+def test_pileup_caller():
+    pileup_gvcf = os.path.join(strain_name_dict['13-1941'], 'pileup', '13-1941.gvcf.gz')
+    gvcf_file = PileupCaller().call_strain(strain_name='13-1941',
+                                           sorted_bam=strain_sorted_bam_dict['13-1941'],
+                                           ref_fasta=strain_reference_abs_path_dict['13-1941'],
+                                           gvcf_file=pileup_gvcf,
+                                           logfile=logfile)
+    pileup_store, best_ref, best_ref_set = TreeMethods.load_vcf_strain(strain_name='13-1941',
+                                                                       vcf_file=gvcf_file)
+    # The records must be on the contigs of the reference genome of the strain
+    with open(strain_reference_abs_path_dict['13-1941'] + '.fai', 'r') as fai:
+        contigs = {line.split('\t')[0] for line in fai}
+    assert best_ref_set and best_ref_set <= contigs
+    assert sum(len(chrom_calls) for chrom_calls in pileup_store.values()) > 0
+    # Compare the substitutions with those called by deepvariant in test_deepvariant_postprocess_variants
+    deepvariant_store, _, _ = TreeMethods.load_vcf_strain(strain_name='13-1941',
+                                                          vcf_file=strain_vcf_dict['13-1941'])
+    snps = [(chrom, pos, chrom_calls[pos]['ALT'].split(',')[0])
+            for chrom, chrom_calls in deepvariant_store.items()
+            for pos in chrom_calls.filter_positions(PASS).tolist()
+            if len(chrom_calls[pos]['ALT'].split(',')[0]) == 1]
+    assert snps
+    called = [(chrom, pos, alt) for chrom, pos, alt in snps
+              if chrom in pileup_store and pos in pileup_store[chrom]
+              and pileup_store[chrom][pos]['FILTER'] == 'PASS'
+              and pileup_store[chrom][pos]['ALT'].split(',')[0] == alt]
+    # The first deepvariant substitution is called with the same alternate allele
+    assert snps[0] in called
+    assert len(called) >= 0.9 * len(snps)
+
+
+def test_deepvariant_worker_local(tmp_path):
+    # The local stand-in runs the commands on the host, so no container is started
+    worker = DeepVariantWorker(home=home,
+                               deepvariant_version=deepvariant_version,
+                               logfile=str(tmp_path / 'log'),
+                               local=True)
+    for strain_name in ('strain_a', 'strain_b'):
+        for phase in ('make_examples', 'call_variants'):
+            out, err = worker.run(command='echo {phase} {sn}'.format(phase=phase,
+                                                                     sn=strain_name),
+                                  strain_name=strain_name,
+                                  phase=phase)
+            assert out == '{phase} {sn}\n'.format(phase=phase,
+                                                  sn=strain_name)
+    assert not worker.started and not worker.cold
+    report_file = str(tmp_path / 'log_deepvariant_times.txt')
+    worker.stop(report_file=report_file)
+    with open(report_file, 'r') as report:
+        lines = report.read().splitlines()
+    assert lines[0] == 'Phase\tStrain\tSeconds'
+    assert [line.split('\t')[:2] for line in lines[1:]] == \
+        [['make_examples', 'strain_a'], ['call_variants', 'strain_a'],
+         ['make_examples', 'strain_b'], ['call_variants', 'strain_b']]
+    assert all(float(line.split('\t')[2]) >= 0 for line in lines[1:])
+    # The timings are only reported once
+    worker.stop(report_file=report_file)
+    with open(report_file, 'r') as report:
+        assert len(report.read().splitlines()) == 5
+
+
+def test_deepvariant_worker_fallback(tmp_path):
+    worker = DeepVariantWorker(home=home,
+                               deepvariant_version=deepvariant_version,
+                               logfile=str(tmp_path / 'log'))
+    # Use echo as a stand-in for docker: the container is never reported as running, so every job must be run with
+    # docker run --rm instead of docker exec
+    worker.docker = 'echo'
+    out, err = worker.run(command='/opt/deepvariant/bin/call_variants',
+                          strain_name='strain_a',
+                          phase='call_variants')
+    assert worker.cold and not worker.started
+    assert out == 'run --rm -v {home}:{home} google/deepvariant:{dvv} /opt/deepvariant/bin/call_variants\n' \
+        .format(home=home,
+                dvv=deepvariant_version)
+    report_file = str(tmp_path / 'log_deepvariant_times.txt')
+    worker.stop(report_file=report_file)
+    with open(report_file, 'r') as report:
+        lines = report.read().splitlines()
+    assert lines[1].startswith('call_variants\tstrain_a\t')
+    assert lines[-1] == '# The deepvariant container could not be started. Each job was run in a new container'
+
+
 def test_copy_test_vcf_files():
     """
     Copy VCF files from test folder to supplement the lone deepvariant-created VCF file. Populate the strain_vcf_dict